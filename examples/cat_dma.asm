@@ -0,0 +1,13 @@
+start:
+       addi $1, $0, buffer
+       sw $1, $0, dma_addr
+loop:
+       addi $2, $0, 64
+       sw $2, $0, dma_in
+       lw $2, $0, dma_in
+       beq $2, $0, break
+       sw $2, $0, dma_out
+       beq $0, $0, loop
+break:
+       halt
+buffer: "................................................................"
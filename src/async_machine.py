@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import asyncio
+import collections
+from typing import Final, NamedTuple, Optional, Protocol
+
+import isa
+from costs import limits
+from devices import InputStarvedError
+from machine import ControlUnit, DataPath, at_access, memory_accesses
+from microcode import PROFILES
+
+SLICE_TICKS: Final[int] = 10_000
+_DMA_IN: Final[int] = isa.PREDEFINED_LABELS["dma_in"]
+
+
+class AsyncSink(Protocol):
+    async def write(self, text: str) -> None: ...
+
+
+class SessionResult(NamedTuple):
+    ticks: int
+    instructions: int
+    halted: bool
+
+
+class AsyncInput:
+    """Input that arrives while the program runs; `close` ends it with a terminating zero like `StreamInput`"""
+
+    pos: int
+    _buffer: collections.deque[int]
+    _closed: bool
+    ended: bool
+    _arrived: asyncio.Event
+
+    def __init__(self) -> None:
+        self.pos = 0
+        self._buffer = collections.deque()
+        self._closed = False
+        self.ended = False
+        self._arrived = asyncio.Event()
+
+    def feed(self, text: str) -> None:
+        assert not self._closed, "Input is already closed"
+        self._buffer.extend(ord(char) for char in text)
+        self._arrived.set()
+
+    def close(self) -> None:
+        self._closed = True
+        self._arrived.set()
+
+    def available(self) -> bool:
+        """Whether `read` returns without starving; reading past the end of closed input still fails"""
+        return len(self._buffer) > 0 or self._closed
+
+    async def wait(self) -> None:
+        while not self.available():
+            self._arrived.clear()
+            await self._arrived.wait()
+
+    def read(self) -> int:
+        if len(self._buffer) > 0:
+            self.pos += 1
+            return self._buffer.popleft()
+        if not self._closed:
+            raise InputStarvedError
+        assert not self.ended, "Read from empty input buffer"
+        self.ended = True
+        return 0
+
+    def skip(self, count: int, *, ended: bool = False) -> None:
+        assert count <= len(self._buffer), "Skip past the input that arrived"
+        for _ in range(count):
+            self.read()
+        if ended:
+            self.read()
+            assert self.ended, "Skip past the end of input"
+
+
+class PendingOutput:
+    """Collects output between slices, so it can be pushed to an `AsyncSink` in one piece"""
+
+    written: int
+    _chars: list[str]
+
+    def __init__(self) -> None:
+        self.written = 0
+        self._chars = []
+
+    def write(self, char: int) -> None:
+        self._chars.append(chr(char))
+        self.written += 1
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> str:
+        text = "".join(self._chars)
+        self._chars = []
+        return text
+
+
+class AsyncControlUnit(ControlUnit):
+    """`ControlUnit` that raises `InputStarvedError` before a microinstruction that would wait for input.
+
+    The check runs before anything changes, so the same microinstruction simply runs again once
+    input arrives. Only microinstructions that access memory are checked, and only with AR as it
+    will be at the access: the fetch writes AR in the same microinstruction it reads memory.
+    """
+
+    _input: AsyncInput
+    _accessing: frozenset[int]
+
+    def __init__(self, microcode: list[isa.MInstruction], data_path: DataPath, input_device: AsyncInput) -> None:
+        super().__init__(microcode, data_path)
+        self._input = input_device
+        self._accessing = memory_accesses(microcode)
+
+    def execute_microinstruction(self) -> None:
+        if self.mpc in self._accessing and not self._input.available() and self._waits_for_input():
+            raise InputStarvedError
+        super().execute_microinstruction()
+
+    def _waits_for_input(self) -> bool:
+        minstr = self.microcode[self.mpc]
+        assert isinstance(minstr, isa.MIOperation)
+        address = at_access(minstr, self.data_path.registers, isa.AR)
+        return (minstr.mem_rd and address == isa.INPUT_DEVICE_ADDR) or (minstr.mem_wr and address == _DMA_IN)
+
+
+async def simulate_async(
+    program: isa.LoadableProgram,
+    input_device: AsyncInput,
+    sink: AsyncSink,
+    profile: str = "classic",
+    *,
+    slice_ticks: int = SLICE_TICKS,
+    max_ticks: Optional[int] = None,
+    max_instructions: Optional[int] = None,
+) -> SessionResult:
+    """Runs `program` in slices of `slice_ticks`, yielding to the event loop between them and
+    awaiting `input_device` whenever the program needs input that has not arrived yet.
+
+    Output is pushed to `sink` after every slice and before waiting for input, so a prompt
+    reaches the user before the program blocks on the answer. Counters match `simulation` for
+    the same input, however it was split.
+    """
+    assert profile in PROFILES, f"Unknown microcode profile '{profile}'"
+    output_device = PendingOutput()
+    unit = AsyncControlUnit(PROFILES[profile], DataPath(program, input_device, output_device), input_device)
+    tick_limit, instruction_limit = limits(max_ticks, max_instructions)
+    halted = False
+    while not halted:
+        try:
+            halted = unit.run(min(tick_limit, unit.ticks + slice_ticks), max_instructions)
+        except InputStarvedError:
+            await _push(sink, output_device)
+            await input_device.wait()
+            continue
+        await _push(sink, output_device)
+        if unit.ticks >= tick_limit or (unit.mpc == 0 and unit.instructions >= instruction_limit):
+            break
+        await asyncio.sleep(0)
+    return SessionResult(unit.ticks, unit.instructions, halted)
+
+
+async def _push(sink: AsyncSink, output_device: PendingOutput) -> None:
+    text = output_device.take()
+    if len(text) > 0:
+        await sink.write(text)
@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import asyncio
+import pathlib
+
+import pytest
+
+import async_machine
+import machine
+import translator
+
+_EXAMPLES = pathlib.Path(__file__).parent.parent / "examples"
+
+
+class _Collector:
+    def __init__(self) -> None:
+        self.parts: list[str] = []
+        self.written = asyncio.Event()
+
+    async def write(self, text: str) -> None:
+        self.parts.append(text)
+        self.written.set()
+
+
+async def _session(name: str, delay: float, profile: str) -> tuple[list[str], async_machine.SessionResult]:
+    program = translator.parse((_EXAMPLES / "hello_user_name.asm").read_text())
+    input_device = async_machine.AsyncInput()
+    sink = _Collector()
+    session = asyncio.create_task(async_machine.simulate_async(program, input_device, sink, profile, slice_ticks=500))
+    for char in name:
+        await asyncio.sleep(delay)
+        input_device.feed(char)
+    input_device.close()
+    return sink.parts, await session
+
+
+@pytest.mark.parametrize("profile", ["classic", "optimized"])
+def test_concurrent_sessions_match_batch_runs(profile: str) -> None:
+    names = [f"user {n}\n" for n in range(50)]
+
+    async def main() -> list[tuple[list[str], async_machine.SessionResult]]:
+        return await asyncio.gather(*(_session(name, 0.001 * (n % 3), profile) for n, name in enumerate(names)))
+
+    program = translator.parse((_EXAMPLES / "hello_user_name.asm").read_text())
+    for name, (parts, result) in zip(names, asyncio.run(main())):
+        expected = machine.simulation(program, [ord(c) for c in name] + [0], profile=profile)
+        assert "".join(parts) == expected.output
+        assert result == (expected.ticks, expected.instructions, expected.halted)
+
+
+def test_prompt_is_pushed_before_waiting_for_input() -> None:
+    async def main() -> list[str]:
+        program = translator.parse((_EXAMPLES / "hello_user_name.asm").read_text())
+        input_device = async_machine.AsyncInput()
+        sink = _Collector()
+        session = asyncio.create_task(async_machine.simulate_async(program, input_device, sink))
+        await sink.written.wait()
+        prompt = list(sink.parts)
+        input_device.feed("Alice\n")
+        input_device.close()
+        await session
+        return prompt
+
+    assert asyncio.run(main()) == ["What is your name?\n"]
+
+
+def test_budget_stops_session() -> None:
+    program = translator.parse("start: beq $0, $0, start\n")
+
+    result = asyncio.run(
+        async_machine.simulate_async(program, async_machine.AsyncInput(), _Collector(), max_ticks=1234)
+    )
+
+    assert result == (1234, result.instructions, False)
+
+
+def test_reading_past_closed_input_fails() -> None:
+    program = translator.parse("start:\n lw $1, $0, input\n beq $0, $0, start\n")
+    input_device = async_machine.AsyncInput()
+    input_device.close()
+
+    with pytest.raises(AssertionError, match="Read from empty input buffer"):
+        asyncio.run(async_machine.simulate_async(program, input_device, _Collector()))
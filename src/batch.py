@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import argparse
+import collections
+import concurrent.futures
+import json
+import os
+import sys
+import time
+from typing import Final, Iterable, Iterator, NamedTuple, Optional
+
+import isa
+import machine
+from microcode import PROFILES
+
+CHUNKS_PER_WORKER: Final[int] = 4
+CACHED_PROGRAMS: Final[int] = 64
+
+
+class Job(NamedTuple):
+    program: str
+    input: str
+
+
+class JobResult(NamedTuple):
+    job: Job
+    output: str
+    ticks: int
+    instructions: int
+    halted: bool
+    error: Optional[str]
+
+
+class Settings(NamedTuple):
+    engine: str = "microcode"
+    profile: str = "classic"
+    max_ticks: Optional[int] = None
+    max_instructions: Optional[int] = None
+
+
+class Summary(NamedTuple):
+    jobs: int
+    failed: int
+    stopped: int
+    ticks: int
+    instructions: int
+
+
+_settings = Settings()
+_programs: collections.OrderedDict[str, isa.LoadableProgram] = collections.OrderedDict()
+
+
+def _init_worker(settings: Settings) -> None:
+    global _settings
+    _settings = settings
+    _programs.clear()
+
+
+def _program(path: str) -> isa.LoadableProgram:
+    """Loads a program file once per worker and keeps the last `CACHED_PROGRAMS` by path"""
+    program = _programs.get(path)
+    if program is not None:
+        _programs.move_to_end(path)
+        return program
+    program = _programs[path] = isa.load_program(path)
+    if len(_programs) > CACHED_PROGRAMS:
+        _programs.popitem(last=False)
+    return program
+
+
+def run_job(job: Job) -> JobResult:
+    """Runs in a worker process; each program is loaded once per worker and reused for later jobs"""
+    try:
+        program = _program(job.program)
+        with open(job.input, encoding="ascii") as f:
+            input_buffer = [ord(char) for char in f.read()] + [0]
+        result = machine.simulation(
+            program,
+            input_buffer,
+            _settings.engine,
+            _settings.profile,
+            max_ticks=_settings.max_ticks,
+            max_instructions=_settings.max_instructions,
+        )
+    except Exception as e:  # a failing job is reported and must not stop the batch
+        return JobResult(job, "", 0, 0, False, f"{type(e).__name__}: {e}")
+    return JobResult(job, result.output, result.ticks, result.instructions, result.halted, None)
+
+
+def run_batch(jobs: list[Job], settings: Settings, workers: Optional[int] = None) -> Iterator[JobResult]:
+    """Yields results in the order of `jobs` as soon as they and all preceding ones are done"""
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, len(jobs) // (workers * CHUNKS_PER_WORKER))
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(settings,)) as pool:
+        yield from pool.map(run_job, jobs, chunksize=chunksize)
+
+
+def summarize(results: Iterable[JobResult]) -> Summary:
+    finished = list(results)
+    return Summary(
+        jobs=len(finished),
+        failed=sum(result.error is not None for result in finished),
+        stopped=sum(result.error is None and not result.halted for result in finished),
+        ticks=sum(result.ticks for result in finished),
+        instructions=sum(result.instructions for result in finished),
+    )
+
+
+def _jobs(args: argparse.Namespace) -> list[Job]:
+    if args.pairs:
+        assert len(args.files) % 2 == 0, "Expected program and input file pairs"
+        return [Job(program, inp) for program, inp in zip(args.files[::2], args.files[1::2])]
+    program, *inputs = args.files
+    return [Job(program, inp) for inp in inputs]
+
+
+def _report(results: Iterable[JobResult]) -> Iterator[JobResult]:
+    for result in results:
+        record = {"program": result.job.program, "input": result.job.input, **result._asdict()}
+        del record["job"]
+        print(json.dumps(record), flush=True)
+        yield result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate many inputs or program/input pairs in parallel")
+    parser.add_argument("files", nargs="+", help="a program followed by input files, or pairs with --pairs")
+    parser.add_argument("--pairs", action="store_true", help="treat files as program and input pairs")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--engine", choices=machine.ENGINES, default="microcode")
+    parser.add_argument("--microcode", choices=PROFILES.keys(), default="classic")
+    parser.add_argument("--max-ticks", type=int, metavar="N", help="stop each job once N ticks are executed")
+    parser.add_argument("--max-instructions", type=int, metavar="N", help="stop each job after N instructions")
+    args = parser.parse_args()
+    settings = Settings(args.engine, args.microcode, args.max_ticks, args.max_instructions)
+    begin = time.perf_counter()
+    summary = summarize(_report(run_batch(_jobs(args), settings, args.jobs)))
+    print(
+        f"jobs: {summary.jobs}, failed: {summary.failed}, stopped by budget: {summary.stopped}, "
+        f"ticks: {summary.ticks}, instructions: {summary.instructions}, "
+        f"elapsed: {time.perf_counter() - begin:.2f}s",
+        file=sys.stderr,
+    )
+    sys.exit(1 if summary.failed > 0 else 0)
@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+import os
+import pathlib
+
+import batch
+import machine
+import translator
+
+_EXAMPLES = pathlib.Path(__file__).parent.parent / "examples"
+
+
+def test_batch_matches_single_runs(tmp_path: os.PathLike[str]) -> None:
+    program = os.path.join(tmp_path, "cat.json")
+    translator.main(str(_EXAMPLES / "cat.asm"), program)
+    texts = [f"input number {n}\n" * n for n in range(12)]
+    jobs = []
+    for n, text in enumerate(texts):
+        path = os.path.join(tmp_path, f"{n}.txt")
+        with open(path, "w") as f:
+            f.write(text)
+        jobs.append(batch.Job(program, path))
+    jobs.append(batch.Job(program, os.path.join(tmp_path, "missing.txt")))
+
+    results = list(batch.run_batch(jobs, batch.Settings(engine="functional"), workers=3))
+
+    assert [result.job for result in results] == jobs
+    for text, result in zip(texts, results):
+        expected = machine.simulation(
+            translator.parse((_EXAMPLES / "cat.asm").read_text()), [ord(c) for c in text] + [0]
+        )
+        assert (result.output, result.ticks, result.instructions, result.error) == (*expected[:3], None)
+    assert results[-1].error is not None
+    assert results[-1].error.startswith("FileNotFoundError")
+    summary = batch.summarize(results)
+    assert (summary.jobs, summary.failed, summary.stopped) == (13, 1, 0)
+
+
+def test_programs_are_cached_by_path(tmp_path: os.PathLike[str]) -> None:
+    paths = [os.path.join(tmp_path, f"{n}.json") for n in range(batch.CACHED_PROGRAMS + 1)]
+    for path in paths:
+        translator.main(str(_EXAMPLES / "hello.asm"), path)
+    batch._programs.clear()
+
+    first = batch._program(paths[0])
+    assert batch._program(paths[0]) is first
+    for path in paths[1:]:
+        batch._program(path)
+    assert len(batch._programs) == batch.CACHED_PROGRAMS
+    assert batch._program(paths[0]) is not first
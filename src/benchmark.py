@@ -0,0 +1,273 @@
+from __future__ import annotations
+
+import argparse
+import fnmatch
+import io
+import json
+import pathlib
+import sys
+import timeit
+from typing import Callable, Final, Iterator, NamedTuple, Optional, TypeAlias
+
+import devices
+import isa
+import lexer as lex
+import machine
+import translator
+from microcode import PROFILES
+
+EXAMPLES: Final[pathlib.Path] = pathlib.Path(__file__).parent.parent / "examples"
+DEFAULT_THRESHOLD: Final[float] = 0.2
+EXAMPLE_INPUTS: Final[dict[str, str]] = {
+    "cat": "large input line\n",
+    "cat_dma": "large input line\n",
+    "hello_user_name": "Benchmark",
+}
+
+_BLOCK = """block{name}:
+    addi $1, $0, {n}
+    lw $2, $1, data{name}
+    beq $2, $0, block{name}
+    sw $2, $0, output
+    add $3, $3, $2
+data{name}: "x\\n\\0"
+"""
+_BLOCK_LINES = _BLOCK.count("\n")
+
+_LOOP = """start:
+    addi $1, $0, {count}
+    addi $2, $0, 0
+loop:
+    addi $2, $2, 3
+    andi $3, $2, 255
+    sub $1, $1, $4
+    shr $3, $3, 1
+    beq $1, $0, break
+    addi $4, $0, 1
+    beq $0, $0, loop
+break:
+    halt
+"""
+
+
+class Measurement(NamedTuple):
+    value: float
+    unit: str
+    higher_is_better: bool = True
+
+
+Results: TypeAlias = dict[str, Measurement]
+
+
+def _label_suffix(n: int) -> str:
+    """Labels are letters only, so block numbers are spelled in base 26"""
+    suffix = ""
+    while True:
+        n, digit = divmod(n, 26)
+        suffix += chr(ord("a") + digit)
+        if n == 0:
+            return suffix
+
+
+def synthetic_source(lines: int) -> str:
+    blocks = [_BLOCK.format(n=n % 1000, name=_label_suffix(n)) for n in range(max(1, lines // _BLOCK_LINES))]
+    return "".join(blocks) + "start:\n    halt\n"
+
+
+def loop_source(iterations: int) -> str:
+    return _LOOP.format(count=iterations)
+
+
+def data_source(words: int) -> str:
+    return f'data: "{"x" * words}"\nstart:\n    halt\n'
+
+
+def measure(fn: Callable[[], object], repeat: int) -> float:
+    """Best time of a single call out of `repeat` samples, each sample at least 0.2s long"""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number
+
+
+def translator_throughput(lines: int, repeat: int = 1) -> tuple[int, float]:
+    source = synthetic_source(lines)
+    actual = source.count("\n")
+    return (actual, actual / measure(lambda: translator.parse(source), repeat))
+
+
+def bench_lexer(scale: float) -> Results:
+    source = synthetic_source(int(50_000 * scale))
+    lines = source.count("\n")
+    elapsed = measure(lambda: lex.Lexer.new(source).run(), 3)
+    return {"lexer/synthetic": Measurement(lines / elapsed, "lines/s")}
+
+
+def bench_translator(scale: float) -> Results:
+    _, rate = translator_throughput(int(50_000 * scale), 3)
+    return {"translator/synthetic": Measurement(rate, "lines/s")}
+
+
+def _run_rates(name: str, program: isa.Program, text: str, engine: str) -> Results:
+    input_buffer = [ord(c) for c in text] + [0]
+    runs: list[machine.SimulationResult] = []
+    elapsed = measure(lambda: runs.append(machine.simulation(program, input_buffer.copy(), engine)), 3)
+    result = runs[-1]
+    return {
+        f"{name}/{engine}:ticks": Measurement(result.ticks / elapsed, "ticks/s"),
+        f"{name}/{engine}:instructions": Measurement(result.instructions / elapsed, "instructions/s"),
+    }
+
+
+def bench_loop(scale: float) -> Results:
+    results: Results = {}
+    for engine in machine.ENGINES:
+        iterations = int(3_000 * scale) * (1 if engine == "microcode" else 20)
+        results |= _run_rates("loop", translator.parse(loop_source(max(1, iterations))), "", engine)
+    return results
+
+
+def bench_examples(scale: float) -> Results:
+    results: Results = {}
+    for path in sorted(EXAMPLES.glob("*.asm")):
+        program = translator.parse(path.read_text())
+        text = EXAMPLE_INPUTS.get(path.stem, "") * (max(1, int(100 * scale)) if path.stem.startswith("cat") else 1)
+        results |= _run_rates(f"examples/{path.stem}", program, text, "microcode")
+    return results
+
+
+def bench_load(scale: float) -> Results:
+    program = translator.parse(data_source(max(1, int(60_000 * scale))))
+    as_json = io.StringIO()
+    isa.write_program(program, as_json)
+    as_object = io.BytesIO()
+    isa.write_object(program, as_object)
+
+    def load_json() -> None:
+        machine.DataPath(
+            isa.read_program(io.StringIO(as_json.getvalue())), devices.BufferInput([]), devices.BufferOutput()
+        )
+
+    def load_object() -> None:
+        image = isa.ObjectImage(as_object.getvalue())
+        machine.DataPath(image, devices.BufferInput([]), devices.BufferOutput())
+        image.release()
+
+    return {
+        "load/json": Measurement(measure(load_json, 3) * 1000, "ms", higher_is_better=False),
+        "load/object": Measurement(measure(load_object, 3) * 1000, "ms", higher_is_better=False),
+    }
+
+
+BENCHMARKS: Final[dict[str, Callable[[float], Results]]] = {
+    "lexer": bench_lexer,
+    "translator": bench_translator,
+    "loop": bench_loop,
+    "examples": bench_examples,
+    "load": bench_load,
+}
+
+
+def run_suite(scale: float, only: str = "*") -> Results:
+    results: Results = {}
+    for name, bench in BENCHMARKS.items():
+        if fnmatch.fnmatch(name, only):
+            results |= bench(scale)
+    return results
+
+
+def compare(results: Results, baseline: Results, threshold: float) -> list[str]:
+    """Names of the measurements that got worse than the baseline by more than `threshold`
+
+    >>> compare({"a": Measurement(70, "lines/s"), "b": Measurement(13, "ms", False)},
+    ...         {"a": Measurement(100, "lines/s"), "b": Measurement(10, "ms", False)}, 0.2)
+    ['a', 'b']
+    >>> compare({"a": Measurement(90, "lines/s")}, {"a": Measurement(100, "lines/s"), "c": Measurement(1, "ms")}, 0.2)
+    []
+    """
+    regressions = []
+    for name, current in results.items():
+        if name not in baseline:
+            continue
+        ratio = current.value / baseline[name].value
+        if not current.higher_is_better:
+            ratio = 1 / ratio
+        if ratio < 1 - threshold:
+            regressions.append(name)
+    return regressions
+
+
+def write_results(results: Results, path: pathlib.Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps({name: m._asdict() for name, m in results.items()}, indent=2) + "\n")
+
+
+def read_results(path: pathlib.Path) -> Results:
+    return {name: Measurement(**fields) for name, fields in json.loads(path.read_text()).items()}
+
+
+def _print_results(results: Results, baseline: Optional[Results]) -> None:
+    for name, current in results.items():
+        line = f"{name:48} {current.value:>16,.3f} {current.unit}"
+        if baseline is not None and name in baseline:
+            line += f" ({(current.value / baseline[name].value - 1) * 100:+.1f}%)"
+        print(line)
+
+
+def _suite(args: argparse.Namespace) -> int:
+    results = run_suite(args.scale, args.only)
+    baseline = read_results(args.baseline) if args.baseline is not None and args.baseline.exists() else None
+    _print_results(results, baseline)
+    if args.output is not None:
+        write_results(results, args.output)
+    if baseline is None:
+        return 0
+    regressions = compare(results, baseline, args.threshold)
+    for name in regressions:
+        print(f"Regression: {name} is more than {args.threshold:.0%} worse than the baseline", file=sys.stderr)
+    return 1 if len(regressions) > 0 else 0
+
+
+def optimizer_savings(profile: str) -> Iterator[tuple[str, int, int]]:
+    """Ticks of every example translated without and with `-O`, which must not change its output"""
+    for path in sorted(EXAMPLES.glob("*.asm")):
+        input_buffer = [ord(c) for c in EXAMPLE_INPUTS.get(path.stem, "")] + [0]
+        source = path.read_text()
+        plain = machine.simulation(translator.parse(source), input_buffer.copy(), profile=profile)
+        optimized = machine.simulation(translator.parse(source, optimize=True), input_buffer.copy(), profile=profile)
+        assert optimized.output == plain.output, f"-O changed the output of {path.name}"
+        yield (path.stem, plain.ticks, optimized.ticks)
+
+
+def _optimizer(args: argparse.Namespace) -> int:
+    for name, before, after in optimizer_savings(args.microcode):
+        print(f"{name:24} {before:>10} -> {after:>10} ticks, saved {before - after} ({(before - after) / before:.1%})")
+    return 0
+
+
+def _scaling(args: argparse.Namespace) -> int:
+    for step in reversed(range(args.steps)):
+        lines, rate = translator_throughput(args.lines >> step, args.repeat)
+        print(f"{lines:>10} lines {rate:>12,.0f} lines/sec")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Performance benchmarks for the lexer, translator and simulator")
+    commands = parser.add_subparsers(required=True)
+    suite = commands.add_parser("suite", help="run the benchmark suite and compare it with a baseline")
+    suite.add_argument("--scale", type=float, default=1.0, help="workload size multiplier")
+    suite.add_argument("--only", default="*", help="glob over " + ", ".join(BENCHMARKS))
+    suite.add_argument("--output", type=pathlib.Path, help="write results as JSON")
+    suite.add_argument("--baseline", type=pathlib.Path, help="JSON results to compare with, if the file exists")
+    suite.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="allowed relative slowdown")
+    suite.set_defaults(command=_suite)
+    scaling = commands.add_parser("scaling", help="translator throughput on synthetic sources of doubling size")
+    scaling.add_argument("--lines", type=int, default=1_000_000, help="size of the largest source")
+    scaling.add_argument("--steps", type=int, default=4, help="number of sizes, each twice the previous")
+    scaling.add_argument("--repeat", type=int, default=1, help="runs per size, the best one is reported")
+    scaling.set_defaults(command=_scaling)
+    optimizer = commands.add_parser("optimizer", help="ticks saved by the translator's -O on the example programs")
+    optimizer.add_argument("--microcode", choices=PROFILES.keys(), default="classic")
+    optimizer.set_defaults(command=_optimizer)
+    args = parser.parse_args()
+    sys.exit(args.command(args))
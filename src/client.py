@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import argparse
+import base64
+import json
+import os
+import socket
+import sys
+import tempfile
+from typing import Any, Final, Optional
+
+DEFAULT_SOCKET: Final[str] = os.path.join(os.environ.get("XDG_RUNTIME_DIR", tempfile.gettempdir()), "asm-sim.sock")
+
+
+class ServerError(Exception):
+    """A request failed on the server; the message is the exception raised there"""
+
+
+class Client:
+    """Connection to `server.py`: one JSON request per line, answered in order.
+
+    The client only imports the standard library, so starting it costs far less than
+    importing the translator and the simulator it replaces.
+    """
+
+    _socket: socket.socket
+    _reader: Any
+
+    def __init__(self, path: str = DEFAULT_SOCKET) -> None:
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(path)
+        self._reader = self._socket.makefile("rb")
+
+    def __enter__(self) -> Client:
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._reader.close()
+        self._socket.close()
+
+    def request(self, request: dict[str, Any]) -> dict[str, Any]:
+        self._socket.sendall(json.dumps(request).encode() + b"\n")
+        line = self._reader.readline()
+        assert len(line) > 0, "Server closed the connection"
+        response: dict[str, Any] = json.loads(line)
+        if "error" in response:
+            raise ServerError(response["error"])
+        return response
+
+    def translate(self, source: str, *, binary: bool = False, optimize: bool = False) -> bytes:
+        """Contents of the file `translator.py` would write for `source`"""
+        response = self.request({"op": "translate", "source": source, "binary": binary, "optimize": optimize})
+        return base64.b64decode(response["program"])
+
+    def run(
+        self,
+        program: bytes,
+        text: str,
+        engine: str = "microcode",
+        profile: str = "classic",
+        *,
+        max_ticks: Optional[int] = None,
+        max_instructions: Optional[int] = None,
+    ) -> dict[str, Any]:
+        """Simulates `program` (a JSON or object file's contents) on `text`; returns output and counters"""
+        return self.request(
+            {
+                "op": "run",
+                "program": base64.b64encode(program).decode(),
+                "input": text,
+                "engine": engine,
+                "profile": profile,
+                "max_ticks": max_ticks,
+                "max_instructions": max_instructions,
+            }
+        )
+
+
+def translate_main(client: Client, args: argparse.Namespace) -> None:
+    with open(args.source) as f:
+        source = f.read()
+    program = client.translate(source, binary=args.binary, optimize=args.optimize)
+    with open(args.target, "wb") as f:
+        f.write(program)
+
+
+def run_main(client: Client, args: argparse.Namespace) -> None:
+    with open(args.program_file, "rb") as f:
+        program = f.read()
+    with open(args.input_file, encoding="ascii") as f:
+        text = f.read()
+    result = client.run(
+        program,
+        text,
+        args.engine,
+        args.microcode,
+        max_ticks=args.max_ticks,
+        max_instructions=args.max_instructions,
+    )
+    sys.stdout.write(result["output"])
+    sys.stdout.flush()
+    if not result["halted"]:
+        print(f"Stopped by budget at tick {result['ticks']}", file=sys.stderr)
+    if args.stats:
+        print(f"ticks: {result['ticks']}, instructions: {result['instructions']}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Translate or simulate programs on a running 'server.py'")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help=f"server socket, '{DEFAULT_SOCKET}' by default")
+    commands = parser.add_subparsers(dest="command", required=True)
+    translate = commands.add_parser("translate", help="same arguments as 'translator.py'")
+    translate.add_argument("source")
+    translate.add_argument("target")
+    translate.add_argument("--binary", action="store_true", help="write a binary object file instead of JSON")
+    translate.add_argument("-O", dest="optimize", action="store_true", help="run the optimizer over the program")
+    translate.set_defaults(main=translate_main)
+    run = commands.add_parser("run", help="same arguments as 'machine.py'")
+    run.add_argument("program_file")
+    run.add_argument("input_file")
+    run.add_argument("--engine", choices=("microcode", "functional", "jit"), default="microcode")
+    run.add_argument("--microcode", choices=("classic", "dispatch", "optimized"), default="classic")
+    run.add_argument("--stats", action="store_true", help="print tick and instruction counts to stderr")
+    run.add_argument("--max-ticks", type=int, metavar="N", help="stop once N ticks are executed")
+    run.add_argument("--max-instructions", type=int, metavar="N", help="stop once N instructions are executed")
+    run.set_defaults(main=run_main)
+    args = parser.parse_args()
+    try:
+        with Client(args.socket) as client:
+            args.main(client, args)
+    except ServerError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import sys
+from typing import NamedTuple, Optional
+
+import isa
+
+
+class InstructionCost(NamedTuple):
+    """Ticks from an instruction's fetch up to the next fetch, indexable by branch outcome"""
+
+    not_taken: int
+    taken: int
+
+
+def instruction_costs(microcode: list[isa.MInstruction]) -> dict[isa.Op, InstructionCost]:
+    return {
+        op: InstructionCost(
+            not_taken=_walk_instruction(microcode, op, taken=False),
+            taken=_walk_instruction(microcode, op, taken=True),
+        )
+        for op in isa.Op
+    }
+
+
+def limits(max_ticks: Optional[int], max_instructions: Optional[int]) -> tuple[int, int]:
+    """Budgets as bounds for the tick and instruction counters, unbounded when not given"""
+    return (
+        sys.maxsize if max_ticks is None else max_ticks,
+        sys.maxsize if max_instructions is None else max_instructions,
+    )
+
+
+def _walk_instruction(microcode: list[isa.MInstruction], op: isa.Op, *, taken: bool) -> int:
+    # The halting microinstruction is not counted, the same way `ControlUnit` stops before its tick
+    mpc = 0
+    ticks = 0
+    while True:
+        assert ticks <= len(microcode), f"Microcode for {op} does not return to instruction fetch"
+        minstr = microcode[mpc]
+        if isinstance(minstr, isa.MIOperation):
+            if minstr.halt:
+                return ticks
+            mpc += 1
+        else:
+            mpc = _next_mpc(minstr, mpc, op, taken=taken)
+        ticks += 1
+        if mpc == 0:
+            return ticks
+
+
+def _next_mpc(minstr: isa.MIJump, mpc: int, op: isa.Op, *, taken: bool) -> int:
+    if minstr.to != -1:
+        return minstr.to
+    if minstr.if_zero != -1 and taken:
+        return minstr.if_zero
+    if minstr.if_carry != -1 and taken:
+        return minstr.if_carry
+    if minstr.if_op[1] != -1 and minstr.if_op[0] == op:
+        return minstr.if_op[1]
+    if len(minstr.dispatch) > 0:
+        return minstr.dispatch[op.code()]
+    return mpc + 1
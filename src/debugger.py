@@ -0,0 +1,341 @@
+from __future__ import annotations
+
+import argparse
+import cmd
+import operator
+from typing import Callable, Final, NamedTuple, Optional, TextIO
+
+import isa
+from costs import limits
+from devices import BufferInput, BufferOutput, InputDevice, OutputDevice
+from journal import Journal
+from machine import ControlUnit, DataPath
+from microcode import PROFILES
+from paging import WATCH_READ, WATCH_WRITE
+from tracing import memory_word_repr
+
+Condition = Callable[[DataPath], bool]
+
+REGISTER_NAMES: Final[dict[str, int]] = {
+    **{f"${n}": n for n in range(isa.GEN_REG_N)},
+    "ar": isa.AR,
+    "dr": isa.DR,
+    "pc": isa.PC,
+    "or1": isa.OR1,
+    "or2": isa.OR2,
+    "or3": isa.OR3,
+}
+_COMPARISONS: Final[dict[str, Callable[[int, int], bool]]] = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+
+class Access(NamedTuple):
+    address: int
+    value: int
+    write: bool
+    tick: int
+
+
+class Watchpoint(NamedTuple):
+    address: int
+    length: int
+    flags: int
+
+
+class Stop(NamedTuple):
+    reason: str
+    """'halt', 'breakpoint', 'watchpoint', 'budget' or 'back' after going back in time"""
+    pc: int
+    accesses: list[Access]
+    """Watched accesses made by the instruction that was executed last"""
+
+
+class Debugger(ControlUnit):
+    """Microcode engine that stops before breakpoints and after instructions that access watched memory.
+
+    Breakpoints are only checked between instructions, once per instruction. Watchpoints are
+    kept in the page table (see `PagedMemory.watch`), so memory outside watched pages is
+    accessed exactly as in a normal run. Instruction fetches do not trigger read watchpoints.
+    With a journal the debugger can also go back in time and find the last write to an address.
+
+    >>> import translator
+    >>> program = translator.parse('start: addi $1, $0, 5\\n sw $1, $0, 100\\n halt')
+    >>> from devices import BufferInput, BufferOutput
+    >>> debugger = Debugger(program, BufferInput([0]), BufferOutput())
+    >>> debugger.watch(100)
+    >>> debugger.cont()
+    Stop(reason='watchpoint', pc=2, accesses=[Access(address=100, value=5, write=True, tick=23)])
+    >>> debugger.cont().reason
+    'halt'
+    """
+
+    breakpoints: dict[int, Optional[Condition]]
+    watchpoints: list[Watchpoint]
+    _accesses: list[Access]
+    _leaving: Optional[int]
+
+    def __init__(
+        self,
+        program: isa.LoadableProgram,
+        input_device: InputDevice,
+        output_device: OutputDevice,
+        profile: str = "classic",
+        *,
+        journal_window: Optional[int] = None,
+    ) -> None:
+        """With `journal_window` the debugger can go back up to that many ticks, see `Journal`"""
+        assert profile in PROFILES, f"Unknown microcode profile '{profile}'"
+        journal = Journal(PROFILES[profile], journal_window) if journal_window is not None else None
+        super().__init__(PROFILES[profile], DataPath(program, input_device, output_device), journal=journal)
+        self.breakpoints = {}
+        self.watchpoints = []
+        self._accesses = []
+        self._leaving = None
+
+    def break_at(self, address: int, condition: Optional[Condition] = None) -> None:
+        self.breakpoints[address] = condition
+
+    def watch(self, address: int, count: int = 1, *, read: bool = False, write: bool = True) -> None:
+        flags = (WATCH_READ if read else 0) | (WATCH_WRITE if write else 0)
+        assert flags != 0, "Watch reads, writes or both"
+        self.data_path.memory.watch(address, count, self._watched, flags)
+        self.watchpoints.append(Watchpoint(address, count, flags))
+
+    def unwatch(self, address: int) -> None:
+        """Removes the watchpoints starting at `address`"""
+        removed = [watchpoint for watchpoint in self.watchpoints if watchpoint.address == address]
+        self.watchpoints = [watchpoint for watchpoint in self.watchpoints if watchpoint.address != address]
+        memory = self.data_path.memory
+        for watchpoint in removed:
+            memory.unwatch(watchpoint.address, watchpoint.length)
+        for watchpoint in self.watchpoints:
+            memory.watch(watchpoint.address, watchpoint.length, self._watched, watchpoint.flags)
+
+    def cont(self, max_ticks: Optional[int] = None, max_instructions: Optional[int] = None) -> Stop:
+        """Runs until `HALT`, a breakpoint, a watched access or a budget, which are absolute like in `run`"""
+        halted = self.run(max_ticks, max_instructions)
+        pc = self.data_path.registers[isa.PC]
+        accesses, self._accesses = self._accesses, []
+        if halted:
+            return Stop("halt", pc, accesses)
+        if self._leaving is not None:
+            return Stop("breakpoint", pc, accesses)
+        if len(accesses) > 0:
+            return Stop("watchpoint", pc, accesses)
+        return Stop("budget", pc, accesses)
+
+    def step(self, count: int = 1) -> Stop:
+        return self.cont(max_instructions=self.instructions + count)
+
+    def step_back(self, count: int = 1) -> Stop:
+        """Goes back to the fetch of the `count`-th previous instruction"""
+        assert self.journal is not None, "Going back needs the journal"
+        return self.back_to(self.journal.instruction_start(count))
+
+    def back_to(self, tick: int) -> Stop:
+        assert self.journal is not None, "Going back needs the journal"
+        self.journal.run_back_to(self, tick)
+        pc = self.data_path.registers[isa.PC]
+        self._accesses = []
+        self._leaving = pc if self.mpc == 0 else None  # continuing must not stop at a breakpoint right here
+        return Stop("back", pc, [])
+
+    def last_write(self, address: int) -> Optional[int]:
+        assert self.journal is not None, "Finding writes needs the journal"
+        return self.journal.last_write(address)
+
+    def run(self, max_ticks: Optional[int] = None, max_instructions: Optional[int] = None) -> bool:
+        tick_limit, instruction_limit = limits(max_ticks, max_instructions)
+        try:
+            while self._tick < tick_limit and (
+                self.mpc != 0 or (self._instructions < instruction_limit and not self._stopping())
+            ):
+                self.execute_microinstruction()
+        except StopIteration:
+            return True
+        return False
+
+    def _stopping(self) -> bool:
+        """Checked before every instruction is fetched"""
+        pc = self.data_path.registers[isa.PC]
+        leaving, self._leaving = self._leaving, None
+        if len(self._accesses) > 0:
+            return True
+        if pc == leaving or pc not in self.breakpoints:
+            return False
+        condition = self.breakpoints[pc]
+        if condition is not None and not condition(self.data_path):
+            return False
+        self._leaving = pc
+        return True
+
+    def _watched(self, address: int, value: int, write: bool) -> None:
+        if write or self.mpc != 0:
+            self._accesses.append(Access(address, value, write, self._tick))
+
+
+def parse_address(text: str) -> int:
+    """A number in any Python notation or a predefined label such as 'output'"""
+    if text in isa.PREDEFINED_LABELS:
+        return isa.PREDEFINED_LABELS[text]
+    return int(text, 0)
+
+
+def parse_condition(words: list[str]) -> Condition:
+    """A condition like `$1 == 10` or `pc >= 0x20` on a register value"""
+    assert len(words) == 3, "Expected a condition like '$1 == 10'"
+    name, comparison, text = words
+    assert name in REGISTER_NAMES, f"Unknown register '{name}'"
+    assert comparison in _COMPARISONS, f"Unknown comparison '{comparison}'"
+    register, compare, value = REGISTER_NAMES[name], _COMPARISONS[comparison], int(text, 0)
+    return lambda data_path: compare(data_path.registers[register], value)
+
+
+class DebuggerShell(cmd.Cmd):
+    """Commands for `Debugger`, typed in or read from a script; errors are reported and do not stop the session"""
+
+    prompt = "(asm) "
+    debugger: Debugger
+    _shown: int
+
+    def __init__(self, debugger: Debugger, script: Optional[TextIO] = None) -> None:
+        super().__init__(stdin=script)
+        if script is not None:
+            self.use_rawinput = False
+            self.prompt = ""
+        self.debugger = debugger
+        self._shown = 0
+
+    def onecmd(self, line: str) -> bool:
+        if line == "EOF":
+            return True
+        try:
+            return super().onecmd(line)
+        except (AssertionError, ValueError) as e:
+            print(f"error: {e}")
+            return False
+
+    def emptyline(self) -> bool:
+        return False
+
+    def do_break(self, arg: str) -> None:
+        """break ADDRESS [if REGISTER OP VALUE] - stop before the instruction at ADDRESS"""
+        address, *rest = arg.split()
+        condition = None
+        if len(rest) > 0:
+            assert rest[0] == "if", "Expected 'if' before the condition"
+            condition = parse_condition(rest[1:])
+        self.debugger.break_at(parse_address(address), condition)
+
+    def do_delete(self, arg: str) -> None:
+        """delete ADDRESS - remove the breakpoint at ADDRESS"""
+        address = parse_address(arg)
+        assert address in self.debugger.breakpoints, f"No breakpoint at {arg}"
+        del self.debugger.breakpoints[address]
+
+    def do_watch(self, arg: str) -> None:
+        """watch ADDRESS [COUNT] [r|w|rw] - stop after instructions that access these words, 'w' by default"""
+        address, *rest = arg.split()
+        mode = rest.pop() if len(rest) > 0 and rest[-1] in ("r", "w", "rw") else "w"
+        count = int(rest[0], 0) if len(rest) > 0 else 1
+        self.debugger.watch(parse_address(address), count, read="r" in mode, write="w" in mode)
+
+    def do_unwatch(self, arg: str) -> None:
+        """unwatch ADDRESS - remove the watchpoints starting at ADDRESS"""
+        self.debugger.unwatch(parse_address(arg))
+
+    def do_continue(self, arg: str) -> bool:
+        """continue [TICKS] - run until a break, optionally for at most TICKS more ticks"""
+        max_ticks = self.debugger.ticks + int(arg, 0) if arg else None
+        return self._report(self.debugger.cont(max_ticks))
+
+    def do_step(self, arg: str) -> bool:
+        """step [N] - execute N instructions, 1 by default"""
+        return self._report(self.debugger.step(int(arg, 0) if arg else 1))
+
+    def do_stepback(self, arg: str) -> None:
+        """stepback [N] - go back to the start of the N-th previous instruction, 1 by default"""
+        self._report(self.debugger.step_back(int(arg, 0) if arg else 1))
+
+    def do_backto(self, arg: str) -> None:
+        """backto TICK - go back to the state before TICK was executed"""
+        self._report(self.debugger.back_to(int(arg, 0)))
+
+    def do_lastwrite(self, arg: str) -> None:
+        """lastwrite ADDRESS - tick of the last store to ADDRESS that is still in the journal"""
+        tick = self.debugger.last_write(parse_address(arg))
+        journal = self.debugger.journal
+        assert journal is not None
+        print(f"written at tick {tick}" if tick is not None else f"not written since tick {journal.oldest}")
+
+    def do_regs(self, arg: str) -> None:
+        """regs - print registers and flags"""
+        data_path = self.debugger.data_path
+        print(" ".join(f"{name}={memory_word_repr(data_path.registers[n])}" for name, n in REGISTER_NAMES.items()))
+        print(f"zero={int(data_path.zero)} carry={int(data_path.carry)} ", end="")
+        print(f"tick={self.debugger.ticks} instructions={self.debugger.instructions}")
+
+    def do_mem(self, arg: str) -> None:
+        """mem ADDRESS [COUNT] - print COUNT words of RAM from ADDRESS, without touching devices"""
+        address, *rest = arg.split()
+        start = parse_address(address)
+        words = self.debugger.data_path.memory.read_words(start, int(rest[0], 0) if rest else 1)
+        for offset, word in enumerate(words):
+            print(f"{start + offset:#06x}: {memory_word_repr(word)}")
+
+    def do_info(self, arg: str) -> None:
+        """info - list breakpoints and watchpoints"""
+        for address, condition in sorted(self.debugger.breakpoints.items()):
+            print(f"break {address:#06x}{' (conditional)' if condition is not None else ''}")
+        for watchpoint in self.debugger.watchpoints:
+            mode = ("r" if watchpoint.flags & WATCH_READ else "") + ("w" if watchpoint.flags & WATCH_WRITE else "")
+            print(f"watch {watchpoint.address:#06x} {watchpoint.length} {mode}")
+
+    def do_quit(self, arg: str) -> bool:
+        """quit - stop debugging"""
+        return True
+
+    def _report(self, stop: Stop) -> bool:
+        self._echo()
+        for access in stop.accesses:
+            kind = "write" if access.write else "read"
+            print(f"{kind} {access.address:#06x} = {memory_word_repr(access.value)} at tick {access.tick}")
+        print(f"{stop.reason} at pc {stop.pc:#06x}, tick {self.debugger.ticks}")
+        return stop.reason == "halt"
+
+    def _echo(self) -> None:
+        """Prints the output written since the last stop; going back takes back what was shown"""
+        output = self.debugger.data_path.output_device
+        output.flush()
+        if isinstance(output, BufferOutput):
+            if output.written > self._shown:
+                text = output.text()[self._shown :]
+                print(text, end="" if text.endswith("\n") else "\n")
+            self._shown = output.written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Debug a translated program with breakpoints and watchpoints")
+    parser.add_argument("program_file")
+    parser.add_argument("input_file")
+    parser.add_argument("--microcode", choices=PROFILES.keys(), default="classic")
+    parser.add_argument("-x", dest="script", metavar="FILE", help="read debugger commands from FILE")
+    parser.add_argument("--journal", type=int, metavar="TICKS", help="keep the last TICKS ticks to go back in time")
+    args = parser.parse_args()
+    with open(args.input_file, encoding="ascii") as f:
+        input_buffer = [ord(char) for char in f.read()] + [0]
+    with isa.open_program(args.program_file) as program:
+        debugger = Debugger(
+            program, BufferInput(input_buffer), BufferOutput(), args.microcode, journal_window=args.journal
+        )
+        if args.script is None:
+            DebuggerShell(debugger).cmdloop()
+        else:
+            with open(args.script) as script:
+                DebuggerShell(debugger, script).cmdloop()
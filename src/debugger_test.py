@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import io
+import pathlib
+
+import pytest
+
+import debugger
+import devices
+import lexer
+import machine
+import translator
+
+_EXAMPLES = pathlib.Path(__file__).parent.parent / "examples"
+_SOURCE = (_EXAMPLES / "hello_user_name.asm").read_text()
+_NAME = "Alice\n"
+_TOKENS = lexer.Lexer.new(_SOURCE).run()
+_LABELS = translator.labels_from_tokens(_TOKENS, translator.strings_from_tokens(_TOKENS))
+_STORE_NAME = _LABELS["scan_loop"] + 2
+
+
+def _debugger(profile: str = "classic") -> debugger.Debugger:
+    program = translator.parse(_SOURCE)
+    input_device = devices.BufferInput([ord(char) for char in _NAME] + [0])
+    return debugger.Debugger(program, input_device, devices.BufferOutput(), profile)
+
+
+def _output(unit: debugger.Debugger) -> str:
+    output_device = unit.data_path.output_device
+    assert isinstance(output_device, devices.BufferOutput)
+    return output_device.text()
+
+
+@pytest.mark.parametrize("profile", ["classic", "optimized"])
+def test_stops_do_not_change_the_run(profile: str) -> None:
+    expected = machine.simulation(translator.parse(_SOURCE), [ord(char) for char in _NAME] + [0], profile=profile)
+    unit = _debugger(profile)
+    scan_loop = _LABELS["scan_loop"]
+    unit.break_at(scan_loop)
+    unit.watch(0, _LABELS["start"], read=True, write=False)
+
+    stops = []
+    while (stop := unit.cont()).reason != "halt":
+        stops.append(stop)
+
+    assert (_output(unit), unit.ticks, unit.instructions) == (expected.output, expected.ticks, expected.instructions)
+    assert sum(stop.reason == "breakpoint" for stop in stops) == len(_NAME) + 1
+    assert all(stop.pc == scan_loop for stop in stops if stop.reason == "breakpoint")
+    assert (
+        "".join(chr(access.value) for stop in stops for access in stop.accesses)
+        == "What is your name?\n\0Hello, Alice\n\0"
+    )
+
+
+def test_conditional_breakpoint_sees_registers() -> None:
+    unit = _debugger()
+    unit.break_at(_STORE_NAME, debugger.parse_condition(["$2", "==", str(ord("i"))]))
+
+    stop = unit.cont()
+
+    assert (stop.reason, stop.pc) == ("breakpoint", _STORE_NAME)
+    assert unit.data_path.registers[2] == ord("i")
+    assert unit.data_path.registers[1] == _NAME.index("i")
+    assert unit.step(2).reason == "budget"
+    assert unit.cont().reason == "halt"
+
+
+def test_watchpoint_reports_the_access_after_the_instruction() -> None:
+    unit = _debugger()
+    unit.watch(debugger.parse_address("output"))
+
+    stop = unit.cont()
+
+    assert stop.reason == "watchpoint"
+    assert [(access.address, chr(access.value), access.write) for access in stop.accesses] == [(0xFF01, "W", True)]
+    assert _output(unit) == "W"
+    assert unit.mpc == 0
+    unit.unwatch(0xFF01)
+    assert unit.cont().reason == "halt"
+
+
+def test_shell_runs_a_script(capsys: pytest.CaptureFixture[str]) -> None:
+    unit = debugger.Debugger(
+        translator.parse(_SOURCE),
+        devices.BufferInput([ord(char) for char in _NAME] + [0]),
+        devices.BufferOutput(),
+        journal_window=10_000,
+    )
+    commands = [f"break {_STORE_NAME} if $1 >= 3", "continue", "regs", f"mem {_LABELS['name_buffer']} 3", "info"]
+    commands += ["bogus", f"lastwrite {_LABELS['name_buffer'] + 2}", "stepback 2", "backto 40", "lastwrite 27"]
+    commands += [f"delete {_STORE_NAME}", "continue", "regs"]
+    debugger.DebuggerShell(unit, io.StringIO("\n".join(commands))).cmdloop()
+
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[:2] == ["What is your name?", f"breakpoint at pc {_STORE_NAME:#06x}, tick 1509"]
+    assert lines[2].startswith("$0=   0 $1=   3 $2=  99 ")
+    assert lines[4:7] == ["0x001b:   65", "0x001c:  108", "0x001d:  105"]
+    assert lines[7:] == [
+        f"break {_STORE_NAME:#06x} (conditional)",
+        "*** Unknown syntax: bogus",
+        "written at tick 1453",
+        f"back at pc {_LABELS['scan_loop']:#06x}, tick 1483",
+        "back at pc 0x0028, tick 40",
+        "not written since tick 0",
+        "What is your name?",
+        "Hello, Alice",
+        "halt at pc 0x0037, tick 2598",
+    ]
+    assert _output(unit) == "What is your name?\nHello, Alice\n"
@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+from array import array
+from typing import TYPE_CHECKING, Final, Protocol, TextIO
+
+if TYPE_CHECKING:
+    from paging import PagedMemory
+
+CHUNK_SIZE: Final[int] = 64 * 1024
+
+
+class InputStarvedError(Exception):
+    """Raised by an input device that has nothing to read yet, but may get more input later"""
+
+
+class InputDevice(Protocol):
+    @property
+    def pos(self) -> int: ...
+
+    @property
+    def ended(self) -> bool:
+        """Whether the input is used up, so any further read fails"""
+        ...
+
+    def read(self) -> int: ...
+
+    def skip(self, count: int, *, ended: bool = False) -> None:
+        """Skips `count` characters and, when `ended`, the end of input after them"""
+        ...
+
+
+class OutputDevice(Protocol):
+    @property
+    def written(self) -> int: ...
+
+    def write(self, char: int) -> None: ...
+
+    def flush(self) -> None: ...
+
+
+class BufferInput:
+    buffer: list[int]
+    pos: int
+
+    def __init__(self, buffer: list[int]) -> None:
+        self.buffer = buffer
+        self.pos = 0
+
+    def read(self) -> int:
+        assert self.pos < len(self.buffer), "Read from empty input buffer"
+        char = self.buffer[self.pos]
+        self.pos += 1
+        return char
+
+    @property
+    def ended(self) -> bool:
+        return self.pos == len(self.buffer)
+
+    def skip(self, count: int, *, ended: bool = False) -> None:
+        # The terminating zero is part of the buffer, so `count` already covers it
+        assert self.pos + count <= len(self.buffer), "Skip past the end of input buffer"
+        self.pos += count
+        assert self.ended or not ended, "Input buffer goes on after the skipped end"
+
+
+class BufferOutput:
+    buffer: list[int]
+
+    def __init__(self) -> None:
+        self.buffer = []
+
+    def write(self, char: int) -> None:
+        self.buffer.append(char)
+
+    def flush(self) -> None:
+        pass
+
+    @property
+    def written(self) -> int:
+        return len(self.buffer)
+
+    def text(self) -> str:
+        return "".join([chr(c) for c in self.buffer])
+
+
+class StreamInput:
+    """Reads the stream in chunks, then returns a single terminating zero like a null-terminated string"""
+
+    stream: TextIO
+    chunk_size: int
+    pos: int
+    _chunk: str
+    _chunk_pos: int
+    ended: bool
+
+    def __init__(self, stream: TextIO, chunk_size: int = CHUNK_SIZE) -> None:
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.pos = 0
+        self._chunk = ""
+        self._chunk_pos = 0
+        self.ended = False
+
+    def read(self) -> int:
+        if self._chunk_pos == len(self._chunk):
+            self._chunk = self.stream.read(self.chunk_size)
+            self._chunk_pos = 0
+        if self._chunk_pos == len(self._chunk):
+            assert not self.ended, "Read from empty input buffer"
+            self.ended = True
+            return 0
+        char = self._chunk[self._chunk_pos]
+        self._chunk_pos += 1
+        self.pos += 1
+        return ord(char)
+
+    def skip(self, count: int, *, ended: bool = False) -> None:
+        while count > 0:
+            if self._chunk_pos == len(self._chunk):
+                self._chunk = self.stream.read(self.chunk_size)
+                self._chunk_pos = 0
+                assert len(self._chunk) > 0, "Skip past the end of input stream"
+            step = min(count, len(self._chunk) - self._chunk_pos)
+            self._chunk_pos += step
+            self.pos += step
+            count -= step
+        if ended:
+            self.read()
+            assert self.ended, "Skip past the end of input stream"
+
+
+class StreamOutput:
+    """Buffers characters and writes them out on every newline or once `chunk_size` characters are collected"""
+
+    stream: TextIO
+    chunk_size: int
+    written: int
+    _buffer: list[str]
+
+    def __init__(self, stream: TextIO, chunk_size: int = CHUNK_SIZE) -> None:
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.written = 0
+        self._buffer = []
+
+    def write(self, char: int) -> None:
+        self._buffer.append(chr(char))
+        if char == ord("\n") or len(self._buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if len(self._buffer) == 0:
+            return
+        self.stream.write("".join(self._buffer))
+        self.stream.flush()
+        self.written += len(self._buffer)
+        self._buffer = []
+
+
+class DmaController:
+    """Block transfers between the character devices and RAM, mapped as three ports from `base`.
+
+    `base` holds the RAM address of the next transfer. Writing `n` to `base + 1` copies up to `n`
+    input characters there, stopping after the terminating zero or at the end of live input, and reading that port returns how
+    many characters (without the zero) were copied; once input has ended transfers copy nothing.
+    Writing `n` to `base + 2` sends `n` words from the address to the output, one character each.
+    A transfer takes a single memory access, however many words it moves.
+    """
+
+    PORTS: Final[int] = 3
+
+    memory: PagedMemory
+    input_device: InputDevice
+    output_device: OutputDevice
+    address: int
+    copied: int
+    ended: bool
+
+    def __init__(self, memory: PagedMemory, input_device: InputDevice, output_device: OutputDevice) -> None:
+        self.memory = memory
+        self.input_device = input_device
+        self.output_device = output_device
+        self.address = 0
+        self.copied = 0
+        self.ended = False
+
+    def attach(self, base: int) -> None:
+        self.memory.map(base, write=self._set_address)
+        self.memory.map(base + 1, read=lambda: self.copied, write=self.read_block)
+        self.memory.map(base + 2, write=self.write_block)
+
+    def read_block(self, count: int) -> None:
+        words = array("I")
+        try:
+            while len(words) < count and not self.ended:
+                char = self.input_device.read() & 0xFF
+                self.ended = char == 0
+                words.append(char)
+        except InputStarvedError:
+            pass  # a transfer from live input copies what has arrived so far
+        self.memory.write_words(self.address, words)
+        self.copied = len(words) - 1 if self.ended and len(words) > 0 else len(words)
+
+    def write_block(self, count: int) -> None:
+        for word in self.memory.read_words(self.address, count):
+            self.output_device.write(word & 0xFF)
+
+    def _set_address(self, address: int) -> None:
+        self.address = address
@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import io
+import pathlib
+from array import array
+
+import pytest
+
+import devices
+import isa
+import machine
+import translator
+
+_EXAMPLES = pathlib.Path(__file__).parent.parent / "examples"
+
+
+@pytest.mark.parametrize("engine", machine.ENGINES)
+def test_cat_streams_input_to_output(engine: str) -> None:
+    program = translator.parse((pathlib.Path(__file__).parent.parent / "examples" / "cat.asm").read_text())
+    text = "first line\nsecond line\n" * 20
+    stream = io.StringIO()
+    output_device = devices.StreamOutput(stream, chunk_size=16)
+
+    machine.simulate(program, devices.StreamInput(io.StringIO(text), chunk_size=7), output_device, engine)
+
+    assert stream.getvalue() == text
+    assert output_device.written == len(text)
+
+
+def test_stream_input_is_terminated_once() -> None:
+    input_device = devices.StreamInput(io.StringIO("ab"), chunk_size=1)
+
+    assert [input_device.read() for _ in range(3)] == [ord("a"), ord("b"), 0]
+    with pytest.raises(AssertionError, match="Read from empty input buffer"):
+        input_device.read()
+
+
+@pytest.mark.parametrize("engine", machine.ENGINES)
+def test_dma_cat_moves_blocks(engine: str) -> None:
+    text = "a block device moves whole lines at once\n" * 10
+    input_buffer = [ord(c) for c in text] + [0]
+    by_char = machine.simulation(translator.parse((_EXAMPLES / "cat.asm").read_text()), input_buffer.copy(), engine)
+    by_block = machine.simulation(translator.parse((_EXAMPLES / "cat_dma.asm").read_text()), input_buffer, engine)
+
+    assert by_block.output == by_char.output == text
+    assert by_block.ticks * 10 < by_char.ticks
+
+
+def test_dma_stops_after_terminator() -> None:
+    source = "start:\n addi $1, $0, 100\n sw $1, $0, dma_addr\n addi $1, $0, 8\n sw $1, $0, dma_in\n sw $1, $0, dma_in\n halt\n"
+    unit = machine.prepare(
+        translator.parse(source), devices.BufferInput([ord("h"), ord("i"), 0]), devices.BufferOutput()
+    )
+
+    assert unit.run() is True
+    assert [unit.data_path.memory[address] for address in range(100, 104)] == [ord("h"), ord("i"), 0, 0]
+    assert (unit.data_path.dma.copied, unit.data_path.dma.ended) == (0, True)
+
+
+@pytest.mark.parametrize("engine", ["functional", "jit"])
+def test_block_writes_invalidate_cached_code(engine: str) -> None:
+    program = translator.parse("start:\n addi $1, $1, 1\n addi $2, $2, 1\n beq $0, $0, start\n")
+    unit = machine.prepare(program, devices.BufferInput([]), devices.BufferOutput(), engine)
+    assert unit.run(max_instructions=30) is False
+
+    unit.data_path.memory.write_words(1, array("I", [isa.encode_instruction((isa.Op.HALT,))]))
+
+    assert unit.run() is True
+    assert unit.data_path.registers[1:3] == [11, 10]
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import pytest
+import pytest_golden  # type: ignore[import-untyped]
+
+import devices
+import functional
+import isa
+import jit
+import machine
+import microcode
+import translator
+
+
+@pytest.mark.golden_test("golden/*.yml")
+@pytest.mark.parametrize("engine", ["functional", "jit"])
+@pytest.mark.parametrize("profile", ["classic", "dispatch", "optimized"])
+def test_engine_matches_microcode(golden: pytest_golden.plugin.GoldenTestFixture, engine: str, profile: str) -> None:
+    program = translator.parse(golden["in_source"])
+    input_buffer = [ord(c) for c in golden["in_stdin"]] + [0]
+
+    expected = machine.simulation(program, input_buffer.copy(), profile=profile)
+    actual = machine.simulation(program, input_buffer.copy(), engine, profile)
+
+    assert actual == expected
+
+
+@pytest.mark.golden_test("golden/*.yml")
+@pytest.mark.parametrize(("slower", "faster"), [("classic", "dispatch"), ("dispatch", "optimized")])
+def test_profile_saves_ticks(golden: pytest_golden.plugin.GoldenTestFixture, slower: str, faster: str) -> None:
+    program = translator.parse(golden["in_source"])
+    input_buffer = [ord(c) for c in golden["in_stdin"]] + [0]
+
+    expected = machine.simulation(program, input_buffer.copy(), profile=slower)
+    actual = machine.simulation(program, input_buffer.copy(), profile=faster)
+
+    assert actual.output == expected.output
+    assert actual.instructions == expected.instructions
+    assert actual.ticks < expected.ticks
+
+
+def test_jit_invalidates_overwritten_block() -> None:
+    program = translator.parse("start:\n addi $1, $0, 7\n sw $1, $0, start\n halt\n")
+    data_path = machine.DataPath(program, devices.BufferInput([0]), devices.BufferOutput())
+    unit = jit.JitUnit(microcode.microcode, data_path)
+    unit.run()
+
+    assert data_path.memory[0] == 7
+    assert unit.compiled_blocks() == [range(2, 3)]
+    assert (unit.ticks, unit.instructions) == machine.simulation(program, [0])[1:3]
+
+
+def test_functional_invalidates_overwritten_fusion() -> None:
+    source = """start:
+        addi $1, $1, 1
+    body:
+        addi $2, $2, 5
+        bleq $1, $3, start
+        lw $4, $0, end
+        sw $4, $0, body
+        addi $3, $0, 2
+        beq $0, $0, start
+    end:
+        halt
+    """
+    program = translator.parse(source)
+    data_path = machine.DataPath(program, devices.BufferInput([0]), devices.BufferOutput())
+    unit = functional.FunctionalUnit(microcode.microcode, data_path)
+
+    assert unit.run() is True
+    assert unit.fused_sequences() == [range(3, 6)]
+    assert data_path.registers[1:3] == [2, 5]
+    assert (unit.ticks, unit.instructions) == machine.simulation(program, [0])[1:3]
+
+
+@pytest.mark.parametrize("budget", range(1, 30, 2))
+def test_functional_fusion_keeps_budgets_exact(budget: int) -> None:
+    program = translator.parse(
+        "start:\n lw $1, $0, input\n beq $1, $0, end\n sw $1, $0, output\n beq $0, $0, start\nend:\n halt\n"
+    )
+    input_buffer = [ord(c) for c in "fused"] + [0]
+
+    expected = machine.simulation(program, input_buffer.copy(), max_instructions=budget)
+    actual = machine.simulation(program, input_buffer.copy(), "functional", max_instructions=budget)
+    assert actual == expected
+
+    # The microcode stops inside an instruction, but both count the instruction the budget interrupted
+    expected = machine.simulation(program, input_buffer.copy(), max_ticks=budget * 10)
+    actual = machine.simulation(program, input_buffer.copy(), "functional", max_ticks=budget * 10)
+    assert actual.instructions == expected.instructions
+
+
+@pytest.mark.parametrize("profile", ["classic", "dispatch", "optimized"])
+@pytest.mark.parametrize("engine", machine.ENGINES)
+def test_data_words_are_not_executed(engine: str, profile: str) -> None:
+    for word in (65, 15 << isa.OPCODE_SHIFT):
+        program = isa.Program(0, [word, (isa.Op.HALT,)])
+        unit = machine.prepare(program, devices.BufferInput([0]), devices.BufferOutput(), engine, profile)
+
+        with pytest.raises(AssertionError, match="Unknown opcode"):
+            unit.run()
+
+
+@pytest.mark.parametrize("profile", ["classic", "dispatch"])
+@pytest.mark.parametrize("engine", machine.ENGINES)
+def test_dma_overwriting_the_running_code(engine: str, profile: str) -> None:
+    # DMA copies the terminating zero over `patch`, so the stale store must not run; every engine
+    # then stops at the word with the unknown opcode 0
+    program = translator.parse(
+        """start:
+            addi $1, $0, patch
+            sw $1, $0, dma_addr
+            addi $2, $0, 1
+            sw $2, $0, dma_in
+            addi $3, $0, 89
+        patch:
+            sw $3, $0, output
+            halt
+        """
+    )
+    output = devices.BufferOutput()
+    unit = machine.prepare(program, devices.BufferInput([0]), output, engine, profile)
+
+    with pytest.raises(AssertionError, match="Unknown opcode '0'"):
+        unit.run()
+    assert output.text() == ""
@@ -0,0 +1,243 @@
+from __future__ import annotations
+
+import argparse
+import itertools
+import sys
+from typing import Final, NamedTuple, Union
+
+import costs
+import isa
+import microcode_optimizer
+from isa import Op
+from microcode import PROFILES
+
+MAX_STEPS: Final[int] = 1000
+_ARCHITECTURAL: Final[tuple[int, ...]] = (*range(1, isa.GEN_REG_N), isa.PC)
+
+
+class Term(NamedTuple):
+    """An unknown value: an initial register, a memory read, or an operation over other values"""
+
+    name: str
+    args: tuple[Value, ...] = ()
+
+
+class Word(NamedTuple):
+    """An instruction word whose immediate is unknown, while opcode and register fields are fixed"""
+
+    fields: int
+
+
+Value = Union[int, Term, Word]
+Conditions = frozenset[tuple[Value, bool]]
+
+
+class Effect(NamedTuple):
+    """Architectural result of one instruction along one path through the microcode"""
+
+    registers: tuple[Value, ...]
+    events: tuple[tuple[str, Value, Value], ...]
+    halted: bool
+    instructions: int
+
+
+class Outcome(NamedTuple):
+    effect: Effect
+    ticks: int
+
+
+class _Path(NamedTuple):
+    mpc: int
+    registers: tuple[Value, ...]
+    conditions: Conditions
+    events: tuple[tuple[str, Value, Value], ...]
+    ticks: int
+    instructions: int
+
+
+_PC: Final[Term] = Term("pc")
+
+
+def instruction_words(op: Op) -> list[Value]:
+    """Every combination of register fields for `op`, with a symbolic immediate for RRI ops"""
+    code = op.code() << isa.OPCODE_SHIFT
+    match op.type():
+        case isa.OpType.RRR:
+            return [
+                isa.encode_instruction((op, isa.RegArg(r1), isa.RegArg(r2), isa.RegArg(r3)))
+                for r1, r2, r3 in itertools.product(range(isa.GEN_REG_N), repeat=3)
+            ]
+        case isa.OpType.RRI:
+            return [
+                Word(code | r1 << isa.R1_SHIFT | r2 << isa.R2_SHIFT)
+                for r1, r2 in itertools.product(range(isa.GEN_REG_N), repeat=2)
+            ]
+    return [code]
+
+
+def execute(microcode: list[isa.MInstruction], word: Value) -> dict[Conditions, Outcome]:
+    """Runs one instruction from fetch back to fetch (or halt) over symbolic registers and memory.
+
+    Branches on unknown flags fork the run, so the result has an outcome for every feasible
+    combination of the conditions it tested. Memory reads and writes are recorded in order
+    instead of being modelled, which also covers the devices behind them.
+    """
+    registers: list[Value] = [Term("r", (reg,)) for reg in range(isa.REG_N)]
+    registers[0] = 0
+    registers[isa.PC] = _PC
+    outcomes: dict[Conditions, Outcome] = {}
+    stack = [_Path(0, tuple(registers), frozenset(), (), 0, 0)]
+    while len(stack) > 0:
+        path = stack.pop()
+        assert path.ticks < MAX_STEPS, f"Microcode does not return to instruction fetch at {path.mpc}"
+        if path.mpc == 0 and path.ticks > 0:
+            outcomes[path.conditions] = _finish(path, halted=False)
+            continue
+        minstr = microcode[path.mpc]
+        if path.mpc == 1:
+            path = path._replace(instructions=path.instructions + 1)
+        if isinstance(minstr, isa.MIOperation):
+            if minstr.halt:
+                outcomes[path.conditions] = _finish(_operation(path, minstr, word), halted=True)
+                continue
+            stack.append(_operation(path, minstr, word)._replace(mpc=path.mpc + 1, ticks=path.ticks + 1))
+        else:
+            stack.extend(p._replace(ticks=p.ticks + 1) for p in _jump(path, minstr))
+    return outcomes
+
+
+def check(original: list[isa.MInstruction], optimized: list[isa.MInstruction]) -> list[str]:
+    """Differences between two ROMs over every instruction word, empty when they are equivalent"""
+    problems = []
+    for op in Op:
+        for word in instruction_words(op):
+            expected = {conditions: outcome.effect for conditions, outcome in execute(original, word).items()}
+            actual = {conditions: outcome.effect for conditions, outcome in execute(optimized, word).items()}
+            if actual != expected:
+                problems.append(f"{op.name} {_word_repr(word)}: {_difference(expected, actual)}")
+    return problems
+
+
+def _finish(path: _Path, *, halted: bool) -> Outcome:
+    effect = Effect(tuple(path.registers[reg] for reg in _ARCHITECTURAL), path.events, halted, path.instructions)
+    return Outcome(effect, path.ticks)
+
+
+def _read(registers: tuple[Value, ...], reg: int) -> Value:
+    if reg == isa.IND_AR:
+        reg = _index(registers[isa.AR])
+    return 0 if reg == 0 else registers[reg]
+
+
+def _index(address: Value) -> int:
+    assert isinstance(address, int), f"Indirect register access through an unknown index {address}"
+    index: int = address & isa.IND_AR_MASK
+    return index
+
+
+def _operation(path: _Path, minstr: isa.MIOperation, word: Value) -> _Path:
+    registers = list(path.registers)
+    events = path.events
+    result, _ = _alu(minstr.alu_ctrl, _read(path.registers, minstr.x_sel), _read(path.registers, minstr.y_sel))
+    target = _index(registers[isa.AR]) if minstr.rwr_sel == isa.IND_AR else minstr.rwr_sel
+    if target != 0:
+        registers[target] = result
+    if minstr.mem_wr:
+        events += (("write", registers[isa.AR], registers[isa.DR]),)
+    if minstr.mem_rd:
+        address = registers[isa.AR]
+        registers[isa.DR] = word if address == _PC else Term("read", (len(events), address))
+        if address != _PC:
+            events += (("read", address, registers[isa.DR]),)
+    return path._replace(registers=tuple(registers), events=events)
+
+
+def _jump(path: _Path, minstr: isa.MIJump) -> list[_Path]:
+    result, carry = _alu(minstr.alu_ctrl, _read(path.registers, minstr.x_sel), _read(path.registers, minstr.y_sel))
+    if minstr.to != -1:
+        return [path._replace(mpc=minstr.to)]
+    zero = (result == 0) if isinstance(result, int) else Term("zero", (result,))
+    forks = []
+    for flag, target in ((zero, minstr.if_zero), (carry, minstr.if_carry)):
+        if target == -1:
+            continue
+        if not isinstance(flag, bool):
+            forks.append(path._replace(mpc=target, conditions=path.conditions | {(flag, True)}))
+            path = path._replace(conditions=path.conditions | {(flag, False)})
+        elif flag:
+            return [*forks, path._replace(mpc=target)]
+    return [*forks, path._replace(mpc=_decoded_target(minstr, result, path.mpc))]
+
+
+def _decoded_target(minstr: isa.MIJump, result: Value, mpc: int) -> int:
+    if minstr.if_op[1] == -1 and len(minstr.dispatch) == 0:
+        return mpc + 1
+    code = _opcode(result)
+    if minstr.if_op[1] != -1 and code == minstr.if_op[0].code():
+        return minstr.if_op[1]
+    if len(minstr.dispatch) > 0:
+        assert code < len(minstr.dispatch), f"Unknown opcode '{code}'"
+        assert minstr.dispatch[code] != -1, f"Unknown opcode '{code}'"
+        return minstr.dispatch[code]
+    return mpc + 1
+
+
+def _opcode(value: Value) -> int:
+    if isinstance(value, Word):
+        return value.fields >> isa.OPCODE_SHIFT
+    assert isinstance(value, int), f"Decoding an unknown instruction {value}"
+    return value >> isa.OPCODE_SHIFT
+
+
+_FIELDS: Final[dict[isa.ALUControl, int]] = {
+    isa.ALUControl.mask_fst_r: isa.R1_SHIFT,
+    isa.ALUControl.mask_snd_r: isa.R2_SHIFT,
+    isa.ALUControl.mask_thrd_r: isa.R3_SHIFT,
+}
+_CARRIES: Final[frozenset[isa.ALUControl]] = frozenset({isa.ALUControl.add, isa.ALUControl.inc, isa.ALUControl.sub})
+
+
+def _alu(ctrl: isa.ALUControl, x: Value, y: Value) -> tuple[Value, Union[bool, Term]]:
+    if isinstance(x, int) and isinstance(y, int):
+        return ctrl.call(x, y)
+    if ctrl is isa.ALUControl.only_x:
+        return (x, False)
+    if isinstance(x, Word) and ctrl in _FIELDS:
+        return ((x.fields >> _FIELDS[ctrl]) & isa.REG_FIELD_MASK, False)
+    if isinstance(x, Word) and ctrl is isa.ALUControl.mask_imm:
+        return (Term("imm"), False)
+    result = Term(ctrl.name, (x, y))
+    return (result, Term("carry", (result,)) if ctrl in _CARRIES else False)
+
+
+def _word_repr(word: Value) -> str:
+    if isinstance(word, Word):
+        return f"{word.fields:#010x}+imm"
+    return f"{word:#010x}" if isinstance(word, int) else repr(word)
+
+
+def _difference(expected: dict[Conditions, Effect], actual: dict[Conditions, Effect]) -> str:
+    if expected.keys() != actual.keys():
+        return f"tested conditions differ: {sorted(map(repr, expected))} != {sorted(map(repr, actual))}"
+    for conditions, effect in expected.items():
+        if actual[conditions] != effect:
+            return f"{actual[conditions]} instead of {effect}"
+    return "no difference"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Optimize a microcode ROM and prove it equivalent to the original")
+    parser.add_argument("--microcode", choices=PROFILES.keys(), default="dispatch")
+    args = parser.parse_args()
+    original = PROFILES[args.microcode]
+    optimized = microcode_optimizer.optimize(original).microcode
+    problems = check(original, optimized)
+    for problem in problems:
+        print(problem)
+    print(f"{len(original)} -> {len(optimized)} microinstructions, {'not ' if problems else ''}equivalent")
+    before, after = costs.instruction_costs(original), costs.instruction_costs(optimized)
+    for op in Op:
+        print(
+            f"{op.name:6} ticks {before[op].not_taken:>3} -> {after[op].not_taken:>3}, taken {before[op].taken:>3} -> {after[op].taken:>3}"
+        )
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,41 @@
+from __future__ import annotations
+
+import pytest
+
+import equivalence
+import isa
+import microcode_optimizer
+from isa import MIJump, MIOperation, Op
+from microcode import PROFILE_LABELS, PROFILES
+
+
+@pytest.mark.parametrize("profile", ["classic", "dispatch"])
+def test_optimized_rom_is_equivalent(profile: str) -> None:
+    original = PROFILES[profile]
+    optimized = microcode_optimizer.optimize(original).microcode
+
+    assert equivalence.check(original, optimized) == []
+    assert len(equivalence.instruction_words(Op.ADD)) == isa.GEN_REG_N**3
+
+
+def test_increment_pc_is_merged_into_routines() -> None:
+    optimized = PROFILES["optimized"]
+    labels = PROFILE_LABELS["optimized"]
+
+    assert "increment_pc" not in labels
+    assert optimized[labels["SHR"] + 5 : labels["SHR"] + 7] == [
+        MIOperation(x_sel=isa.PC, alu_ctrl=isa.ALUControl.inc, rwr_sel=isa.PC),
+        MIJump(to=0),
+    ]
+
+
+def test_broken_rom_is_detected() -> None:
+    original = PROFILES["dispatch"]
+    broken = list(original)
+    add = PROFILE_LABELS["dispatch"]["ADD"] + 5
+    broken[add] = broken[add]._replace(alu_ctrl=isa.ALUControl.sub)
+
+    problems = equivalence.check(original, broken)
+
+    assert len(problems) > 0
+    assert all(problem.startswith("ADD ") for problem in problems)
@@ -0,0 +1,326 @@
+from __future__ import annotations
+
+import argparse
+import collections
+from typing import Callable, Final, Mapping, NamedTuple, Optional
+
+import costs
+import isa
+from isa import Op
+from microcode import PROFILES
+
+_BRANCHES: Final[frozenset[Op]] = frozenset({Op.BEQ, Op.BLEQ})
+
+
+class Cost(NamedTuple):
+    best: int
+    worst: int
+
+    def __str__(self) -> str:
+        return str(self.best) if self.best == self.worst else f"{self.best}..{self.worst}"
+
+
+class Edge(NamedTuple):
+    """Leaving a block, with the ticks of the whole block when it leaves this way"""
+
+    target: Optional[int]
+    """Next block, or None when the program halts or runs off its code"""
+    ticks: int
+    taken: bool
+
+
+class Block(NamedTuple):
+    start: int
+    instructions: tuple[isa.Instruction, ...]
+    exits: tuple[Edge, ...]
+
+    @property
+    def cost(self) -> Cost:
+        return Cost(min(edge.ticks for edge in self.exits), max(edge.ticks for edge in self.exits))
+
+
+class Loop(NamedTuple):
+    header: int
+    blocks: frozenset[int]
+    iteration: Cost
+    """Ticks from the header back to it, without the iterations of loops nested in it"""
+    innermost: bool
+
+
+class Estimate(NamedTuple):
+    """Tick costs of a program's blocks and loops.
+
+    Every run that halts is a path through the blocks without back edges plus, for each loop,
+    the iterations that return to its header, so its ticks are within `base` plus the sum of
+    `iteration` times the number of returns of every loop.
+    """
+
+    blocks: dict[int, Block]
+    loops: list[Loop]
+    base: Optional[Cost]
+    """Ticks to halt without returning to a loop header, or None if the program never halts"""
+
+    def ticks(self, iterations: Mapping[int, int]) -> Cost:
+        """Bounds on the ticks of a run that returns `iterations[header]` times to every loop header"""
+        assert self.base is not None, "The program never halts"
+        best, worst = self.base
+        for loop in self.loops:
+            assert loop.header in iterations, f"Iterations of the loop at {loop.header:#06x} are not given"
+            best += loop.iteration.best * iterations[loop.header]
+            worst += loop.iteration.worst * iterations[loop.header]
+        return Cost(best, worst)
+
+    def formula(self) -> str:
+        if self.base is None:
+            return "never halts"
+        return " + ".join([str(self.base), *(f"{loop.iteration}*n[{loop.header:#06x}]" for loop in self.loops)])
+
+
+def estimate(program: isa.LoadableProgram, microcode: list[isa.MInstruction]) -> Estimate:
+    """Static tick costs of the code reachable from the program's start.
+
+    Instruction costs come from walking `microcode`, so they include the position of the
+    opcode in the decoding chain, and a branch costs differently when taken. A branch
+    comparing a register with itself is always taken.
+
+    >>> import translator
+    >>> from microcode import PROFILES
+    >>> program = translator.parse('''
+    ...     start: addi $2, $0, 5
+    ...     loop: addi $1, $1, 1
+    ...         bleq $1, $2, loop
+    ...         halt''')
+    >>> result = estimate(program, PROFILES["classic"])
+    >>> result.formula()
+    '53 + 27*n[0x0001]'
+    >>> result.ticks({1: 5})
+    Cost(best=188, worst=188)
+    """
+    words: dict[int, int] = {}
+    for section in program.sections():
+        with section.words as view:
+            words.update(zip(range(section.address, section.address + len(view)), view.tolist()))
+    code = _code(words, program.start)
+    blocks = _blocks(code, program.start, costs.instruction_costs(microcode))
+    order, back_edges = _depth_first(blocks, program.start)
+    base = _extremes(
+        blocks,
+        order,
+        program.start,
+        within=lambda source, edge: (source, edge.target) not in back_edges,
+        ends=lambda _, edge: edge.target is None,
+    )
+    return Estimate(blocks, _loops(blocks, order, back_edges), base)
+
+
+def _code(words: dict[int, int], start: int) -> dict[int, isa.Instruction]:
+    code: dict[int, isa.Instruction] = {}
+    pending = [start]
+    while len(pending) > 0:
+        pc = pending.pop()
+        if pc in code or pc not in words or isa.op_from_code(words[pc] >> isa.OPCODE_SHIFT) is None:
+            continue
+        instr = code[pc] = isa.decode_instruction(words[pc])
+        pending += _successors(instr, pc)
+    return code
+
+
+def _successors(instr: isa.Instruction, pc: int) -> list[int]:
+    if instr[0] is Op.HALT:
+        return []
+    branch = _branch(instr)
+    if branch is None:
+        return [pc + 1]
+    target, always = branch
+    return [target] if always else [target, pc + 1]
+
+
+def _branch(instr: isa.Instruction) -> Optional[tuple[int, bool]]:
+    """Target of a branch and whether it is always taken"""
+    match instr:
+        case (Op.BEQ | Op.BLEQ, isa.RegArg(r1), isa.RegArg(r2), isa.ImmArg(target)):
+            return (target, r1 == r2)
+    return None
+
+
+def _blocks(
+    code: dict[int, isa.Instruction], start: int, instruction_costs: dict[Op, costs.InstructionCost]
+) -> dict[int, Block]:
+    leaders = {start} | {
+        target for pc, instr in code.items() if instr[0] in _BRANCHES for target in _successors(instr, pc)
+    }
+    blocks: dict[int, Block] = {}
+    for leader in sorted(leaders & code.keys()):
+        pc = leader
+        ticks = 0
+        while code[pc][0] not in _BRANCHES and code[pc][0] is not Op.HALT and pc + 1 in code.keys() - leaders:
+            ticks += instruction_costs[code[pc][0]].not_taken
+            pc += 1
+        instrs = tuple(code[address] for address in range(leader, pc + 1))
+        blocks[leader] = Block(leader, instrs, _exits(code, pc, ticks, instruction_costs[code[pc][0]]))
+    return blocks
+
+
+def _exits(code: dict[int, isa.Instruction], pc: int, ticks: int, cost: costs.InstructionCost) -> tuple[Edge, ...]:
+    """Ways out of the block ending with the instruction at `pc`, after `ticks` of the ones before it"""
+    if code[pc][0] is Op.HALT:
+        return (Edge(None, ticks + cost.not_taken, taken=False),)
+    branch = _branch(code[pc])
+    not_taken = Edge(pc + 1 if pc + 1 in code else None, ticks + cost.not_taken, taken=False)
+    if branch is None:
+        return (not_taken,)
+    target, always = branch
+    taken = Edge(target if target in code else None, ticks + cost.taken, taken=True)
+    return (taken,) if always else (taken, not_taken)
+
+
+def _targets(block: Block) -> list[int]:
+    return list(dict.fromkeys(edge.target for edge in block.exits if edge.target is not None))
+
+
+def _depth_first(blocks: dict[int, Block], start: int) -> tuple[list[int], set[tuple[int, int]]]:
+    """Blocks in postorder and the edges that return to a block still being visited"""
+    order: list[int] = []
+    back_edges: set[tuple[int, int]] = set()
+    visiting = {start}
+    finished: set[int] = set()
+    stack = [(start, iter(_targets(blocks[start])))]
+    while len(stack) > 0:
+        source, targets = stack[-1]
+        target = next((t for t in targets if t not in finished and not _back(source, t, visiting, back_edges)), None)
+        if target is None:
+            stack.pop()
+            visiting.remove(source)
+            finished.add(source)
+            order.append(source)
+        else:
+            visiting.add(target)
+            stack.append((target, iter(_targets(blocks[target]))))
+    return order, back_edges
+
+
+def _back(source: int, target: int, visiting: set[int], back_edges: set[tuple[int, int]]) -> bool:
+    if target in visiting:
+        back_edges.add((source, target))
+        return True
+    return False
+
+
+def _extremes(
+    blocks: dict[int, Block],
+    order: list[int],
+    start: int,
+    *,
+    within: Callable[[int, Edge], bool],
+    ends: Callable[[int, Edge], bool],
+) -> Optional[Cost]:
+    """Cheapest and dearest paths from `start` along `within` edges up to an edge that `ends` them.
+
+    Edges that are not back edges lead to blocks earlier in the postorder, so every block's
+    paths are known before the blocks leading to it.
+    """
+    paths: dict[int, Cost] = {}
+    for source in order:
+        found = [
+            cost
+            for edge in blocks[source].exits
+            if (cost := _path(edge, paths, within=within(source, edge), end=ends(source, edge))) is not None
+        ]
+        if len(found) > 0:
+            paths[source] = Cost(min(cost.best for cost in found), max(cost.worst for cost in found))
+    return paths.get(start)
+
+
+def _path(edge: Edge, paths: dict[int, Cost], *, within: bool, end: bool) -> Optional[Cost]:
+    if end:
+        return Cost(edge.ticks, edge.ticks)
+    if not within or edge.target not in paths:
+        return None
+    rest = paths[edge.target]
+    return Cost(edge.ticks + rest.best, edge.ticks + rest.worst)
+
+
+def _loops(blocks: dict[int, Block], order: list[int], back_edges: set[tuple[int, int]]) -> list[Loop]:
+    predecessors: dict[int, set[int]] = collections.defaultdict(set)
+    for source in blocks:
+        for target in _targets(blocks[source]):
+            predecessors[target].add(source)
+    bodies: dict[int, set[int]] = collections.defaultdict(set)
+    for source, header in back_edges:
+        bodies[header] |= _body(predecessors, source, header)
+    loops = []
+    for header, body in sorted(bodies.items()):
+        entries = sorted(block for block in body - {header} if not predecessors[block] <= body)
+        assert len(entries) == 0, f"The loop at {header:#06x} is also entered at {', '.join(map(hex, entries))}"
+        innermost = all(other == header or other not in body for other in bodies)
+        loops.append(Loop(header, frozenset(body), _iteration(blocks, order, back_edges, header, body), innermost))
+    return loops
+
+
+def _body(predecessors: dict[int, set[int]], source: int, header: int) -> set[int]:
+    """Blocks of the loop closed by the back edge from `source` to `header`"""
+    body = {header}
+    pending = [source]
+    while len(pending) > 0:
+        block = pending.pop()
+        if block not in body:
+            body.add(block)
+            pending += predecessors[block]
+    return body
+
+
+def _iteration(
+    blocks: dict[int, Block], order: list[int], back_edges: set[tuple[int, int]], header: int, body: set[int]
+) -> Cost:
+    iteration = _extremes(
+        blocks,
+        order,
+        header,
+        within=lambda source, edge: edge.target in body and (source, edge.target) not in back_edges,
+        ends=lambda source, edge: edge.target == header and (source, header) in back_edges,
+    )
+    assert iteration is not None, f"The loop at {header:#06x} never returns to its header"
+    return iteration
+
+
+def _describe(instr: isa.Instruction, cost: costs.InstructionCost) -> str:
+    args = ", ".join(f"${arg.idx}" if isinstance(arg, isa.RegArg) else str(arg.val) for arg in instr[1:])
+    ticks = f"{cost.not_taken}, taken {cost.taken}" if instr[0] in _BRANCHES else str(cost.not_taken)
+    return f"{instr[0].name.lower():5} {args:16} {ticks}"
+
+
+def _iterations(text: str) -> tuple[int, int]:
+    header, count = text.split("=")
+    return int(header, 0), int(count)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimate the ticks of a translated program without running it")
+    parser.add_argument("program_file")
+    parser.add_argument("--microcode", choices=PROFILES.keys(), default="classic")
+    parser.add_argument(
+        "-n",
+        dest="iterations",
+        type=_iterations,
+        action="append",
+        metavar="HEADER=N",
+        help="returns to the loop header at address HEADER, given for every loop to bound the total ticks",
+    )
+    parser.add_argument("--blocks", action="store_true", help="list blocks with the ticks of every instruction")
+    args = parser.parse_args()
+    microcode = PROFILES[args.microcode]
+    result = estimate(isa.load_program(args.program_file), microcode)
+    if args.blocks:
+        instruction_costs = costs.instruction_costs(microcode)
+        for block in result.blocks.values():
+            print(f"block {block.start:#06x}: {block.cost} ticks")
+            for pc, instr in enumerate(block.instructions, block.start):
+                print(f"  {pc:#06x} {_describe(instr, instruction_costs[instr[0]])}")
+    for loop in result.loops:
+        blocks = ", ".join(f"{block:#06x}" for block in sorted(loop.blocks))
+        print(
+            f"loop {loop.header:#06x}{' (innermost)' if loop.innermost else ''}: {loop.iteration} ticks per iteration, blocks {blocks}"
+        )
+    print(f"ticks: {result.formula()}")
+    if args.iterations is not None:
+        print(f"ticks for the given iterations: {result.ticks(dict(args.iterations))}")
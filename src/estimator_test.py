@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import collections
+import pathlib
+
+import pytest
+
+import devices
+import estimator
+import isa
+import machine
+import translator
+from microcode import PROFILES
+
+_EXAMPLES = pathlib.Path(__file__).parent.parent / "examples"
+_TEXTS = {"cat": "cat test!", "cat_dma": "Alice in a DMA wonderland\n" * 3, "hello_user_name": "Alice\n"}
+
+
+def _returns(result: estimator.Estimate, program: isa.Program, text: str, profile: str) -> tuple[dict[int, int], int]:
+    """Returns to every loop header in a run and the run's ticks, found by stepping it one instruction at a time"""
+    blocks = {
+        pc: block.start
+        for block in result.blocks.values()
+        for pc in range(block.start, block.start + len(block.instructions))
+    }
+    unit = machine.prepare(
+        program, devices.BufferInput([ord(char) for char in text] + [0]), devices.BufferOutput(), "functional", profile
+    )
+    returns: collections.Counter[int] = collections.Counter()
+    pc = program.start
+    while not unit.run(max_instructions=unit.instructions + 1):
+        following = unit.data_path.registers[isa.PC]
+        returns.update(loop.header for loop in result.loops if following == loop.header and blocks[pc] in loop.blocks)
+        pc = following
+    return {loop.header: returns[loop.header] for loop in result.loops}, unit.ticks
+
+
+@pytest.mark.parametrize("profile", PROFILES.keys())
+@pytest.mark.parametrize("name", ["cat", "cat_dma", "fib", "gcd", "hello", "hello_user_name"])
+def test_runs_are_within_the_estimate(name: str, profile: str) -> None:
+    program = translator.parse((_EXAMPLES / f"{name}.asm").read_text())
+    result = estimator.estimate(program, PROFILES[profile])
+
+    iterations, ticks = _returns(result, program, _TEXTS.get(name, ""), profile)
+
+    bounds = result.ticks(iterations)
+    assert bounds.best <= ticks <= bounds.worst
+
+
+def test_blocks_and_loops() -> None:
+    program = translator.parse(
+        """
+        start: addi $1, $0, 0
+            addi $2, $0, 3
+        outer: addi $3, $0, 0
+        inner: addi $3, $3, 1
+            bleq $3, $2, inner
+            addi $1, $1, 1
+            beq $1, $2, done
+            beq $0, $0, outer
+        done: halt
+            addi $4, $0, 1
+        """
+    )
+    result = estimator.estimate(program, PROFILES["classic"])
+
+    assert list(result.blocks) == [0, 2, 3, 5, 7, 8]
+    assert [edge.target for edge in result.blocks[7].exits] == [2]
+    assert [(loop.header, sorted(loop.blocks), loop.innermost) for loop in result.loops] == [
+        (2, [2, 3, 5, 7], False),
+        (3, [3], True),
+    ]
+    simulated = machine.simulation(program, [0])
+    assert result.ticks({2: 2, 3: 3 * 3}) == (simulated.ticks, simulated.ticks)
+
+
+def test_code_that_never_halts() -> None:
+    result = estimator.estimate(translator.parse("start: beq $0, $0, start"), PROFILES["classic"])
+
+    assert result.base is None
+    assert result.formula() == "never halts"
+    assert [loop.header for loop in result.loops] == [0]
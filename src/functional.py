@@ -0,0 +1,340 @@
+from __future__ import annotations
+
+import operator
+from typing import TYPE_CHECKING, Any, Callable, Final, NamedTuple, Optional, TypeAlias
+
+import isa
+from costs import InstructionCost, instruction_costs, limits
+from isa import Op
+from paging import PAGE_MASK, PAGE_SHIFT
+
+if TYPE_CHECKING:
+    from machine import DataPath
+
+Handler: TypeAlias = Callable[[Any, int], tuple[int, bool]]
+Step: TypeAlias = Callable[[], None]
+
+MAX_FUSED: Final[int] = 3
+
+_ALU: Final[dict[Op, Callable[[int, int], int]]] = {
+    Op.ADDI: operator.add,
+    Op.ANDI: operator.and_,
+    Op.SHR: operator.rshift,
+    Op.ADD: operator.add,
+    Op.SUB: operator.sub,
+}
+_BRANCHES: Final[dict[Op, Callable[[int, int], bool]]] = {Op.BEQ: operator.eq, Op.BLEQ: operator.le}
+
+
+class Fused(NamedTuple):
+    """A superinstruction: a straight run of up to `MAX_FUSED` instructions executed as one call.
+
+    `run(pc)` returns the next pc and the ticks of the whole run. `prefix_ticks` are the ticks
+    before its last instruction, which tells whether budgets would have let it run in full.
+    """
+
+    run: Callable[[int], tuple[int, int]]
+    pcs: range
+    prefix_ticks: int
+
+
+class FunctionalUnit:
+    """Executes whole instructions against the `DataPath`, bypassing the microcode loop.
+
+    Ticks are accounted with costs derived from the microcode ROM, so `ticks` and
+    `instructions` match what `ControlUnit` would have counted for the same run.
+    Decoded instructions are cached by word value, so overwritten code needs no invalidation.
+    Budgets are checked between instructions, so `mpc` is always 0 when `run` returns.
+
+    On its first execution every pc is checked for a fusable run of instructions (see `_fuse`),
+    which later executions then take in a single call. Runs are cached by address and dropped
+    by stores to any word they cover, and are skipped when a budget would stop inside them.
+    """
+
+    data_path: DataPath
+    mpc: Final[int] = 0
+    ticks: int
+    instructions: int
+    _costs: dict[Op, InstructionCost]
+    _handlers: dict[Op, Handler]
+    _decoded: dict[int, isa.Instruction]
+    _fused: dict[int, Optional[Fused]]
+
+    def __init__(self, microcode: list[isa.MInstruction], data_path: DataPath) -> None:
+        self.data_path = data_path
+        self.ticks = 0
+        self.instructions = 0
+        self._costs = instruction_costs(microcode)
+        self._decoded = {}
+        self._fused = {}
+        self._handlers = {
+            Op.LW: self._lw,
+            Op.SW: self._sw,
+            Op.BEQ: self._beq,
+            Op.BLEQ: self._bleq,
+            Op.ADDI: self._addi,
+            Op.ANDI: self._andi,
+            Op.ADD: self._add,
+            Op.SUB: self._sub,
+            Op.SHR: self._shr,
+        }
+        data_path.memory.write_listeners.append(self._forget)
+
+    def run(self, max_ticks: Optional[int] = None, max_instructions: Optional[int] = None) -> bool:
+        pages = self.data_path.memory.pages
+        registers = self.data_path.registers
+        handlers = self._handlers
+        costs = self._costs
+        decoded = self._decoded
+        fusions = self._fused
+        tick_limit, instruction_limit = limits(max_ticks, max_instructions)
+        pc = registers[isa.PC]
+        try:
+            while self.ticks < tick_limit and self.instructions < instruction_limit:
+                try:
+                    fused = fusions[pc]
+                except KeyError:
+                    fused = fusions[pc] = self._fuse(pc)
+                if (
+                    fused is not None
+                    and self.ticks + fused.prefix_ticks < tick_limit
+                    and self.instructions + len(fused.pcs) <= instruction_limit
+                ):
+                    self.instructions += len(fused.pcs)
+                    pc, ticks = fused.run(pc)
+                    self.ticks += ticks
+                    continue
+                word = pages[pc >> PAGE_SHIFT][pc & PAGE_MASK]
+                instr = decoded.get(word)
+                if instr is None:
+                    instr = decoded[word] = isa.decode_instruction(word)
+                op = instr[0]
+                self.instructions += 1
+                if op is Op.HALT:
+                    self.ticks += costs[op].not_taken
+                    return True
+                pc, taken = handlers[op](instr, pc)
+                self.ticks += costs[op][taken]
+            return False
+        finally:
+            registers[isa.PC] = pc
+
+    def restore(self, mpc: int, ticks: int, instructions: int) -> None:
+        assert mpc == 0, "The functional engine can only resume between instructions"
+        self.ticks = ticks
+        self.instructions = instructions
+
+    def fused_sequences(self) -> list[range]:
+        return [fused.pcs for fused in self._fused.values() if fused is not None]
+
+    def _fuse(self, start: int) -> Optional[Fused]:
+        """Longest run from `start` that is worth fusing, if any.
+
+        Branches may only end a run. A store may end it too, or sit inside it when its address
+        is a constant outside the run other than `dma_in`, so a fused run never overwrites its
+        own instructions.
+        """
+        instrs = self._scan(start)
+        while len(instrs) >= 2 and not _fusable(start, instrs):
+            instrs.pop()
+        if len(instrs) < 2:
+            return None
+        head = tuple(self._step(instr) for instr in instrs[:-1])
+        last = instrs[-1]
+        prefix_ticks = sum(self._costs[instr[0]].not_taken for instr in instrs[:-1])
+        length = len(instrs)
+        pcs = range(start, start + length)
+        if last[0] in _BRANCHES:
+            return Fused(self._fused_branch(head, last, prefix_ticks, length), pcs, prefix_ticks)  # type: ignore[arg-type]
+        steps = (*head, self._step(last))
+        ticks = prefix_ticks + self._costs[last[0]].not_taken
+
+        def run(pc: int) -> tuple[int, int]:
+            for step in steps:
+                step()
+            return (pc + length, ticks)
+
+        return Fused(run, pcs, prefix_ticks)
+
+    def _scan(self, start: int) -> list[isa.Instruction]:
+        memory = self.data_path.memory
+        instrs: list[isa.Instruction] = []
+        for pc in range(start, min(start + MAX_FUSED, len(memory))):
+            op = isa.op_from_code(memory[pc] >> isa.OPCODE_SHIFT)
+            if op is None or op is Op.HALT:
+                break
+            instrs.append(isa.decode_instruction(memory[pc]))
+            if op in _BRANCHES:
+                break
+        return instrs
+
+    def _fused_branch(
+        self,
+        head: tuple[Step, ...],
+        branch: tuple[Op, isa.RegArg, isa.RegArg, isa.ImmArg],
+        prefix_ticks: int,
+        length: int,
+    ) -> Callable[[int], tuple[int, int]]:
+        op, r1, r2, imm = branch
+        registers = self.data_path.registers
+        compare = _BRANCHES[op]
+        x, y, target = r1.idx, r2.idx, imm.val
+        taken = prefix_ticks + self._costs[op].taken
+        not_taken = prefix_ticks + self._costs[op].not_taken
+
+        def run(pc: int) -> tuple[int, int]:
+            for step in head:
+                step()
+            if compare(registers[x], registers[y]):
+                return (target, taken)
+            return (pc + length, not_taken)
+
+        return run
+
+    def _step(self, instr: isa.Instruction) -> Step:
+        op = instr[0]
+        if op is Op.LW:
+            return self._lw_step(instr)  # type: ignore[arg-type]
+        if op is Op.SW:
+            return self._sw_step(instr)  # type: ignore[arg-type]
+        return self._alu_step(instr)  # type: ignore[arg-type]
+
+    def _lw_step(self, instr: tuple[Op, isa.RegArg, isa.RegArg, isa.ImmArg]) -> Step:
+        _, r1, r2, imm = instr
+        registers = self.data_path.registers
+        pages = self.data_path.memory.pages
+        load = self._load
+        dst, base, offset = r1.idx, r2.idx, imm.val
+
+        def step() -> None:
+            address = registers[base] + offset
+            value = (
+                pages[address >> PAGE_SHIFT][address & PAGE_MASK] if address != isa.INPUT_DEVICE_ADDR else load(address)
+            )
+            if dst != 0:
+                registers[dst] = value
+
+        return step
+
+    def _sw_step(self, instr: tuple[Op, isa.RegArg, isa.RegArg, isa.ImmArg]) -> Step:
+        _, r1, r2, imm = instr
+        registers = self.data_path.registers
+        store = self._store
+        src, base, offset = r1.idx, r2.idx, imm.val
+
+        def step() -> None:
+            store(registers[base] + offset, registers[src])
+
+        return step
+
+    def _alu_step(self, instr: tuple[Op, isa.RegArg, isa.RegArg, isa.RegArg | isa.ImmArg]) -> Step:
+        op, r1, r2, arg = instr
+        registers = self.data_path.registers
+        alu = _ALU[op]
+        dst, x = r1.idx, r2.idx
+        if dst == 0:
+            return _nothing
+        if isinstance(arg, isa.ImmArg):
+            imm = arg.val
+
+            def step_imm() -> None:
+                registers[dst] = alu(registers[x], imm)
+
+            return step_imm
+        y = arg.idx
+
+        def step() -> None:
+            registers[dst] = alu(registers[x], registers[y])
+
+        return step
+
+    def _load(self, address: int) -> int:
+        if address == isa.INPUT_DEVICE_ADDR:
+            self.data_path.registers[isa.AR] = address
+            self.data_path.signal_mem_rd()
+            return self.data_path.registers[isa.DR]
+        return self.data_path.memory[address]
+
+    def _store(self, address: int, data: int) -> None:
+        self.data_path.registers[isa.AR] = address
+        self.data_path.registers[isa.DR] = data
+        self.data_path.signal_mem_wr()
+        self._forget(address, 1)
+
+    def _forget(self, address: int, count: int) -> None:
+        """Drops the superinstructions that cover any of the `count` words written from `address`"""
+        for start in range(address - MAX_FUSED + 1, address + count):
+            self._fused.pop(start, None)
+
+    def _set(self, reg: int, val: int) -> None:
+        if reg != 0:
+            self.data_path.registers[reg] = val
+
+    def _lw(self, instr: tuple[Op, isa.RegArg, isa.RegArg, isa.ImmArg], pc: int) -> tuple[int, bool]:
+        _, r1, r2, imm = instr
+        self._set(r1.idx, self._load(self._get(r2.idx) + imm.val))
+        return (pc + 1, False)
+
+    def _sw(self, instr: tuple[Op, isa.RegArg, isa.RegArg, isa.ImmArg], pc: int) -> tuple[int, bool]:
+        _, r1, r2, imm = instr
+        self._store(self._get(r2.idx) + imm.val, self._get(r1.idx))
+        return (pc + 1, False)
+
+    def _beq(self, instr: tuple[Op, isa.RegArg, isa.RegArg, isa.ImmArg], pc: int) -> tuple[int, bool]:
+        _, r1, r2, imm = instr
+        if self._get(r1.idx) == self._get(r2.idx):
+            return (imm.val, True)
+        return (pc + 1, False)
+
+    def _bleq(self, instr: tuple[Op, isa.RegArg, isa.RegArg, isa.ImmArg], pc: int) -> tuple[int, bool]:
+        _, r1, r2, imm = instr
+        if self._get(r1.idx) <= self._get(r2.idx):
+            return (imm.val, True)
+        return (pc + 1, False)
+
+    def _addi(self, instr: tuple[Op, isa.RegArg, isa.RegArg, isa.ImmArg], pc: int) -> tuple[int, bool]:
+        _, r1, r2, imm = instr
+        self._set(r1.idx, self._get(r2.idx) + imm.val)
+        return (pc + 1, False)
+
+    def _andi(self, instr: tuple[Op, isa.RegArg, isa.RegArg, isa.ImmArg], pc: int) -> tuple[int, bool]:
+        _, r1, r2, imm = instr
+        self._set(r1.idx, self._get(r2.idx) & imm.val)
+        return (pc + 1, False)
+
+    def _shr(self, instr: tuple[Op, isa.RegArg, isa.RegArg, isa.ImmArg], pc: int) -> tuple[int, bool]:
+        _, r1, r2, imm = instr
+        self._set(r1.idx, self._get(r2.idx) >> imm.val)
+        return (pc + 1, False)
+
+    def _add(self, instr: tuple[Op, isa.RegArg, isa.RegArg, isa.RegArg], pc: int) -> tuple[int, bool]:
+        _, r1, r2, r3 = instr
+        self._set(r1.idx, self._get(r2.idx) + self._get(r3.idx))
+        return (pc + 1, False)
+
+    def _sub(self, instr: tuple[Op, isa.RegArg, isa.RegArg, isa.RegArg], pc: int) -> tuple[int, bool]:
+        _, r1, r2, r3 = instr
+        self._set(r1.idx, self._get(r2.idx) - self._get(r3.idx))
+        return (pc + 1, False)
+
+    def _get(self, reg: int) -> int:
+        return self.data_path.registers[reg]
+
+
+def _fusable(start: int, instrs: list[isa.Instruction]) -> bool:
+    for instr in instrs[:-1]:
+        if instr[0] in _BRANCHES:
+            return False
+        if instr[0] is Op.SW and not _outside(instr, range(start, start + len(instrs))):  # type: ignore[arg-type]
+            return False
+    return True
+
+
+def _outside(store: tuple[Op, isa.RegArg, isa.RegArg, isa.ImmArg], pcs: range) -> bool:
+    """Whether the store can't change the run, which a block transfer started through `dma_in` could"""
+    _, _, base, offset = store
+    return base.idx == 0 and offset.val not in pcs and offset.val != isa.DMA_ADDR + 1
+
+
+def _nothing() -> None:
+    pass
@@ -1,9 +1,15 @@
 from __future__ import annotations
 
+import contextlib
+import io
 import json
 import math
+import mmap
+import struct
+import sys
+from array import array
 from enum import Enum
-from typing import Final, NamedTuple, TextIO, TypeAlias, Union
+from typing import BinaryIO, Final, Iterator, NamedTuple, Optional, TextIO, TypeAlias, Union
 
 from utils import iota, iota_reset
 
@@ -18,13 +24,26 @@ REG_N = GEN_REG_N + iota_reset()
 IND_AR = -1
 IND_AR_MASK = pow(2, math.ceil(math.log(REG_N) / math.log(2))) - 1
 
+WORD_MASK = 0xFFFFFFFF
+OPCODE_SHIFT = 28
+R1_SHIFT = 25
+R2_SHIFT = 22
+R3_SHIFT = 19
+REG_FIELD_MASK = 0b111
+IMM_BITS = 22
+IMM_MASK = (1 << IMM_BITS) - 1
+
 ORIGIN = 0
 MEMORY_SIZE = 0xFFFF
 INPUT_DEVICE_ADDR = 0xFF00
 OUTPUT_DEVICE_ADDR = 0xFF01
+DMA_ADDR = 0xFF02
 PREDEFINED_LABELS: Final[dict[str, int]] = {
     "input": INPUT_DEVICE_ADDR,
     "output": OUTPUT_DEVICE_ADDR,
+    "dma_addr": DMA_ADDR,
+    "dma_in": DMA_ADDR + 1,
+    "dma_out": DMA_ADDR + 2,
 }
 
 
@@ -84,6 +103,52 @@ def instruction_from_args(op: Op, args: list[ImmArg | RegArg]) -> Instruction:
 
 MemoryWord: TypeAlias = Instruction | int
 
+_OPS_BY_CODE: Final[dict[int, Op]] = {op.code(): op for op in Op}
+
+
+def op_from_code(code: int) -> Optional[Op]:
+    return _OPS_BY_CODE.get(code)
+
+
+def encode_instruction(instr: Instruction) -> int:
+    word = instr[0].code() << OPCODE_SHIFT
+    for arg, shift in zip(instr[1:], (R1_SHIFT, R2_SHIFT, R3_SHIFT)):
+        match arg:
+            case RegArg(idx):
+                assert 0 <= idx <= REG_FIELD_MASK, f"Register index {idx} does not fit the register field"
+                word |= idx << shift
+            case ImmArg(val):
+                assert 0 <= val <= IMM_MASK, f"Immediate {val} does not fit {IMM_BITS} bits"
+                word |= val
+    return word
+
+
+def decode_instruction(word: int) -> Instruction:
+    """
+    >>> decode_instruction(encode_instruction((Op.ADD, RegArg(1), RegArg(2), RegArg(3))))
+    (ADD, RegArg(idx=1), RegArg(idx=2), RegArg(idx=3))
+    >>> decode_instruction(encode_instruction((Op.ADDI, RegArg(5), RegArg(0), ImmArg(4000000))))
+    (ADDI, RegArg(idx=5), RegArg(idx=0), ImmArg(val=4000000))
+    """
+    code = (word & WORD_MASK) >> OPCODE_SHIFT
+    op = op_from_code(code)
+    assert op is not None, f"Unknown opcode '{code}'"
+    r1 = RegArg((word >> R1_SHIFT) & REG_FIELD_MASK)
+    r2 = RegArg((word >> R2_SHIFT) & REG_FIELD_MASK)
+    match op.type():
+        case OpType.RRR:
+            return (op, r1, r2, RegArg((word >> R3_SHIFT) & REG_FIELD_MASK))
+        case OpType.RRI:
+            return (op, r1, r2, ImmArg(word & IMM_MASK))
+    return (op,)
+
+
+def encode_word(word: MemoryWord) -> int:
+    if isinstance(word, int):
+        assert 0 <= word <= WORD_MASK, f"Data word {word} does not fit 32 bits"
+        return word
+    return encode_instruction(word)
+
 
 class ALUControl(Enum):
     add = iota()
@@ -97,28 +162,28 @@ class ALUControl(Enum):
     mask_thrd_r = iota()
     mask_imm = iota_reset()
 
-    def call(self, x: MemoryWord, y: MemoryWord) -> tuple[MemoryWord, bool]:
-        match self, x, y:
-            case ALUControl.add, int(x), int(y):
-                return (x + y, x + y > 0xFFFFFFFF)
-            case ALUControl.band, int(x), int(y):
+    def call(self, x: int, y: int) -> tuple[int, bool]:
+        match self:
+            case ALUControl.add:
+                return (x + y, x + y > WORD_MASK)
+            case ALUControl.band:
                 return (x & y, False)
-            case ALUControl.shr, int(x), int(y):
+            case ALUControl.shr:
                 return (x >> y, False)
-            case ALUControl.inc, int(x), _:
-                return (x + 1, x + 1 > 0xFFFFFFFF)
-            case ALUControl.sub, int(x), int(y):
+            case ALUControl.inc:
+                return (x + 1, x + 1 > WORD_MASK)
+            case ALUControl.sub:
                 return (x - y, x < y)
-            case ALUControl.only_x, x, _:
+            case ALUControl.only_x:
                 return (x, False)
-            case ALUControl.mask_fst_r, (_, RegArg(r), _, _), _:
-                return (r, False)
-            case ALUControl.mask_snd_r, (_, _, RegArg(r), _), _:
-                return (r, False)
-            case ALUControl.mask_thrd_r, (_, _, _, RegArg(r)), _:
-                return (r, False)
-            case ALUControl.mask_imm, (_, _, _, ImmArg(n)), _:
-                return (n, False)
+            case ALUControl.mask_fst_r:
+                return ((x >> R1_SHIFT) & REG_FIELD_MASK, False)
+            case ALUControl.mask_snd_r:
+                return ((x >> R2_SHIFT) & REG_FIELD_MASK, False)
+            case ALUControl.mask_thrd_r:
+                return ((x >> R3_SHIFT) & REG_FIELD_MASK, False)
+            case ALUControl.mask_imm:
+                return (x & IMM_MASK, False)
         assert False, f"Unsupported ALU operation: '{self}' '{x}' '{y}'"
 
 
@@ -130,6 +195,7 @@ class MIJump(NamedTuple):
     if_zero: int = -1
     if_carry: int = -1
     if_op: tuple[Op, int] = (Op.HALT, -1)
+    dispatch: tuple[int, ...] = ()
     to: int = -1
 
     def __repr__(self) -> str:
@@ -142,6 +208,8 @@ class MIJump(NamedTuple):
             res += f" C -> {self.if_carry}"
         if self.if_op[1] != -1:
             res += f" {self.if_op[0].name} -> {self.if_op[1]}"
+        if len(self.dispatch) > 0:
+            res += " dispatch -> " + ", ".join(f"{op.name}:{self.dispatch[op.code()]}" for op in Op)
         return res
 
 
@@ -164,10 +232,73 @@ class MIOperation(NamedTuple):
 MInstruction: TypeAlias = MIOperation | MIJump
 
 
+class Section(NamedTuple):
+    address: int
+    words: memoryview
+
+
 class Program(NamedTuple):
     start: int
     instructions: list[MemoryWord]
 
+    def sections(self) -> Iterator[Section]:
+        yield Section(ORIGIN, memoryview(array("I", [encode_word(word) for word in self.instructions])))
+
+
+OBJECT_MAGIC: Final[bytes] = b"ASMO"
+OBJECT_VERSION: Final[int] = 1
+_OBJECT_HEADER: Final[struct.Struct] = struct.Struct("<4sHHI")
+_OBJECT_SECTION: Final[struct.Struct] = struct.Struct("<II")
+
+
+class ObjectImage:
+    """Binary object file: a header (magic, version, section count, start address)
+    followed by sections, each an address, a word count and little-endian 32-bit words.
+    Sections are read lazily as views into the underlying buffer.
+    """
+
+    start: int
+    section_count: int
+    _buffer: memoryview
+
+    def __init__(self, buffer: bytes | mmap.mmap) -> None:
+        self._buffer = memoryview(buffer)
+        magic, version, self.section_count, self.start = _OBJECT_HEADER.unpack_from(self._buffer)
+        assert magic == OBJECT_MAGIC, "Not an object file"
+        assert version == OBJECT_VERSION, f"Unsupported object file version {version}"
+
+    def sections(self) -> Iterator[Section]:
+        offset = _OBJECT_HEADER.size
+        for _ in range(self.section_count):
+            address, length = _OBJECT_SECTION.unpack_from(self._buffer, offset)
+            offset += _OBJECT_SECTION.size
+            words = self._buffer[offset : offset + 4 * length]
+            assert len(words) == 4 * length, "Truncated object file section"
+            offset += 4 * length
+            if sys.byteorder == "little":
+                yield Section(address, words.cast("I"))
+            else:
+                swapped = array("I", words.tobytes())
+                swapped.byteswap()
+                yield Section(address, memoryview(swapped))
+
+    def release(self) -> None:
+        self._buffer.release()
+
+
+LoadableProgram: TypeAlias = Union[Program, ObjectImage]
+
+
+def memory_image(program: LoadableProgram) -> array[int]:
+    memory = array("I", [0]) * MEMORY_SIZE
+    with memoryview(memory) as view:
+        for section in program.sections():
+            end = section.address + len(section.words)
+            assert end <= MEMORY_SIZE, f"Section at {section.address} does not fit into memory"
+            view[section.address : end] = section.words
+            section.words.release()
+    return memory
+
 
 class ProgramEncoder(json.JSONEncoder):
     def default(self, obj: Op | object) -> object:
@@ -177,7 +308,7 @@ class ProgramEncoder(json.JSONEncoder):
 
 
 def instruction_from_tuple(tup: tuple[int, ...]) -> Instruction:
-    op = next(op for op in Op if op.code() == tup[0])
+    op = op_from_code(tup[0])
     assert op is not None, f"Unknown opcode '{tup[0]}'"
     match op.type(), tup[1:]:
         case OpType.RRR, ([int(r1)], [int(r2)], [int(r3)]):
@@ -190,7 +321,40 @@ def instruction_from_tuple(tup: tuple[int, ...]) -> Instruction:
 
 
 def write_program(program: Program, out: TextIO) -> None:
-    json.dump(program, out, cls=ProgramEncoder)
+    out.write(json.dumps(program, cls=ProgramEncoder))
+
+
+def write_object(program: Program, out: BinaryIO) -> None:
+    words = array("I", [encode_word(word) for word in program.instructions])
+    if sys.byteorder != "little":
+        words.byteswap()
+    out.write(_OBJECT_HEADER.pack(OBJECT_MAGIC, OBJECT_VERSION, 1, program.start))
+    out.write(_OBJECT_SECTION.pack(ORIGIN, len(words)))
+    out.write(words.tobytes())
+
+
+def load_program(path: str) -> LoadableProgram:
+    """Reads a program into memory, unlike `open_program` which keeps an object file mapped"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if data.startswith(OBJECT_MAGIC):
+        return ObjectImage(data)
+    return read_program(io.StringIO(data.decode("utf-8")))
+
+
+@contextlib.contextmanager
+def open_program(path: str) -> Iterator[LoadableProgram]:
+    with open(path, "rb") as f:
+        if f.read(len(OBJECT_MAGIC)) != OBJECT_MAGIC:
+            f.seek(0)
+            yield read_program(io.TextIOWrapper(f, encoding="utf-8"))
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            image = ObjectImage(mapped)
+            try:
+                yield image
+            finally:
+                image.release()
 
 
 def read_program(src: TextIO) -> Program:
@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+import contextlib
+import io
+import os
+import pathlib
+
+import isa
+import machine
+import translator
+
+
+def test_binary_object_runs_like_json(tmp_path: os.PathLike[str]) -> None:
+    source = os.path.join(tmp_path, "source.asm")
+    input_stream = os.path.join(tmp_path, "input.txt")
+    with open(source, "w", encoding="utf-8") as file:
+        file.write((pathlib.Path(__file__).parent.parent / "examples" / "hello_user_name.asm").read_text())
+    with open(input_stream, "w", encoding="utf-8") as file:
+        file.write("Alice")
+
+    outputs = []
+    for binary in (False, True):
+        target = os.path.join(tmp_path, f"target_{binary}.o")
+        translator.main(source, target, binary=binary)
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            machine.main(target, input_stream)
+        outputs.append(stdout.getvalue())
+
+    assert outputs[0] == outputs[1] == "What is your name?\nHello, Alice"
+    with isa.open_program(os.path.join(tmp_path, "target_True.o")) as image:
+        assert isinstance(image, isa.ObjectImage)
+        [section] = list(image.sections())
+        with section.words as words:
+            loaded = words.tolist()
+    program = translator.parse(open(source).read())
+    assert image.start == program.start
+    assert loaded == [isa.encode_word(word) for word in program.instructions]
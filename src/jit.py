@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, Callable, Final, Optional, TypeAlias
+
+import isa
+from costs import InstructionCost, instruction_costs, limits
+from isa import Op
+from paging import PAGE_MASK, PAGE_SHIFT
+
+if TYPE_CHECKING:
+    from machine import DataPath
+    from paging import Page
+
+MAX_BLOCK_LEN: Final[int] = 256
+
+Block: TypeAlias = Callable[[list[int], "list[Page]", "JitUnit"], int]
+
+
+class JitUnit:
+    """Compiles straight-line runs of guest code ending in `BEQ`/`BLEQ`/`HALT` into Python functions.
+
+    Blocks are cached by their start address and dropped when a store hits an address
+    they were compiled from. Each block adds the ticks its instructions would take in the
+    microcode, so the counters match `ControlUnit`. Budgets are checked between blocks, so a run
+    may overshoot them by up to one block.
+    """
+
+    data_path: DataPath
+    mpc: Final[int] = 0
+    ticks: int
+    instructions: int
+    _costs: dict[Op, InstructionCost]
+    _blocks: dict[int, Block]
+    _block_ranges: dict[int, range]
+    _code_addrs: dict[int, set[int]]
+    _dropped: bool
+
+    def __init__(self, microcode: list[isa.MInstruction], data_path: DataPath) -> None:
+        self.data_path = data_path
+        self.ticks = 0
+        self.instructions = 0
+        self._costs = instruction_costs(microcode)
+        self._blocks = {}
+        self._block_ranges = {}
+        self._code_addrs = {}
+        self._dropped = False
+        data_path.memory.write_listeners.append(self._forget)
+
+    def run(self, max_ticks: Optional[int] = None, max_instructions: Optional[int] = None) -> bool:
+        registers = self.data_path.registers
+        pages = self.data_path.memory.pages
+        tick_limit, instruction_limit = limits(max_ticks, max_instructions)
+        pc = registers[isa.PC]
+        try:
+            while self.ticks < tick_limit and self.instructions < instruction_limit:
+                block = self._blocks.get(pc)
+                if block is None:
+                    block = self._compile(pc)
+                pc = block(registers, pages, self)
+        except StopIteration:
+            return True
+        registers[isa.PC] = pc
+        return False
+
+    def restore(self, mpc: int, ticks: int, instructions: int) -> None:
+        assert mpc == 0, "The JIT engine can only resume between instructions"
+        self.ticks = ticks
+        self.instructions = instructions
+
+    def load(self, address: int) -> int:
+        self.data_path.registers[isa.AR] = address
+        self.data_path.signal_mem_rd()
+        return self.data_path.registers[isa.DR]
+
+    def store(self, address: int, data: int) -> bool:
+        """Whether the store dropped compiled code, so the running block must not go on past it.
+
+        A device such as DMA may write memory far from `address`, which drops code through `_forget`.
+        """
+        self._dropped = False
+        self.data_path.registers[isa.AR] = address
+        self.data_path.registers[isa.DR] = data
+        self.data_path.signal_mem_wr()
+        if address in self._code_addrs:
+            self._invalidate(address)
+        return self._dropped
+
+    def compiled_blocks(self) -> list[range]:
+        return list(self._block_ranges.values())
+
+    def _forget(self, address: int, count: int) -> None:
+        for written in range(address, address + count):
+            if written in self._code_addrs:
+                self._invalidate(written)
+
+    def _invalidate(self, address: int) -> None:
+        self._dropped = True
+        for start in self._code_addrs.pop(address, set()):
+            del self._blocks[start]
+            for pc in self._block_ranges.pop(start):
+                starts = self._code_addrs.get(pc)
+                if starts is not None:
+                    starts.discard(start)
+                    if len(starts) == 0:
+                        del self._code_addrs[pc]
+
+    def _compile(self, start: int) -> Block:
+        instrs = self._scan(start)
+        namespace: dict[str, Any] = {}
+        exec(compile(generate_block(start, instrs, self._costs), f"<block {start}>", "exec"), namespace)
+        block: Block = namespace["block"]
+        self._blocks[start] = block
+        self._block_ranges[start] = range(start, start + len(instrs))
+        for pc in self._block_ranges[start]:
+            self._code_addrs.setdefault(pc, set()).add(start)
+        return block
+
+    def _scan(self, start: int) -> list[isa.Instruction]:
+        memory = self.data_path.memory
+        instrs: list[isa.Instruction] = []
+        pc = start
+        while len(instrs) < MAX_BLOCK_LEN and pc < len(memory):
+            if isa.op_from_code(memory[pc] >> isa.OPCODE_SHIFT) is None:
+                break
+            instr = isa.decode_instruction(memory[pc])
+            instrs.append(instr)
+            if instr[0] in (Op.BEQ, Op.BLEQ, Op.HALT):
+                break
+            pc += 1
+        assert len(instrs) > 0, f"Unknown opcode '{memory[start] >> isa.OPCODE_SHIFT}'"
+        return instrs
+
+
+class _Emitter:
+    lines: list[str]
+    costs: dict[Op, InstructionCost]
+    ticks: int
+    instructions: int
+    dirty: set[int]
+
+    def __init__(self, costs: dict[Op, InstructionCost]) -> None:
+        self.lines = []
+        self.costs = costs
+        self.ticks = 0
+        self.instructions = 0
+        self.dirty = set()
+
+    def emit(self, line: str, indent: int = 1) -> None:
+        self.lines.append("    " * indent + line)
+
+    def exit(self, next_pc: int | str, ticks: int, *, indent: int = 1, halt: bool = False) -> None:
+        for reg in sorted(self.dirty):
+            self.emit(f"regs[{reg}] = r{reg}", indent)
+        self.emit(f"unit.ticks += {ticks}", indent)
+        self.emit(f"unit.instructions += {self.instructions}", indent)
+        if halt:
+            self.emit(f"regs[{isa.PC}] = {next_pc}", indent)
+            self.emit('raise StopIteration("Got halt signal")', indent)
+        else:
+            self.emit(f"return {next_pc}", indent)
+
+
+def generate_block(start: int, instrs: list[isa.Instruction], costs: dict[Op, InstructionCost]) -> str:
+    e = _Emitter(costs)
+    used = sorted({arg.idx for instr in instrs for arg in instr[1:] if isinstance(arg, isa.RegArg) and arg.idx != 0})
+    e.lines.append("def block(regs, mem, unit):")
+    for reg in used:
+        e.emit(f"r{reg} = regs[{reg}]")
+    for pc, instr in enumerate(instrs, start):
+        e.emit(f"# {pc}: {instr[0].name.lower()} {', '.join(_arg_repr(arg) for arg in instr[1:])}")
+        e.instructions += 1
+        _EMITTERS[instr[0]](e, pc, instr)
+    if instrs[-1][0] not in (Op.BEQ, Op.BLEQ, Op.HALT):
+        e.exit(start + len(instrs), e.ticks)
+    return "\n".join(e.lines) + "\n"
+
+
+def _arg_repr(arg: isa.RegArg | isa.ImmArg) -> str:
+    if isinstance(arg, isa.RegArg):
+        return f"${arg.idx}"
+    return str(arg.val)
+
+
+def _reg(arg: isa.RegArg) -> str:
+    return "0" if arg.idx == 0 else f"r{arg.idx}"
+
+
+def _set(e: _Emitter, arg: isa.RegArg, expr: str) -> None:
+    if arg.idx == 0:
+        e.emit(f"_ = {expr}")
+        return
+    e.emit(f"r{arg.idx} = {expr}")
+    e.dirty.add(arg.idx)
+
+
+def _emit_lw(e: _Emitter, pc: int, instr: tuple[Op, isa.RegArg, isa.RegArg, isa.ImmArg]) -> None:
+    _, r1, r2, imm = instr
+    e.ticks += e.costs[Op.LW].not_taken
+    if r2.idx != 0:
+        e.emit(f"a = {_reg(r2)} + {imm.val}")
+        _set(e, r1, f"mem[a >> {PAGE_SHIFT}][a & {PAGE_MASK}] if a != {isa.INPUT_DEVICE_ADDR} else unit.load(a)")
+    elif imm.val == isa.INPUT_DEVICE_ADDR:
+        _set(e, r1, f"unit.load({imm.val})")
+    else:
+        _set(e, r1, f"mem[{imm.val >> PAGE_SHIFT}][{imm.val & PAGE_MASK}]")
+
+
+def _emit_sw(e: _Emitter, pc: int, instr: tuple[Op, isa.RegArg, isa.RegArg, isa.ImmArg]) -> None:
+    _, r1, r2, imm = instr
+    e.ticks += e.costs[Op.SW].not_taken
+    e.emit(f"if unit.store({_reg(r2)} + {imm.val}, {_reg(r1)}):")
+    e.exit(pc + 1, e.ticks, indent=2)
+
+
+def _emit_branch(e: _Emitter, pc: int, instr: tuple[Op, isa.RegArg, isa.RegArg, isa.ImmArg]) -> None:
+    op, r1, r2, imm = instr
+    cmp = "==" if op == Op.BEQ else "<="
+    e.emit(f"if {_reg(r1)} {cmp} {_reg(r2)}:")
+    e.exit(imm.val, e.ticks + e.costs[op].taken, indent=2)
+    e.exit(pc + 1, e.ticks + e.costs[op].not_taken)
+
+
+def _emit_halt(e: _Emitter, pc: int, instr: tuple[Op]) -> None:
+    e.exit(pc, e.ticks + e.costs[Op.HALT].not_taken, halt=True)
+
+
+def _binary(sign: str) -> Callable[[_Emitter, int, Any], None]:
+    def emit(e: _Emitter, pc: int, instr: tuple[Op, isa.RegArg, isa.RegArg, isa.RegArg | isa.ImmArg]) -> None:
+        op, r1, r2, y = instr
+        e.ticks += e.costs[op].not_taken
+        _set(e, r1, f"{_reg(r2)} {sign} {_reg(y) if isinstance(y, isa.RegArg) else y.val}")
+
+    return emit
+
+
+_EMITTERS: Final[dict[Op, Callable[[_Emitter, int, Any], None]]] = {
+    Op.LW: _emit_lw,
+    Op.SW: _emit_sw,
+    Op.BEQ: _emit_branch,
+    Op.BLEQ: _emit_branch,
+    Op.ADDI: _binary("+"),
+    Op.ANDI: _binary("&"),
+    Op.ADD: _binary("+"),
+    Op.SUB: _binary("-"),
+    Op.SHR: _binary(">>"),
+    Op.HALT: _emit_halt,
+}
@@ -0,0 +1,266 @@
+from __future__ import annotations
+
+import collections
+from array import array
+from typing import TYPE_CHECKING, Any, Final, NamedTuple, Optional
+
+import isa
+from devices import BufferInput, BufferOutput, DmaController
+from machine import ControlUnit, at_access, memory_accesses
+from paging import PAGE_MASK, PAGE_SHIFT, PagedMemory
+
+if TYPE_CHECKING:
+    from machine import DataPath
+
+WINDOW: Final[int] = 1_000_000
+CHECKPOINTS: Final[int] = 16
+"""Checkpoints in a window, unless the interval is given"""
+
+_ZERO: Final[int] = 1
+_CARRY: Final[int] = 2
+_REGISTER: Final[int] = 4
+_ACCESS: Final[int] = 8
+_STORE: Final[int] = 16
+_DMA: Final[int] = 32
+_MPC_SHIFT: Final[int] = 6
+_TICK_SHIFT: Final[int] = 22
+_MPC_MASK: Final[int] = (1 << _TICK_SHIFT) - (1 << _MPC_SHIFT)
+_ITEMS: Final[tuple[tuple[int, int], ...]] = ((_REGISTER, 2), (_ACCESS, 3), (_STORE, 2), (_DMA, 4))
+_DMA_PORTS: Final[range] = range(isa.DMA_ADDR, isa.DMA_ADDR + DmaController.PORTS)
+
+
+class Checkpoint(NamedTuple):
+    mpc: int
+    ticks: int
+    instructions: int
+    registers: list[int]
+    carry: bool
+    zero: bool
+    input_pos: int
+    output_written: int
+    dma: tuple[int, int, bool]
+    pages: dict[int, array[int]]
+    """RAM of the pages resident at the checkpoint; the others are all zeros"""
+
+
+class _Segment(NamedTuple):
+    """A checkpoint and the undo records of the microinstructions executed after it"""
+
+    checkpoint: Checkpoint
+    headers: array[int]
+    items: list[Any]
+
+
+class Journal:
+    """Undo journal of a `ControlUnit`, which calls `record` before every microinstruction.
+
+    A record holds only what the microinstruction is about to change: the old value of the
+    register it writes, the flags, and for memory accesses the old DR, the I/O positions, the
+    old word it stores over and the DMA state. Headers pack the tick, `mpc` and which of these
+    follow into one 64-bit word, so a record of a register write takes about 24 bytes.
+
+    Every `checkpoint_interval` ticks a full checkpoint of the machine starts a new segment,
+    and segments older than `window` ticks are dropped. Going back far restores the nearest
+    checkpoint and re-executes from it, so it never takes longer than an interval.
+
+    Undoing I/O rewinds the devices, so the unit must read a `BufferInput` and write a `BufferOutput`.
+
+    >>> import translator
+    >>> from machine import DataPath
+    >>> from microcode import PROFILES
+    >>> program = translator.parse('start: addi $1, $0, 5\\n sw $1, $0, 100\\n halt')
+    >>> journal = Journal(PROFILES["classic"])
+    >>> unit = ControlUnit(PROFILES["classic"], DataPath(program, BufferInput([0]), BufferOutput()), journal=journal)
+    >>> unit.run()
+    True
+    >>> tick = journal.last_write(100)
+    >>> tick
+    23
+    >>> journal.run_back_to(unit, tick)
+    >>> (unit.data_path.memory[100], unit.instructions, unit.data_path.registers[1])
+    (0, 2, 5)
+    """
+
+    window: int
+    checkpoint_interval: int
+    _accessing: frozenset[int]
+    _segments: collections.deque[_Segment]
+
+    def __init__(
+        self, microcode: list[isa.MInstruction], window: int = WINDOW, checkpoint_interval: Optional[int] = None
+    ) -> None:
+        self.window = window
+        self.checkpoint_interval = checkpoint_interval or max(1, window // CHECKPOINTS)
+        self._accessing = memory_accesses(microcode)
+        self._segments = collections.deque()
+
+    @property
+    def oldest(self) -> int:
+        """The earliest tick the unit can go back to"""
+        assert len(self._segments) > 0, "Nothing is journaled yet"
+        return self._segments[0].checkpoint.ticks
+
+    def record(self, unit: ControlUnit) -> None:
+        """Called before the unit executes the microinstruction at `unit.mpc`"""
+        if len(self._segments) == 0 or unit.ticks >= self._segments[-1].checkpoint.ticks + self.checkpoint_interval:
+            self._checkpoint(unit)
+        segment = self._segments[-1]
+        if len(segment.headers) > 0 and segment.headers[-1] >> _TICK_SHIFT == unit.ticks:
+            self._undo(unit, segment)  # the last attempt at this tick did not finish, e.g. `HALT`
+        data_path = unit.data_path
+        registers = data_path.registers
+        minstr = unit.microcode[unit.mpc]
+        flags = (_ZERO if data_path.zero else 0) | (_CARRY if data_path.carry else 0)
+        items = segment.items
+        if isinstance(minstr, isa.MIOperation):
+            register = registers[isa.AR] & isa.IND_AR_MASK if minstr.rwr_sel == isa.IND_AR else minstr.rwr_sel
+            if 0 < register < isa.REG_N:
+                flags |= _REGISTER
+                items += (register, registers[register])
+        if unit.mpc in self._accessing:
+            assert isinstance(minstr, isa.MIOperation)
+            flags |= self._record_access(minstr, data_path, items)
+        segment.headers.append(unit.ticks << _TICK_SHIFT | unit.mpc << _MPC_SHIFT | flags)
+
+    def step_back(self, unit: ControlUnit, ticks: int = 1) -> None:
+        self.run_back_to(unit, unit.ticks - ticks)
+
+    def run_back_to(self, unit: ControlUnit, tick: int) -> None:
+        """Brings the unit back to the state it had before executing `tick`"""
+        assert self.oldest <= tick <= unit.ticks, f"Tick {tick} is outside the journal ({self.oldest}-{unit.ticks})"
+        segment = self._segments[-1]
+        if segment.checkpoint.ticks <= tick and unit.ticks - tick <= tick - segment.checkpoint.ticks:
+            while len(segment.headers) > 0 and segment.headers[-1] >> _TICK_SHIFT >= tick:
+                self._undo(unit, segment)
+            return
+        while self._segments[-1].checkpoint.ticks > tick:
+            self._segments.pop()
+        segment = self._segments[-1]
+        self._restore(unit, segment.checkpoint)
+        del segment.headers[:]
+        segment.items.clear()
+        ControlUnit.run(unit, tick)
+
+    def instruction_start(self, count: int = 1) -> int:
+        """Tick of the `count`-th last instruction fetch in the journal, or the oldest tick"""
+        for segment in reversed(self._segments):
+            for header in reversed(segment.headers):
+                if header & _MPC_MASK == 0:
+                    count -= 1
+                    if count == 0:
+                        tick: int = header >> _TICK_SHIFT
+                        return tick
+        return self.oldest
+
+    def last_write(self, address: int) -> Optional[int]:
+        """Tick of the last microinstruction in the journal that stored to `address`.
+
+        A DMA transfer into RAM counts for every word it could have copied.
+        """
+        for segment in reversed(self._segments):
+            end = len(segment.items)
+            for header in reversed(segment.headers):
+                start = end - sum(count for flag, count in _ITEMS if header & flag)
+                if _writes(header, segment.items[start:end], address):
+                    tick: int = header >> _TICK_SHIFT
+                    return tick
+                end = start
+        return None
+
+    def _record_access(self, minstr: isa.MIOperation, data_path: DataPath, items: list[Any]) -> int:
+        registers = data_path.registers
+        assert isinstance(data_path.input_device, BufferInput), "Only buffered input can be rewound"
+        items += (registers[isa.DR], data_path.input_device.pos, data_path.output_device.written)
+        flags = _ACCESS
+        address = at_access(minstr, registers, isa.AR)
+        if minstr.mem_wr:
+            flags |= _STORE
+            items += (address, data_path.memory.ram(address >> PAGE_SHIFT)[address & PAGE_MASK])
+        if address in _DMA_PORTS:
+            flags |= _DMA
+            dma = data_path.dma
+            block: Optional[array[int]] = None
+            if minstr.mem_wr and address == isa.DMA_ADDR + 1:
+                count = at_access(minstr, registers, isa.DR) & isa.WORD_MASK
+                block = data_path.memory.read_words(dma.address, min(count, data_path.memory.size - dma.address))
+            items += (dma.address, dma.copied, dma.ended, block)
+        return flags
+
+    def _undo(self, unit: ControlUnit, segment: _Segment) -> None:
+        header = segment.headers.pop()
+        items = segment.items
+        data_path = unit.data_path
+        memory = data_path.memory
+        if header & _DMA:
+            block, ended, copied, dma_address = (items.pop() for _ in range(4))
+            if block is not None:
+                _write_ram(memory, dma_address, block)
+            data_path.dma.address, data_path.dma.copied, data_path.dma.ended = dma_address, copied, ended
+        if header & _STORE:
+            old, address = items.pop(), items.pop()
+            memory.ram(address >> PAGE_SHIFT)[address & PAGE_MASK] = old
+        if header & _ACCESS:
+            written, pos, dr = items.pop(), items.pop(), items.pop()
+            _rewind(data_path, pos, written)
+            data_path.registers[isa.DR] = dr
+        if header & _REGISTER:
+            old, register = items.pop(), items.pop()
+            data_path.registers[register] = old
+        data_path.zero = bool(header & _ZERO)
+        data_path.carry = bool(header & _CARRY)
+        mpc = (header & _MPC_MASK) >> _MPC_SHIFT
+        unit.restore(mpc, header >> _TICK_SHIFT, unit.instructions - (mpc == 1))
+
+    def _checkpoint(self, unit: ControlUnit) -> None:
+        data_path = unit.data_path
+        memory = data_path.memory
+        dma = data_path.dma
+        checkpoint = Checkpoint(
+            mpc=unit.mpc,
+            ticks=unit.ticks,
+            instructions=unit.instructions,
+            registers=data_path.registers.copy(),
+            carry=data_path.carry,
+            zero=data_path.zero,
+            input_pos=data_path.input_device.pos,
+            output_written=data_path.output_device.written,
+            dma=(dma.address, dma.copied, dma.ended),
+            pages={number: array("I", memory.ram(number)) for number in memory.resident_pages()},
+        )
+        self._segments.append(_Segment(checkpoint, array("q"), []))
+        while len(self._segments) > 1 and unit.ticks - self._segments[1].checkpoint.ticks >= self.window:
+            self._segments.popleft()
+
+    def _restore(self, unit: ControlUnit, checkpoint: Checkpoint) -> None:
+        data_path = unit.data_path
+        memory = data_path.memory
+        for number in memory.resident_pages():
+            ram = memory.ram(number)
+            ram[:] = checkpoint.pages.get(number, array("I", [0]) * len(ram))
+        data_path.registers[:] = checkpoint.registers
+        data_path.carry = checkpoint.carry
+        data_path.zero = checkpoint.zero
+        data_path.dma.address, data_path.dma.copied, data_path.dma.ended = checkpoint.dma
+        _rewind(data_path, checkpoint.input_pos, checkpoint.output_written)
+        unit.restore(checkpoint.mpc, checkpoint.ticks, checkpoint.instructions)
+
+
+def _writes(header: int, items: list[Any], address: int) -> bool:
+    if header & _DMA and items[-1] is not None and items[-4] <= address < items[-4] + len(items[-1]):
+        return True
+    return bool(header & _STORE) and items[-6 if header & _DMA else -2] == address
+
+
+def _write_ram(memory: PagedMemory, address: int, words: array[int]) -> None:
+    for offset, word in enumerate(words):
+        ram = memory.ram((address + offset) >> PAGE_SHIFT)
+        if ram[(address + offset) & PAGE_MASK] != word:  # words of pages that were never written are still zero
+            ram[(address + offset) & PAGE_MASK] = word
+
+
+def _rewind(data_path: DataPath, input_pos: int, output_written: int) -> None:
+    input_device, output_device = data_path.input_device, data_path.output_device
+    assert isinstance(input_device, BufferInput), "Only buffered input can be rewound"
+    assert isinstance(output_device, BufferOutput), "Only buffered output can be rewound"
+    input_device.pos = input_pos
+    del output_device.buffer[output_written:]
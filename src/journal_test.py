@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import pathlib
+
+import pytest
+
+import devices
+import isa
+import snapshot
+import translator
+from journal import Journal
+from machine import ControlUnit, DataPath
+from microcode import PROFILES
+from paging import PagedMemory
+
+_EXAMPLES = pathlib.Path(__file__).parent.parent / "examples"
+_TEXTS = {"hello_user_name": "Alice\n", "cat_dma": "Alice in a DMA wonderland\n" * 3}
+
+
+def _unit(name: str, journal: Journal | None = None) -> tuple[ControlUnit, isa.Program]:
+    program = translator.parse((_EXAMPLES / f"{name}.asm").read_text())
+    data_path = DataPath(
+        program, devices.BufferInput([ord(char) for char in _TEXTS[name]] + [0]), devices.BufferOutput()
+    )
+    return ControlUnit(PROFILES["classic"], data_path, journal=journal), program
+
+
+def _state(unit: ControlUnit, program: isa.Program) -> tuple[object, ...]:
+    data_path = unit.data_path
+    assert isinstance(data_path.input_device, devices.BufferInput)
+    assert isinstance(data_path.output_device, devices.BufferOutput)
+    dma = data_path.dma
+    return (
+        (unit.mpc, unit.ticks, unit.instructions),
+        (data_path.registers.copy(), data_path.zero, data_path.carry),
+        (data_path.input_device.pos, data_path.output_device.text(), dma.address, dma.copied, dma.ended),
+        snapshot.memory_delta(data_path.memory, PagedMemory.from_program(program)),
+    )
+
+
+def _fresh_state(name: str, tick: int) -> tuple[object, ...]:
+    unit, program = _unit(name)
+    unit.run(tick)
+    return _state(unit, program)
+
+
+@pytest.mark.parametrize("name", ["hello_user_name", "cat_dma"])
+def test_going_back_restores_the_state_of_a_fresh_run(name: str) -> None:
+    journal = Journal(PROFILES["classic"], window=10_000, checkpoint_interval=97)
+    unit, program = _unit(name, journal)
+    assert unit.run()
+    end, halted = unit.ticks, _state(unit, program)
+
+    for tick in [end - 1, end - 2, end - 40, end * 2 // 3, end * 2 // 3 - 1, end // 3, 13, 0]:
+        journal.run_back_to(unit, tick)
+        assert _state(unit, program) == _fresh_state(name, tick)
+    assert unit.run()
+    assert _state(unit, program) == halted
+
+
+def test_window_bounds_the_journal() -> None:
+    journal = Journal(PROFILES["classic"], window=500, checkpoint_interval=100)
+    unit, program = _unit("hello_user_name", journal)
+    assert unit.run()
+
+    assert unit.ticks - 600 < journal.oldest <= unit.ticks - 500
+    with pytest.raises(AssertionError, match="outside the journal"):
+        journal.run_back_to(unit, journal.oldest - 1)
+    journal.run_back_to(unit, journal.oldest)
+    assert _state(unit, program) == _fresh_state("hello_user_name", journal.oldest)
+
+
+def test_last_write_finds_stores_and_transfers() -> None:
+    journal = Journal(PROFILES["classic"])
+    unit, program = _unit("cat_dma", journal)
+    assert unit.run()
+    output = isa.OUTPUT_DEVICE_ADDR
+
+    assert journal.last_write(output) is None
+    tick = journal.last_write(isa.DMA_ADDR + 2)
+    assert tick is not None
+    journal.run_back_to(unit, tick + 1)
+    assert unit.data_path.output_device.written == len(_TEXTS["cat_dma"])
+    transfer = journal.last_write(unit.data_path.dma.address)
+    assert transfer is not None
+    assert transfer < tick
+    journal.run_back_to(unit, transfer)
+    assert _state(unit, program) == _fresh_state("cat_dma", transfer)
@@ -4,7 +4,7 @@ import re
 import sys
 from dataclasses import dataclass
 from enum import Enum
-from typing import Callable, Final, NamedTuple, Optional, TypeAlias
+from typing import Callable, Final, Iterator, NamedTuple, Optional, TypeAlias
 
 
 def main(source: str) -> None:
@@ -42,11 +42,18 @@ class Token(NamedTuple):
 
 StateFn: TypeAlias = Callable[["Lexer"], Optional["StateFn"]]
 
+_WS: Final[re.Pattern[str]] = re.compile(r"\s*")
+_INLINE_WS: Final[re.Pattern[str]] = re.compile(r"[^\S\n]*")
+_SEPARATOR: Final[re.Pattern[str]] = re.compile(r"[^\S\n]*,?[^\S\n]*")
+_STATEMENT: Final[re.Pattern[str]] = re.compile(r'(?P<STR>"[^"\n]*")|(?P<LABEL>[a-zA-Z_]+):|(?P<OP>[A-Za-z]+)')
+_ARGUMENT: Final[re.Pattern[str]] = re.compile(
+    r"(?P<ARG_UINT>\d+)|(?P<ARG_REG>\$\d+)|(?P<ARG_LABEL>(?=[^\W\d_])[A-Za-z_]+)"
+)
+
 
 @dataclass
 class Lexer:
     input: str
-    start: int
     pos: int
     tokens: list[Token]
 
@@ -55,147 +62,80 @@ class Lexer:
     @staticmethod
     def new(inp: str) -> Lexer:
         without_comments = "\n".join(line.partition(";")[0] for line in inp.splitlines())
-        return Lexer(input=without_comments, start=0, pos=0, tokens=[])
+        return Lexer(input=without_comments, pos=0, tokens=[])
 
     @staticmethod
     def lex_label_or_op_or_str(l: Lexer) -> Optional[StateFn]:
-        peek = l._peek()
-        if peek == '"':
-            return Lexer.lex_string
-        if re.match(r"^[a-zA-Z_]+:", l.input[l.pos :]):
-            return Lexer.lex_label
-        if peek.isalpha():
-            return Lexer.lex_op
-        if peek == Lexer.EOF:
-            l._emit(TokenType.EOF)
+        if l._peek() == Lexer.EOF:
+            l.tokens.append(Token(TokenType.EOF, ""))
             return None
-        return l._error("Expected label, string, op or EOF")
-
-    @staticmethod
-    def lex_string(l: Lexer) -> Optional[StateFn]:
-        assert l._accept(lambda c: c == '"')
-        l._accept_run(lambda c: c != '"' and c != "\n")
-        assert l._accept(lambda c: c == '"')
-        l._emit(TokenType.STR)
-        l._skip_ws()
-        return Lexer.lex_label_or_op_or_str
-
-    @staticmethod
-    def lex_label(l: Lexer) -> Optional[StateFn]:
-        assert l._accept_run(lambda c: re.match(r"[a-zA-Z_]", c) is not None) > 0
-        l._emit(TokenType.LABEL)
-        assert l._skip(lambda c: c == ":")
-        l._skip_ws()
-        return Lexer.lex_label_or_op_or_str
-
-    @staticmethod
-    def lex_op(l: Lexer) -> Optional[StateFn]:
-        assert l._accept_run(str.isalpha) > 0
-        l._emit(TokenType.OP)
+        match = _STATEMENT.match(l.input, l.pos)
+        if match is None:
+            if l._peek() == '"':
+                return l._error("Unterminated string literal")
+            return l._error("Expected label, string, op or EOF")
+        l._emit(match)
+        l.pos = match.end()
+        if match.lastgroup != TokenType.OP.name:
+            l._skip(_WS)
+            return Lexer.lex_label_or_op_or_str
         if not (l._peek().isspace() or l._peek() == Lexer.EOF):
             return l._error("Expected whitespace or eof after op")
-        l._skip_ws(skip_newline=False)
+        l._skip(_INLINE_WS)
         return Lexer.lex_args
 
     @staticmethod
     def lex_args(l: Lexer) -> Optional[StateFn]:
         peek = l._peek()
         if peek == "\n" or peek == Lexer.EOF:
-            l._skip(lambda c: c == "\n" or c == Lexer.EOF)
-            l._skip_ws()
+            l.pos = min(l.pos + 1, len(l.input))
+            l._skip(_WS)
             return Lexer.lex_label_or_op_or_str
-        if peek.isnumeric():
-            return Lexer.lex_arg_uint
-        if peek == "$":
-            return Lexer.lex_arg_reg
-        if peek.isalpha():
-            return Lexer.lex_arg_label
-        return l._error("Expected register, uint or label argument")
-
-    @staticmethod
-    def lex_arg_uint(l: Lexer) -> Optional[StateFn]:
-        assert l._accept_run(str.isnumeric) > 0
-        l._emit(TokenType.ARG_UINT)
-        l._skip_ws(skip_newline=False)
-        l._skip(lambda c: c == ",")
-        l._skip_ws(skip_newline=False)
-        return Lexer.lex_args
-
-    @staticmethod
-    def lex_arg_reg(l: Lexer) -> Optional[StateFn]:
-        assert l._accept(lambda c: c == "$")
-        if l._accept_run(str.isnumeric) == 0:
-            return l._error("Expected register index")
-        l._emit(TokenType.ARG_REG)
-        l._skip_ws(skip_newline=False)
-        l._skip(lambda c: c == ",")
-        l._skip_ws(skip_newline=False)
-        return Lexer.lex_args
-
-    @staticmethod
-    def lex_arg_label(l: Lexer) -> Optional[StateFn]:
-        assert l._accept_run(lambda c: re.match(r"[A-Za-z_]", c) is not None) > 0
-        l._emit(TokenType.ARG_LABEL)
-        l._skip_ws(skip_newline=False)
-        l._skip(lambda c: c == ",")
-        l._skip_ws(skip_newline=False)
+        match = _ARGUMENT.match(l.input, l.pos)
+        if match is None:
+            if peek == "$":
+                return l._error("Expected register index")
+            return l._error("Expected register, uint or label argument")
+        l._emit(match)
+        l.pos = match.end()
+        l._skip(_SEPARATOR)
         return Lexer.lex_args
 
     def run(self) -> list[Token]:
-        self._skip_ws()
+        self.tokens = list(self.iter_tokens())
+        return self.tokens
+
+    def iter_tokens(self) -> Iterator[Token]:
+        """
+        >>> list(Lexer.new("start: addi $1, $0, 10 ; comment").iter_tokens())
+        [Token(LABEL, 'start'), Token(OP, 'addi'), Token(ARG_REG, '$1'), Token(ARG_REG, '$0'), Token(ARG_UINT, '10'), Token(EOF, '')]
+        >>> list(Lexer.new('msg: "unterminated').iter_tokens())
+        [Token(LABEL, 'msg'), Token(ERROR, 'Unterminat..')]
+        >>> list(Lexer.new("start: ²").iter_tokens())
+        [Token(LABEL, 'start'), Token(ERROR, 'Expected l..')]
+        """
+        self.pos = 0
+        self.tokens = []
+        self._skip(_WS)
         state: Optional[StateFn] = Lexer.lex_label_or_op_or_str
         while state is not None:
             state = state(self)
-        return self.tokens
+            yield from self.tokens
+            self.tokens.clear()
 
-    def _emit(self, ty: TokenType) -> None:
-        self.tokens.append(Token(type=ty, literal=self.input[self.start : self.pos]))
-        self.start = self.pos
+    def _emit(self, match: re.Match[str]) -> None:
+        assert match.lastgroup is not None
+        self.tokens.append(Token(type=TokenType[match.lastgroup], literal=match.group(match.lastgroup)))
 
-    def _next(self) -> str:
+    def _peek(self) -> str:
         if self.pos >= len(self.input):
-            self.pos = len(self.input) + 1
             return Lexer.EOF
-        c = self.input[self.pos]
-        self.pos += 1
-        return c
+        return self.input[self.pos]
 
-    def _backup(self) -> None:
-        self.pos = max(0, self.pos - 1)
-
-    def _ignore(self) -> None:
-        self.start = self.pos
-
-    def _peek(self) -> str:
-        c = self._next()
-        self._backup()
-        return c
-
-    def _accept(self, valid: Callable[[str], bool]) -> bool:
-        if valid(self._next()):
-            return True
-        self._backup()
-        return False
-
-    def _accept_run(self, valid: Callable[[str], bool]) -> int:
-        length = 0
-        while valid(self._next()):
-            length += 1
-        self._backup()
-        return length
-
-    def _skip(self, skip: Callable[[str], bool]) -> bool:
-        skipped = self._accept(skip)
-        self._ignore()
-        return skipped
-
-    def _skip_run(self, skip: Callable[[str], bool]) -> int:
-        skipped = self._accept_run(skip)
-        self._ignore()
-        return skipped
-
-    def _skip_ws(self, *, skip_newline: bool = True) -> int:
-        return self._skip_run(lambda c: c.isspace() and (skip_newline or c != "\n"))
+    def _skip(self, pattern: re.Pattern[str]) -> None:
+        match = pattern.match(self.input, self.pos)
+        assert match is not None
+        self.pos = match.end()
 
     def _error(self, msg: str) -> StateFn:
         def error_state_fn(l: Lexer) -> Optional[StateFn]:
@@ -0,0 +1,270 @@
+from __future__ import annotations
+
+import argparse
+import json
+from typing import Callable, Final, Optional, TypeVar
+
+import numpy as np
+import numpy.typing as npt
+
+import isa
+from costs import limits
+from devices import DmaController
+from machine import SimulationResult
+from microcode import PROFILES
+
+Array = npt.NDArray[np.int64]
+Rows = npt.NDArray[np.intp]
+Flags = npt.NDArray[np.bool_]
+_Item = TypeVar("_Item", bound=np.generic)
+
+_ALU: Final[dict[isa.ALUControl, Callable[[Array, Array], tuple[Array, Flags]]]] = {
+    isa.ALUControl.add: lambda x, y: (x + y, x + y > isa.WORD_MASK),
+    isa.ALUControl.band: lambda x, y: (x & y, np.zeros_like(x, dtype=bool)),
+    isa.ALUControl.inc: lambda x, _: (x + 1, x + 1 > isa.WORD_MASK),
+    isa.ALUControl.sub: lambda x, y: (x - y, x < y),
+    isa.ALUControl.shr: lambda x, y: (x >> y, np.zeros_like(x, dtype=bool)),
+    isa.ALUControl.only_x: lambda x, _: (x, np.zeros_like(x, dtype=bool)),
+    isa.ALUControl.mask_fst_r: lambda x, _: ((x >> isa.R1_SHIFT) & isa.REG_FIELD_MASK, np.zeros_like(x, dtype=bool)),
+    isa.ALUControl.mask_snd_r: lambda x, _: ((x >> isa.R2_SHIFT) & isa.REG_FIELD_MASK, np.zeros_like(x, dtype=bool)),
+    isa.ALUControl.mask_thrd_r: lambda x, _: ((x >> isa.R3_SHIFT) & isa.REG_FIELD_MASK, np.zeros_like(x, dtype=bool)),
+    isa.ALUControl.mask_imm: lambda x, _: (x & isa.IMM_MASK, np.zeros_like(x, dtype=bool)),
+}
+_OVERFLOW: Final[dict[isa.ALUControl, Callable[[Array, Array, Array], Flags]]] = {
+    isa.ALUControl.add: lambda x, y, result: ((x ^ result) & (y ^ result)) < 0,
+    isa.ALUControl.inc: lambda x, _, result: ((x ^ result) & (1 ^ result)) < 0,
+    isa.ALUControl.sub: lambda x, y, result: ((x ^ y) & (x ^ result)) < 0,
+}
+"""Results that wrapped around 64 bits, while `ControlUnit` registers are unbounded"""
+
+
+class LockstepUnit:
+    """Runs one program on many inputs at once, one microinstruction of every machine per step.
+
+    Machines are grouped by their `mpc` each step and every group executes its microinstruction
+    with array operations, so machines that stay in sync cost one group. Memory is a shared image
+    plus diff columns: the first write to an address copies it into a column for every machine.
+    Registers are 64-bit, while `ControlUnit` keeps unbounded ALU results, so a machine whose
+    result does not fit in 64 bits stops and is `failed`.
+
+    A machine that would make `ControlUnit` fail (memory access outside of it, a read from empty
+    input, an unknown opcode or an indirect access to a missing register) stops and is `failed` too.
+    Only the character ports are modelled, so starting a DMA transfer fails the machine too.
+    """
+
+    microcode: list[isa.MInstruction]
+    registers: Array
+    mpc: Array
+    ticks: Array
+    instructions: Array
+    halted: Flags
+    failed: Flags
+    image: Array
+    _columns: Array
+    _diff: Array
+    _diff_addresses: int
+    _inputs: Array
+    _input_lengths: Array
+    _input_pos: Array
+    _outputs: npt.NDArray[np.uint8]
+    _written: Array
+
+    def __init__(
+        self, microcode: list[isa.MInstruction], program: isa.LoadableProgram, inputs: list[list[int]]
+    ) -> None:
+        n = len(inputs)
+        self.microcode = microcode
+        self.registers = np.zeros((n, isa.REG_N), dtype=np.int64)
+        self.registers[:, isa.PC] = program.start
+        self.mpc = np.zeros(n, dtype=np.int64)
+        self.ticks = np.zeros(n, dtype=np.int64)
+        self.instructions = np.zeros(n, dtype=np.int64)
+        self.halted = np.zeros(n, dtype=bool)
+        self.failed = np.zeros(n, dtype=bool)
+        self.image = np.array(isa.memory_image(program), dtype=np.int64)
+        self._columns = np.full(isa.MEMORY_SIZE, -1, dtype=np.int64)
+        self._diff = np.zeros((n, 16), dtype=np.int64)
+        self._diff_addresses = 0
+        self._input_lengths = np.array([len(buffer) for buffer in inputs], dtype=np.int64)
+        self._inputs = np.zeros((n, max([1, *(len(buffer) for buffer in inputs)])), dtype=np.int64)
+        for row, buffer in enumerate(inputs):
+            self._inputs[row, : len(buffer)] = buffer
+        self._input_pos = np.zeros(n, dtype=np.int64)
+        self._outputs = np.zeros((n, 64), dtype=np.uint8)
+        self._written = np.zeros(n, dtype=np.int64)
+
+    def run(self, max_ticks: Optional[int] = None, max_instructions: Optional[int] = None) -> bool:
+        """Steps until every machine halts, fails or reaches a budget; True when all of them halted"""
+        tick_limit, instruction_limit = limits(max_ticks, max_instructions)
+        while True:
+            running = ~self.halted & ~self.failed & (self.ticks < tick_limit)
+            running &= (self.mpc != 0) | (self.instructions < instruction_limit)
+            rows = np.flatnonzero(running)
+            if len(rows) == 0:
+                return bool(self.halted.all())
+            self.step(rows)
+
+    def step(self, rows: Rows) -> None:
+        """Executes one microinstruction on each of the given machines"""
+        mpcs = self.mpc[rows]
+        for mpc in np.unique(mpcs):
+            self._execute(int(mpc), rows[mpcs == mpc])
+
+    def output(self, machine: int) -> str:
+        return "".join(chr(char) for char in self._outputs[machine, : self._written[machine]])
+
+    def results(self) -> list[SimulationResult]:
+        return [
+            SimulationResult(self.output(m), int(self.ticks[m]), int(self.instructions[m]), bool(self.halted[m]))
+            for m in range(len(self.mpc))
+        ]
+
+    def _execute(self, mpc: int, rows: Rows) -> None:
+        minstr = self.microcode[mpc]
+        if mpc == 1:
+            self.instructions[rows] += 1
+        if isinstance(minstr, isa.MIJump):
+            next_mpc = self._jump(minstr, rows)
+        else:
+            self._operation(minstr, rows)
+            next_mpc = np.full(len(rows), mpc + 1, dtype=np.int64)
+        ok = ~self.failed[rows]
+        rows, next_mpc = rows[ok], next_mpc[ok]
+        if isinstance(minstr, isa.MIOperation) and minstr.halt:
+            self.halted[rows] = True
+            return
+        self.ticks[rows] += 1
+        self.mpc[rows] = next_mpc
+
+    def _jump(self, minstr: isa.MIJump, rows: Rows) -> Array:
+        result, carry = self._alu(minstr.alu_ctrl, minstr.x_sel, minstr.y_sel, rows)
+        if minstr.to != -1:
+            return np.full(len(rows), minstr.to, dtype=np.int64)
+        next_mpc = self.mpc[rows] + 1
+        codes = result >> isa.OPCODE_SHIFT
+        if len(minstr.dispatch) > 0:
+            table = np.array(minstr.dispatch, dtype=np.int64)
+            next_mpc = table[np.clip(codes, 0, len(table) - 1)]
+            self.failed[rows[(codes < 0) | (codes >= len(table)) | (next_mpc == -1)]] = True
+        if minstr.if_op[1] != -1:
+            next_mpc = np.where(codes == minstr.if_op[0].code(), minstr.if_op[1], next_mpc)
+        if minstr.if_carry != -1:
+            next_mpc = np.where(carry, minstr.if_carry, next_mpc)
+        if minstr.if_zero != -1:
+            next_mpc = np.where(result == 0, minstr.if_zero, next_mpc)
+        return next_mpc
+
+    def _operation(self, minstr: isa.MIOperation, rows: Rows) -> None:
+        result, _ = self._alu(minstr.alu_ctrl, minstr.x_sel, minstr.y_sel, rows)
+        if minstr.rwr_sel != 0:
+            index = self._register_index(minstr.rwr_sel, rows)
+            written = index != 0
+            self.registers[rows[written], index[written]] = result[written]
+        if minstr.mem_wr:
+            self._memory_write(rows)
+        if minstr.mem_rd:
+            self._memory_read(rows)
+
+    def _alu(self, ctrl: isa.ALUControl, x_sel: int, y_sel: int, rows: Rows) -> tuple[Array, Flags]:
+        x, y = self._read_register(x_sel, rows), self._read_register(y_sel, rows)
+        result, carry = _ALU[ctrl](x, y)
+        if ctrl in _OVERFLOW:
+            self.failed[rows[_OVERFLOW[ctrl](x, y, result)]] = True
+        return result, carry
+
+    def _register_index(self, reg: int, rows: Rows) -> Array:
+        """Selected register of every machine; a missing indirect one fails the machine and reads as `$0`"""
+        if reg != isa.IND_AR:
+            return np.full(len(rows), reg, dtype=np.int64)
+        index: Array = self.registers[rows, isa.AR] & isa.IND_AR_MASK
+        missing = index >= isa.REG_N
+        self.failed[rows[missing]] = True
+        index[missing] = 0
+        return index
+
+    def _read_register(self, reg: int, rows: Rows) -> Array:
+        # `$0` is never written, so its column reads as zero like the register itself
+        column = self._register_index(reg, rows) if reg == isa.IND_AR else reg
+        values: Array = self.registers[rows, column]
+        return values
+
+    def _address(self, rows: Rows) -> Array:
+        """`AR` of every machine; an address outside of memory fails the machine and reads as 0"""
+        addresses: Array = self.registers[rows, isa.AR].copy()
+        outside = (addresses < 0) | (addresses >= isa.MEMORY_SIZE)
+        self.failed[rows[outside]] = True
+        addresses[outside] = 0
+        return addresses
+
+    def _memory_write(self, rows: Rows) -> None:
+        addresses = self._address(rows)
+        data = self.registers[rows, isa.DR]
+        device = addresses == isa.OUTPUT_DEVICE_ADDR
+        self._write_output(rows[device], data[device] & 0xFF)
+        self.failed[rows[(addresses > isa.DMA_ADDR) & (addresses < isa.DMA_ADDR + DmaController.PORTS)]] = True
+        self._store(rows, addresses, data & isa.WORD_MASK)
+
+    def _memory_read(self, rows: Rows) -> None:
+        addresses = self._address(rows)
+        values = self._load(rows, addresses)
+        device = addresses == isa.INPUT_DEVICE_ADDR
+        readers = rows[device]
+        positions = self._input_pos[readers]
+        self.failed[readers[positions >= self._input_lengths[readers]]] = True
+        values[device] = self._inputs[readers, np.minimum(positions, self._inputs.shape[1] - 1)] & 0xFF
+        self._input_pos[readers] += 1
+        self.registers[rows, isa.DR] = values
+
+    def _load(self, rows: Rows, addresses: Array) -> Array:
+        values = self.image[addresses]
+        columns = self._columns[addresses]
+        copied = columns >= 0
+        values[copied] = self._diff[rows[copied], columns[copied]]
+        return values
+
+    def _store(self, rows: Rows, addresses: Array, data: Array) -> None:
+        new = np.unique(addresses[self._columns[addresses] < 0])
+        if len(new) > 0:
+            self._add_columns(new)
+        self._diff[rows, self._columns[addresses]] = data
+
+    def _add_columns(self, addresses: Array) -> None:
+        first = self._diff_addresses
+        self._diff_addresses += len(addresses)
+        if self._diff_addresses > self._diff.shape[1]:
+            self._diff = _grown(self._diff, self._diff_addresses)
+        self._columns[addresses] = np.arange(first, self._diff_addresses)
+        self._diff[:, first : self._diff_addresses] = self.image[addresses]
+
+    def _write_output(self, rows: Rows, chars: Array) -> None:
+        if len(rows) == 0:
+            return
+        needed = int(self._written[rows].max()) + 1
+        if needed > self._outputs.shape[1]:
+            self._outputs = _grown(self._outputs, needed)
+        self._outputs[rows, self._written[rows]] = chars
+        self._written[rows] += 1
+
+
+def _grown(array: npt.NDArray[_Item], columns: int) -> npt.NDArray[_Item]:
+    grown = np.zeros((array.shape[0], max(columns, 2 * array.shape[1])), dtype=array.dtype)
+    grown[:, : array.shape[1]] = array
+    return grown
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate a program on many inputs at once in lockstep")
+    parser.add_argument("program_file")
+    parser.add_argument("input_files", nargs="+")
+    parser.add_argument("--microcode", choices=PROFILES.keys(), default="classic")
+    parser.add_argument("--max-ticks", type=int, metavar="N", help="stop each machine once N ticks are executed")
+    parser.add_argument("--max-instructions", type=int, metavar="N", help="stop each machine after N instructions")
+    args = parser.parse_args()
+    inputs = []
+    for input_file in args.input_files:
+        with open(input_file, encoding="ascii") as f:
+            inputs.append([ord(char) for char in f.read()] + [0])
+    unit = LockstepUnit(PROFILES[args.microcode], isa.load_program(args.program_file), inputs)
+    unit.run(args.max_ticks, args.max_instructions)
+    for input_file, result, failed in zip(args.input_files, unit.results(), unit.failed):
+        print(json.dumps({"input": input_file, **result._asdict(), "failed": bool(failed)}))
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import pathlib
+
+import pytest
+import pytest_golden  # type: ignore[import-untyped]
+
+import lockstep
+import machine
+import microcode
+import translator
+
+_CAT = "start:\n lw $1, $0, input\n beq $1, $0, end\n sw $1, $0, output\n beq $0, $0, start\nend:\n halt\n"
+
+
+@pytest.mark.golden_test("golden/*.yml")
+@pytest.mark.parametrize("profile", ["classic", "optimized"])
+def test_lockstep_matches_microcode(golden: pytest_golden.plugin.GoldenTestFixture, profile: str) -> None:
+    program = translator.parse(golden["in_source"])
+    inputs = [[ord(c) for c in text] + [0] for text in (golden["in_stdin"], "", "lockstep\n", golden["in_stdin"] * 2)]
+    unit = lockstep.LockstepUnit(microcode.PROFILES[profile], program, [buffer.copy() for buffer in inputs])
+
+    halted = unit.run(max_ticks=200_000)
+
+    expected = [machine.simulation(program, buffer, profile=profile, max_ticks=200_000) for buffer in inputs]
+    assert unit.results() == expected
+    assert halted is all(result.halted for result in expected)
+
+
+@pytest.mark.parametrize(("max_ticks", "max_instructions"), [(37, None), (None, 11), (50, 8)])
+def test_lockstep_keeps_budgets(max_ticks: int | None, max_instructions: int | None) -> None:
+    program = translator.parse(_CAT)
+    inputs = [[ord(c) for c in text] + [0] for text in ("a", "lockstep", "")]
+    unit = lockstep.LockstepUnit(microcode.microcode, program, inputs)
+
+    unit.run(max_ticks, max_instructions)
+
+    expected = [
+        machine.simulation(program, buffer, max_ticks=max_ticks, max_instructions=max_instructions) for buffer in inputs
+    ]
+    assert unit.results() == expected
+
+
+def test_lockstep_keeps_memory_per_machine() -> None:
+    source = 'start:\n lw $1, $0, input\n sw $1, $0, cell\n lw $2, $0, cell\n sw $2, $0, output\n halt\ncell: "?"\n'
+    program = translator.parse(source)
+    unit = lockstep.LockstepUnit(microcode.microcode, program, [[ord("x")], [ord("y")], []])
+
+    assert unit.run() is False
+    assert [unit.output(m) for m in range(3)] == ["x", "y", ""]
+    assert unit.failed.tolist() == [False, False, True]
+
+
+def test_lockstep_fails_dma_transfers() -> None:
+    program = translator.parse((pathlib.Path(__file__).parent.parent / "examples" / "cat_dma.asm").read_text())
+    unit = lockstep.LockstepUnit(microcode.microcode, program, [[0]])
+
+    assert unit.run() is False
+    assert unit.failed.tolist() == [True]
+
+
+@pytest.mark.parametrize("doublings", [60, 70])
+def test_lockstep_fails_results_past_64_bits(doublings: int) -> None:
+    source = f"""start:
+        addi $1, $0, 1
+        addi $2, $0, {doublings}
+    loop:
+        add $1, $1, $1
+        addi $3, $3, 1
+        beq $3, $2, done
+        beq $0, $0, loop
+    done:
+        addi $4, $0, 78
+        beq $1, $0, zero
+        sw $4, $0, output
+        halt
+    zero:
+        addi $4, $0, 90
+        sw $4, $0, output
+        halt
+    """
+    program = translator.parse(source)
+    unit = lockstep.LockstepUnit(microcode.microcode, program, [[0]])
+
+    unit.run()
+
+    expected = machine.simulation(program, [0])
+    assert expected.output == "N"
+    if doublings < 63:
+        assert unit.results() == [expected]
+    else:
+        assert unit.failed.tolist() == [True]
+        assert unit.output(0) == ""
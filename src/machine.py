@@ -1,57 +1,194 @@
 from __future__ import annotations
 
+import argparse
+import contextlib
 import logging
 import sys
+from typing import TYPE_CHECKING, BinaryIO, Iterator, NamedTuple, Optional, Protocol
 
 import isa
-from microcode import microcode
-
-
-def main(program_file: str, input_file: str) -> None:
-    with open(program_file) as f:
-        program = isa.read_program(f)
-
-    with open(input_file, encoding="ascii") as f:
-        text = f.read()
-        input_buffer = [ord(c) for c in text]
-        input_buffer.append(0)
-
-    output = simulation(program, input_buffer)
-    print(output, end="")
-
-
-def simulation(program: isa.Program, input_buffer: list[int]) -> str:
-    data_path = DataPath(program, input_buffer)
-    control_unit = ControlUnit(microcode, data_path)
-    try:
-        while True:
-            control_unit.execute_microinstruction()
-    except StopIteration:
-        pass
-
-    return "".join([chr(c) for c in data_path.output_buffer])
+import paging
+import snapshot
+from costs import limits
+from devices import BufferInput, BufferOutput, DmaController, InputDevice, OutputDevice, StreamInput, StreamOutput
+from functional import FunctionalUnit
+from jit import JitUnit
+from microcode import PROFILES
+from tracing import Tracer, input_repr, state_repr
+
+if TYPE_CHECKING:
+    from journal import Journal
+
+ENGINES = ("microcode", "functional", "jit")
+
+
+def main(
+    program_file: str,
+    input_file: str,
+    engine: str = "microcode",
+    profile: str = "classic",
+    *,
+    stats: bool = False,
+    trace_file: Optional[str] = None,
+    trace_last: Optional[int] = None,
+    max_ticks: Optional[int] = None,
+    max_instructions: Optional[int] = None,
+    snapshot_file: Optional[str] = None,
+    resume_file: Optional[str] = None,
+) -> None:
+    output_device = StreamOutput(sys.stdout)
+    resume = _read_snapshot(resume_file)
+    with (
+        open(input_file, encoding="ascii") as f,
+        isa.open_program(program_file) as program,
+        _open_trace(trace_file) as trace_out,
+    ):
+        tracer = Tracer(profile, trace_out, trace_last) if trace_out is not None else None
+        unit = prepare(program, StreamInput(f), output_device, engine, profile, tracer=tracer, resume=resume)
+        try:
+            halted = unit.run(max_ticks, max_instructions)
+        finally:
+            output_device.flush()
+        if not halted and snapshot_file is not None:
+            with open(snapshot_file, "wb") as out:
+                snapshot.write_snapshot(snapshot.capture(unit, program), out)
+    if not halted:
+        print(f"Stopped by budget at tick {unit.ticks}", file=sys.stderr)
+    if stats:
+        resident = len(unit.data_path.memory.resident_pages())
+        print(f"ticks: {unit.ticks}, instructions: {unit.instructions}, resident pages: {resident}", file=sys.stderr)
+
+
+def _read_snapshot(snapshot_file: Optional[str]) -> Optional[snapshot.Snapshot]:
+    if snapshot_file is None:
+        return None
+    with open(snapshot_file, "rb") as f:
+        return snapshot.read_snapshot(f)
+
+
+@contextlib.contextmanager
+def _open_trace(trace_file: Optional[str]) -> Iterator[Optional[BinaryIO]]:
+    if trace_file is None:
+        yield None
+        return
+    with open(trace_file, "wb") as f:
+        yield f
+
+
+class Engine(Protocol):
+    @property
+    def data_path(self) -> DataPath: ...
+
+    @property
+    def mpc(self) -> int: ...
+
+    @property
+    def ticks(self) -> int: ...
+
+    @property
+    def instructions(self) -> int: ...
+
+    def run(self, max_ticks: Optional[int] = None, max_instructions: Optional[int] = None) -> bool:
+        """Runs until `HALT` (returning True) or until a counter reaches its budget (returning False)"""
+
+    def restore(self, mpc: int, ticks: int, instructions: int) -> None: ...
+
+
+class SimulationResult(NamedTuple):
+    output: str
+    ticks: int
+    instructions: int
+    halted: bool = True
+
+
+def simulation(
+    program: isa.LoadableProgram,
+    input_buffer: list[int],
+    engine: str = "microcode",
+    profile: str = "classic",
+    *,
+    max_ticks: Optional[int] = None,
+    max_instructions: Optional[int] = None,
+    resume: Optional[snapshot.Snapshot] = None,
+) -> SimulationResult:
+    output_device = BufferOutput()
+    unit = prepare(program, BufferInput(input_buffer), output_device, engine, profile, resume=resume)
+    halted = unit.run(max_ticks, max_instructions)
+    return SimulationResult(output_device.text(), unit.ticks, unit.instructions, halted)
+
+
+def simulate(
+    program: isa.LoadableProgram,
+    input_device: InputDevice,
+    output_device: OutputDevice,
+    engine: str = "microcode",
+    profile: str = "classic",
+    *,
+    tracer: Optional[Tracer] = None,
+) -> Engine:
+    unit = prepare(program, input_device, output_device, engine, profile, tracer=tracer)
+    unit.run()
+    return unit
+
+
+def prepare(
+    program: isa.LoadableProgram,
+    input_device: InputDevice,
+    output_device: OutputDevice,
+    engine: str = "microcode",
+    profile: str = "classic",
+    *,
+    tracer: Optional[Tracer] = None,
+    resume: Optional[snapshot.Snapshot] = None,
+) -> Engine:
+    assert engine in ENGINES, f"Unknown engine '{engine}'"
+    assert profile in PROFILES, f"Unknown microcode profile '{profile}'"
+    data_path = DataPath(program, input_device, output_device)
+    unit: Engine
+    if tracer is not None:
+        assert engine == "microcode", "Only the microcode engine executes microinstructions to trace"
+        assert tracer.profile == profile, f"Tracer expects the '{tracer.profile}' microcode profile"
+        unit = ControlUnit(PROFILES[profile], data_path, tracer)
+    else:
+        unit = new_engine(engine, data_path, PROFILES[profile])
+    if resume is not None:
+        snapshot.restore(resume, unit, program)
+    return unit
+
+
+def new_engine(engine: str, data_path: DataPath, microcode: list[isa.MInstruction]) -> Engine:
+    if engine == "functional":
+        return FunctionalUnit(microcode, data_path)
+    if engine == "jit":
+        return JitUnit(microcode, data_path)
+    return ControlUnit(microcode, data_path)
 
 
 class DataPath:
-    memory: list[isa.MemoryWord]
-    registers: list[isa.MemoryWord]
+    memory: paging.PagedMemory
+    registers: list[int]
     carry: bool
     zero: bool
-    input_buffer: list[int]
-    output_buffer: list[int]
+    input_device: InputDevice
+    output_device: OutputDevice
+    dma: DmaController
+    _debug: bool
 
-    def __init__(self, program: isa.Program, input_buffer: list[int]) -> None:
-        self.memory = (
-            [0] * isa.ORIGIN + program.instructions + [0] * (isa.MEMORY_SIZE - len(program.instructions) - isa.ORIGIN)
-        )
+    def __init__(self, program: isa.LoadableProgram, input_device: InputDevice, output_device: OutputDevice) -> None:
+        self.memory = paging.PagedMemory.from_program(program)
         self.registers = [0] * isa.REG_N
         self.registers[isa.PC] = program.start
         self.carry = False
         self.zero = False
-        self.input_buffer = input_buffer
-        self.output_buffer = []
-
-    def write_register(self, x_sel: int, y_sel: int, alu_ctrl: isa.ALUControl, rwr_sel: int) -> isa.MemoryWord:
+        self.input_device = input_device
+        self.output_device = output_device
+        self.memory.map(isa.INPUT_DEVICE_ADDR, read=lambda: input_device.read() & 0xFF)
+        self.memory.map(isa.OUTPUT_DEVICE_ADDR, write=lambda data: output_device.write(data & 0xFF))
+        self.dma = DmaController(self.memory, input_device, output_device)
+        self.dma.attach(isa.DMA_ADDR)
+        self._debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+
+    def write_register(self, x_sel: int, y_sel: int, alu_ctrl: isa.ALUControl, rwr_sel: int) -> int:
         x = self._get_reg(x_sel)
         y = self._get_reg(y_sel)
         (r, c) = alu_ctrl.call(x, y)
@@ -63,66 +200,66 @@ class DataPath:
     def signal_mem_wr(self) -> None:
         address = self.registers[isa.AR]
         data = self.registers[isa.DR]
-        assert isinstance(address, int), f"Expected data, but got instruction: {address}"
-        assert isinstance(data, int), f"Expected data, but got instruction: {data}"
-        if address == isa.OUTPUT_DEVICE_ADDR:
-            char = data & 0xFF
-            logging.debug("output: %s", chr(char))
-            self.output_buffer.append(char)
-        self.memory[address] = data
+        if self._debug and address == isa.OUTPUT_DEVICE_ADDR:
+            logging.debug("output: %s", chr(data & 0xFF))
+        self.memory[address] = data & isa.WORD_MASK
 
     def signal_mem_rd(self) -> None:
         address = self.registers[isa.AR]
-        assert isinstance(address, int), "Expected data, but got instruction"
         read = self.memory[address]
-        if address == isa.INPUT_DEVICE_ADDR:
-            assert len(self.input_buffer) > 0, "Read from empty input buffer"
-            popped = self.input_buffer.pop(0)
-            read = popped & 0xFF
-            logging.debug("input: %s", chr(read) if read != 0 else r"\0")
-
+        if self._debug and address == isa.INPUT_DEVICE_ADDR:
+            logging.debug("input: %s", input_repr(read))
         self.registers[isa.DR] = read
 
-    def _get_reg(self, reg: int) -> isa.MemoryWord:
+    def _get_reg(self, reg: int) -> int:
         if reg == isa.IND_AR:
-            ar = self.registers[isa.AR]
-            assert isinstance(ar, int), "Expected data, but got instruction"
-            reg = ar & isa.IND_AR_MASK
+            reg = self.registers[isa.AR] & isa.IND_AR_MASK
         assert _valid_register(reg), f"Unexpected register '{reg}'"
         if reg == 0:
             return 0
         return self.registers[reg]
 
-    def _set_reg(self, reg: int, val: isa.MemoryWord) -> None:
+    def _set_reg(self, reg: int, val: int) -> None:
         if reg == isa.IND_AR:
-            ar = self.registers[isa.AR]
-            assert isinstance(ar, int), "Expected data, but got instruction"
-            reg = ar & isa.IND_AR_MASK
+            reg = self.registers[isa.AR] & isa.IND_AR_MASK
         assert _valid_register(reg), f"Unexpected register '{reg}'"
         if reg != 0:
             self.registers[reg] = val
 
 
-def memory_word_repr(word: isa.MemoryWord) -> str:
-    if isinstance(word, int):
-        return f"{word:4}"
-    [op, *args] = word
-    return f"{op.name:4}"
-
-
 class ControlUnit:
     microcode: list[isa.MInstruction]
     mpc: int
     data_path: DataPath
+    tracer: Optional[Tracer]
+    journal: Optional[Journal]
     _tick: int
     _instructions: int
-
-    def __init__(self, microcode: list[isa.MInstruction], data_path: DataPath) -> None:
+    _debug: bool
+
+    def __init__(
+        self,
+        microcode: list[isa.MInstruction],
+        data_path: DataPath,
+        tracer: Optional[Tracer] = None,
+        journal: Optional[Journal] = None,
+    ) -> None:
         self.microcode = microcode
         self.mpc = 0
         self.data_path = data_path
+        self.tracer = tracer
+        self.journal = journal
         self._tick = 0
         self._instructions = 0
+        self._debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+
+    @property
+    def ticks(self) -> int:
+        return self._tick
+
+    @property
+    def instructions(self) -> int:
+        return self._instructions
 
     def tick(self) -> None:
         self._tick += 1
@@ -130,12 +267,34 @@ class ControlUnit:
     def signal_latch_mpc(self, mpc_sel: int) -> None:
         self.mpc = mpc_sel
 
+    def run(self, max_ticks: Optional[int] = None, max_instructions: Optional[int] = None) -> bool:
+        tick_limit, instruction_limit = limits(max_ticks, max_instructions)
+        try:
+            while self._tick < tick_limit and (self.mpc != 0 or self._instructions < instruction_limit):
+                self.execute_microinstruction()
+        except StopIteration:
+            return True
+        finally:
+            if self.tracer is not None:
+                self.tracer.finish(self.data_path.registers)
+        return False
+
+    def restore(self, mpc: int, ticks: int, instructions: int) -> None:
+        self.mpc = mpc
+        self._tick = ticks
+        self._instructions = instructions
+
     def execute_microinstruction(self) -> None:
+        if self.journal is not None:
+            self.journal.record(self)
         if self.mpc == 1:
             self._instructions += 1
         minstr = self.microcode[self.mpc]
-        logging.debug("executing: %s", minstr)
-        logging.debug("control_unit: %s", self)
+        if self._debug:
+            logging.debug("executing: %s", minstr)
+            logging.debug("control_unit: %s", self)
+        if self.tracer is not None:
+            self.tracer.step(self._tick, self.mpc, minstr, self.data_path.registers)
         next_mpc = self.mpc + 1
         if isinstance(minstr, isa.MIJump):
             next_mpc = self._execute_jump_mi(minstr)
@@ -152,10 +311,13 @@ class ControlUnit:
             return minstr.if_zero
         if minstr.if_carry != -1 and self.data_path.carry:
             return minstr.if_carry
-        if minstr.if_op[1] != -1:
-            assert isinstance(alu_result, tuple), f"Expected instruction, got data: '{alu_result}'"
-            if alu_result[0] == minstr.if_op[0]:
-                return minstr.if_op[1]
+        if minstr.if_op[1] != -1 and alu_result >> isa.OPCODE_SHIFT == minstr.if_op[0].code():
+            return minstr.if_op[1]
+        if len(minstr.dispatch) > 0:
+            code = alu_result >> isa.OPCODE_SHIFT
+            assert code < len(minstr.dispatch), f"Unknown opcode '{code}'"
+            assert minstr.dispatch[code] != -1, f"Unknown opcode '{code}'"
+            return minstr.dispatch[code]
         return self.mpc + 1
 
     def _execute_operation_mi(self, minstr: isa.MIOperation) -> None:
@@ -168,9 +330,31 @@ class ControlUnit:
             raise StopIteration("Got halt signal")
 
     def __repr__(self) -> str:
-        registers_repr = ", ".join(memory_word_repr(word) for word in self.data_path.registers)
-        state_repr = f"tick:{self._tick:3} mpc:{self.mpc:3} regs:{registers_repr}"
-        return f"{state_repr}"
+        return state_repr(self._tick, self.mpc, self.data_path.registers)
+
+
+def memory_accesses(microcode: list[isa.MInstruction]) -> frozenset[int]:
+    """Addresses of the microinstructions that access memory, which must not select registers through AR"""
+    accessing = {
+        mpc: minstr
+        for mpc, minstr in enumerate(microcode)
+        if isinstance(minstr, isa.MIOperation) and (minstr.mem_rd or minstr.mem_wr)
+    }
+    for mpc, minstr in accessing.items():
+        assert isa.IND_AR not in (minstr.x_sel, minstr.y_sel, minstr.rwr_sel), (
+            f"Memory access at {mpc} selects registers through AR"
+        )
+    return frozenset(accessing)
+
+
+def at_access(minstr: isa.MIOperation, registers: list[int], reg: int) -> int:
+    """Value of `reg` when the memory access of `minstr` happens, after its ALU write;
+    the fetch, for one, writes AR in the same microinstruction it reads memory"""
+    if minstr.rwr_sel != reg:
+        return registers[reg]
+    x = 0 if minstr.x_sel == 0 else registers[minstr.x_sel]
+    y = 0 if minstr.y_sel == 0 else registers[minstr.y_sel]
+    return minstr.alu_ctrl.call(x, y)[0]
 
 
 def _valid_register(reg: int) -> bool:
@@ -178,6 +362,46 @@ def _valid_register(reg: int) -> bool:
 
 
 if __name__ == "__main__":
-    logging.getLogger().setLevel(logging.DEBUG)
-    assert len(sys.argv) == 3
-    main(sys.argv[1], sys.argv[2])
+    parser = argparse.ArgumentParser(description="Simulate the machine running a translated program")
+    parser.add_argument("program_file")
+    parser.add_argument("input_file")
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default="microcode",
+        help="'functional' executes whole instructions and 'jit' compiles basic blocks to Python functions, "
+        "both keeping the microcode tick accounting",
+    )
+    parser.add_argument(
+        "--microcode",
+        choices=PROFILES.keys(),
+        default="classic",
+        help="'dispatch' decodes the opcode with a single table-indexed microjump and 'optimized' "
+        "is 'dispatch' after the microcode optimizer ('equivalence.py' checks it)",
+    )
+    parser.add_argument("--stats", action="store_true", help="print tick and instruction counts to stderr")
+    parser.add_argument("--log", action="store_true", help="log every microinstruction to stderr")
+    parser.add_argument("--trace", metavar="FILE", help="record a binary trace, rendered by 'tracing.py FILE'")
+    parser.add_argument(
+        "--trace-last", type=int, metavar="N", help="keep only the last N microinstructions in the trace"
+    )
+    parser.add_argument("--max-ticks", type=int, metavar="N", help="stop once N ticks are executed")
+    parser.add_argument("--max-instructions", type=int, metavar="N", help="stop once N instructions are executed")
+    parser.add_argument("--snapshot", metavar="FILE", help="save the machine state to FILE when stopped by a budget")
+    parser.add_argument("--resume", metavar="FILE", help="continue from a snapshot taken for the same program")
+    args = parser.parse_args()
+    if args.log:
+        logging.basicConfig(level=logging.DEBUG, format="%(levelname)-7s %(module)s:%(funcName)-13s %(message)s")
+    main(
+        args.program_file,
+        args.input_file,
+        args.engine,
+        args.microcode,
+        stats=args.stats,
+        trace_file=args.trace,
+        trace_last=args.trace_last,
+        max_ticks=args.max_ticks,
+        max_instructions=args.max_instructions,
+        snapshot_file=args.snapshot,
+        resume_file=args.resume,
+    )
@@ -3,6 +3,7 @@ from __future__ import annotations
 from typing import Callable, Final, TypeAlias
 
 import isa
+import microcode_optimizer
 from isa import MIJump, MIOperation, Op
 
 _load_0rr: Final[list[isa.MInstruction]] = [
@@ -29,7 +30,7 @@ _load_0ri: Final[list[isa.MInstruction]] = [
 LabelFunc: TypeAlias = Callable[[str], int]
 
 
-def _with_labels(get_microcode: Callable[[LabelFunc], list[isa.MInstruction | str]]) -> list[isa.MInstruction]:
+def _labels(get_microcode: Callable[[LabelFunc], list[isa.MInstruction | str]]) -> dict[str, int]:
     mc_with_stubs = get_microcode(lambda _: 0)
     labels: dict[str, int] = {}
     labels_encountered = 0
@@ -38,23 +39,28 @@ def _with_labels(get_microcode: Callable[[LabelFunc], list[isa.MInstruction | st
             label = mi
             labels[label] = idx - labels_encountered
             labels_encountered += 1
+    return labels
+
+
+def _with_labels(get_microcode: Callable[[LabelFunc], list[isa.MInstruction | str]]) -> list[isa.MInstruction]:
+    labels = _labels(get_microcode)
     return [mi for mi in get_microcode(lambda label: labels[label]) if not isinstance(mi, str)]
 
 
-microcode: Final[list[isa.MInstruction]] = _with_labels(
-    lambda label: [
-        "instruction_fetch",
-        MIOperation(x_sel=isa.PC, rwr_sel=isa.AR, mem_rd=True),
-        MIJump(x_sel=isa.DR, if_op=(Op.LW, label("LW"))),
-        MIJump(x_sel=isa.DR, if_op=(Op.SW, label("SW"))),
-        MIJump(x_sel=isa.DR, if_op=(Op.BEQ, label("BEQ"))),
-        MIJump(x_sel=isa.DR, if_op=(Op.BLEQ, label("BLEQ"))),
-        MIJump(x_sel=isa.DR, if_op=(Op.ADDI, label("ADDI"))),
-        MIJump(x_sel=isa.DR, if_op=(Op.ANDI, label("ANDI"))),
-        MIJump(x_sel=isa.DR, if_op=(Op.SHR, label("SHR"))),
-        MIJump(x_sel=isa.DR, if_op=(Op.ADD, label("ADD"))),
-        MIJump(x_sel=isa.DR, if_op=(Op.SUB, label("SUB"))),
-        MIJump(x_sel=isa.DR, if_op=(Op.HALT, label("HALT"))),
+def _dispatch_table(label: LabelFunc) -> tuple[int, ...]:
+    table = [-1] * (max(op.code() for op in Op) + 1)
+    for op in Op:
+        table[op.code()] = label(op.name)
+    return tuple(table)
+
+
+def _trap() -> MIJump:
+    """Decode jump without a valid target, so a word that no `if_op` matched stops the machine"""
+    return MIJump(x_sel=isa.DR, dispatch=(-1,) * (max(op.code() for op in Op) + 1))
+
+
+def _routines(label: LabelFunc) -> list[isa.MInstruction | str]:
+    return [
         "LW",
         *_load_0ri,
         MIOperation(x_sel=isa.DR, alu_ctrl=isa.ALUControl.mask_fst_r, rwr_sel=isa.OR1),
@@ -119,4 +125,69 @@ microcode: Final[list[isa.MInstruction]] = _with_labels(
         MIOperation(x_sel=isa.PC, alu_ctrl=isa.ALUControl.inc, rwr_sel=isa.PC),
         MIJump(to=label("instruction_fetch")),
     ]
-)
+
+
+_instruction_fetch: Final[list[isa.MInstruction | str]] = [
+    "instruction_fetch",
+    MIOperation(x_sel=isa.PC, rwr_sel=isa.AR, mem_rd=True),
+]
+
+
+def _classic(label: LabelFunc) -> list[isa.MInstruction | str]:
+    return [
+        *_instruction_fetch,
+        MIJump(x_sel=isa.DR, if_op=(Op.LW, label("LW"))),
+        MIJump(x_sel=isa.DR, if_op=(Op.SW, label("SW"))),
+        MIJump(x_sel=isa.DR, if_op=(Op.BEQ, label("BEQ"))),
+        MIJump(x_sel=isa.DR, if_op=(Op.BLEQ, label("BLEQ"))),
+        MIJump(x_sel=isa.DR, if_op=(Op.ADDI, label("ADDI"))),
+        MIJump(x_sel=isa.DR, if_op=(Op.ANDI, label("ANDI"))),
+        MIJump(x_sel=isa.DR, if_op=(Op.SHR, label("SHR"))),
+        MIJump(x_sel=isa.DR, if_op=(Op.ADD, label("ADD"))),
+        MIJump(x_sel=isa.DR, if_op=(Op.SUB, label("SUB"))),
+        MIJump(x_sel=isa.DR, if_op=(Op.HALT, label("HALT"))),
+        _trap(),
+        *_routines(label),
+    ]
+
+
+def _dispatch(label: LabelFunc) -> list[isa.MInstruction | str]:
+    return [
+        *_instruction_fetch,
+        MIJump(x_sel=isa.DR, dispatch=_dispatch_table(label)),
+        *_routines(label),
+    ]
+
+
+microcode: Final[list[isa.MInstruction]] = _with_labels(_classic)
+microcode_dispatch: Final[list[isa.MInstruction]] = _with_labels(_dispatch)
+_optimized: Final[microcode_optimizer.OptimizedRom] = microcode_optimizer.optimize(microcode_dispatch)
+
+PROFILES: Final[dict[str, list[isa.MInstruction]]] = {
+    "classic": microcode,
+    "dispatch": microcode_dispatch,
+    "optimized": _optimized.microcode,
+}
+
+PROFILE_LABELS: Final[dict[str, dict[str, int]]] = {
+    "classic": _labels(_classic),
+    "dispatch": _labels(_dispatch),
+    "optimized": {
+        label: _optimized.addresses[address]
+        for label, address in _labels(_dispatch).items()
+        if address in _optimized.addresses
+    },
+}
+
+
+def routine_names(profile: str) -> list[str]:
+    """Name of the labeled routine each microcode address belongs to
+
+    >>> routine_names("dispatch")[:3]
+    ['instruction_fetch', 'instruction_fetch', 'LW']
+    """
+    starts = {address: label for label, address in PROFILE_LABELS[profile].items()}
+    names: list[str] = []
+    for mpc in range(len(PROFILES[profile])):
+        names.append(starts.get(mpc, names[-1] if len(names) > 0 else ""))
+    return names
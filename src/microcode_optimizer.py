@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import itertools
+from typing import Callable, Final, NamedTuple, Optional
+
+import isa
+
+MAX_INLINE: Final[int] = 2
+_SCRATCH: Final[frozenset[int]] = frozenset({isa.AR, isa.DR, isa.OR1, isa.OR2, isa.OR3})
+_ALL: Final[frozenset[int]] = frozenset(range(isa.REG_N))
+
+
+class OptimizedRom(NamedTuple):
+    microcode: list[isa.MInstruction]
+    addresses: dict[int, int]
+    """New address of the microinstruction that runs in place of each reachable original one"""
+
+
+class _Node(NamedTuple):
+    """A microinstruction whose jump targets are node ids, so nodes can move and be copied"""
+
+    id: int
+    minstr: isa.MInstruction
+
+
+def optimize(microcode: list[isa.MInstruction]) -> OptimizedRom:
+    """Threads jump chains, inlines short tails such as `increment_pc` into the jumps to them,
+    drops writes to scratch registers that are never read and removes unreachable code.
+
+    Instruction fetch stays at address 0 and the decoding microinstruction at address 1,
+    since `ControlUnit` counts instructions when it executes address 1. Flags are treated as
+    scratch: every conditional jump sets them with its own ALU operation before testing them.
+    """
+    nodes = [_Node(address, minstr) for address, minstr in enumerate(microcode)]
+    nodes = _thread_jumps(nodes)
+    nodes = _thread_jumps(_inline_tails(nodes))
+    nodes = _remove_unreachable(_remove_dead_writes(nodes))
+    positions = {node.id: position for position, node in enumerate(nodes)}
+    result = [_retarget(node.minstr, positions.__getitem__) for node in nodes]
+    assert result[0] == microcode[0], "Instruction fetch must stay at address 0"
+    assert positions.get(1) == 1, "Instructions are counted at address 1, so decoding must not move"
+    return OptimizedRom(
+        result, {address: positions[address] for address in range(len(microcode)) if address in positions}
+    )
+
+
+def _targets(minstr: isa.MInstruction) -> list[int]:
+    if isinstance(minstr, isa.MIOperation):
+        return []
+    fields = [minstr.to, minstr.if_zero, minstr.if_carry, minstr.if_op[1], *minstr.dispatch]
+    return [target for target in fields if target != -1]
+
+
+def _retarget(minstr: isa.MInstruction, move: Callable[[int], int]) -> isa.MInstruction:
+    if isinstance(minstr, isa.MIOperation):
+        return minstr
+
+    def moved(target: int) -> int:
+        return target if target == -1 else move(target)
+
+    return minstr._replace(
+        to=moved(minstr.to),
+        if_zero=moved(minstr.if_zero),
+        if_carry=moved(minstr.if_carry),
+        if_op=(minstr.if_op[0], moved(minstr.if_op[1])),
+        dispatch=tuple(moved(target) for target in minstr.dispatch),
+    )
+
+
+def _unconditional(minstr: isa.MInstruction) -> bool:
+    return isinstance(minstr, isa.MIJump) and minstr.to != -1
+
+
+def _falls_through(minstr: isa.MInstruction) -> bool:
+    return not _unconditional(minstr) and not (isinstance(minstr, isa.MIOperation) and minstr.halt)
+
+
+def _successors(nodes: list[_Node], position: int, positions: dict[int, int]) -> list[int]:
+    minstr = nodes[position].minstr
+    successors = [positions[target] for target in _targets(minstr)]
+    if _falls_through(minstr):
+        successors.append(position + 1)
+    return successors
+
+
+def _without(nodes: list[_Node], removed: set[int]) -> list[_Node]:
+    """Drops the `removed` node ids, sending jumps to them to the node they fell through to"""
+    following: dict[int, int] = {}
+    for later, earlier in itertools.pairwise(reversed(nodes)):
+        following[earlier.id] = following.get(later.id, later.id) if later.id in removed else later.id
+    kept = [node for node in nodes if node.id not in removed]
+    return [
+        node._replace(minstr=_retarget(node.minstr, lambda t: following[t] if t in removed else t)) for node in kept
+    ]
+
+
+def _thread_jumps(nodes: list[_Node]) -> list[_Node]:
+    """Retargets jumps past unconditional jumps, and drops unconditional jumps to the next node"""
+    by_id = {node.id: node.minstr for node in nodes}
+
+    def final(target: int) -> int:
+        seen = {target}
+        while _unconditional(by_id[target]) and by_id[target].to not in seen:  # type: ignore[union-attr]
+            target = by_id[target].to  # type: ignore[union-attr]
+            seen.add(target)
+        return target
+
+    threaded = [node._replace(minstr=_retarget(node.minstr, final)) for node in nodes]
+    removed = {
+        node.id
+        for node, after in itertools.pairwise(threaded)
+        if _unconditional(node.minstr) and node.minstr.to == after.id  # type: ignore[union-attr]
+    }
+    return _without(threaded, removed)
+
+
+def _inline_tails(nodes: list[_Node]) -> list[_Node]:
+    """Replaces a jump to up to `MAX_INLINE` operations and a jump with a copy of them"""
+    positions = {node.id: position for position, node in enumerate(nodes)}
+    fresh = itertools.count(max(positions) + 1)
+    result: list[_Node] = []
+    for node in nodes:
+        tail = _tail(nodes, positions[node.minstr.to]) if _unconditional(node.minstr) else None  # type: ignore[union-attr]
+        if tail is None or node.id in {copied.id for copied in tail}:
+            result.append(node)
+            continue
+        first, *rest = tail
+        result.append(_Node(node.id, first.minstr))
+        result.extend(_Node(next(fresh), copied.minstr) for copied in rest)
+    return result
+
+
+def _tail(nodes: list[_Node], position: int) -> Optional[list[_Node]]:
+    for end in range(position, min(position + MAX_INLINE + 1, len(nodes))):
+        minstr = nodes[end].minstr
+        if _unconditional(minstr):
+            return nodes[position : end + 1] if end > position else None
+        if not isinstance(minstr, isa.MIOperation) or minstr.halt:
+            return None
+    return None
+
+
+def _remove_dead_writes(nodes: list[_Node]) -> list[_Node]:
+    """Drops operations whose only effect is a scratch register write that is never read"""
+    live_out = _live_registers(nodes)
+    removed = set()
+    for position, node in enumerate(nodes):
+        minstr = node.minstr
+        if not isinstance(minstr, isa.MIOperation) or minstr.mem_rd or minstr.mem_wr or minstr.halt:
+            continue
+        if minstr.rwr_sel == 0 or (minstr.rwr_sel in _SCRATCH and minstr.rwr_sel not in live_out[position]):
+            removed.add(node.id)
+    return _without(nodes, removed)
+
+
+def _live_registers(nodes: list[_Node]) -> list[frozenset[int]]:
+    positions = {node.id: position for position, node in enumerate(nodes)}
+    live_in = [frozenset[int]() for _ in nodes]
+    live_out = [frozenset[int]() for _ in nodes]
+    changed = True
+    while changed:
+        changed = False
+        for position in reversed(range(len(nodes))):
+            live_out[position] = frozenset().union(*(live_in[s] for s in _successors(nodes, position, positions)))
+            live = _live_before(nodes[position].minstr, live_out[position])
+            if live != live_in[position]:
+                live_in[position] = live
+                changed = True
+    return live_out
+
+
+def _live_before(minstr: isa.MInstruction, live: frozenset[int]) -> frozenset[int]:
+    if isinstance(minstr, isa.MIOperation):
+        if minstr.halt:
+            live = _ALL
+        if minstr.mem_rd:
+            live = (live - {isa.DR}) | {isa.AR}
+        if minstr.mem_wr:
+            live = live | {isa.AR, isa.DR}
+        live = live | {isa.AR} if minstr.rwr_sel == isa.IND_AR else live - {minstr.rwr_sel}
+    return live | _reads(minstr.x_sel) | _reads(minstr.y_sel)
+
+
+def _reads(reg: int) -> frozenset[int]:
+    return _ALL if reg == isa.IND_AR else frozenset({reg})
+
+
+def _remove_unreachable(nodes: list[_Node]) -> list[_Node]:
+    positions = {node.id: position for position, node in enumerate(nodes)}
+    reached = set()
+    work = [0]
+    while len(work) > 0:
+        position = work.pop()
+        if position not in reached:
+            reached.add(position)
+            work.extend(_successors(nodes, position, positions))
+    return [node for position, node in enumerate(nodes) if position in reached]
@@ -0,0 +1,342 @@
+from __future__ import annotations
+
+import operator
+from typing import Callable, Final, NamedTuple, Optional, TypeAlias, Union
+
+import isa
+from isa import Op
+
+MAX_ROUNDS: Final[int] = 16
+
+_EVAL: Final[dict[Op, Callable[[int, int], int]]] = {
+    Op.ADDI: operator.add,
+    Op.ANDI: operator.and_,
+    Op.SHR: operator.rshift,
+    Op.ADD: operator.add,
+    Op.SUB: operator.sub,
+}
+_BRANCHES: Final[dict[Op, Callable[[int, int], bool]]] = {Op.BEQ: operator.eq, Op.BLEQ: operator.le}
+
+
+class LabelArg(NamedTuple):
+    name: str
+
+
+Arg: TypeAlias = Union[isa.RegArg, isa.ImmArg, LabelArg]
+
+
+class Code(NamedTuple):
+    """An instruction whose label arguments are kept by name until `assemble`"""
+
+    op: Op
+    args: tuple[Arg, ...]
+
+
+class Line(NamedTuple):
+    """A memory word with the labels pointing at it; labels at the end of the source have no word"""
+
+    labels: tuple[str, ...]
+    word: Union[Code, int, None]
+
+
+Constants: TypeAlias = tuple[Optional[int], ...]
+
+
+def assemble(lines: list[Line]) -> isa.Program:
+    labels = isa.PREDEFINED_LABELS.copy()
+    pc = isa.ORIGIN
+    for line in lines:
+        for label in line.labels:
+            labels[label] = pc
+        if line.word is not None:
+            pc += 1
+    words: list[isa.MemoryWord] = []
+    for line in lines:
+        if isinstance(line.word, Code):
+            args = [isa.ImmArg(labels[arg.name]) if isinstance(arg, LabelArg) else arg for arg in line.word.args]
+            words.append(isa.instruction_from_args(line.word.op, args))
+        elif line.word is not None:
+            words.append(line.word)
+    return isa.Program(start=labels["start"], instructions=words)
+
+
+def optimize(lines: list[Line]) -> list[Line]:
+    """Repeats constant propagation, jump threading and dead code removal until nothing changes.
+
+    Instructions only move when others are removed, so every label reference must be symbolic:
+    programs that address code as data, use numeric addresses or fall through into data are
+    returned unchanged. Indexed accesses are assumed to stay inside the data they are relative to.
+    """
+    if not _optimizable(lines):
+        return lines
+    for _ in range(MAX_ROUNDS):
+        optimized = _remove_dead_code(_remove_unreachable(_thread_jumps(_propagate_constants(lines))))
+        if optimized == lines:
+            break
+        lines = optimized
+    return lines
+
+
+def _optimizable(lines: list[Line]) -> bool:
+    code_labels = {label for line in lines if isinstance(line.word, Code) for label in line.labels}
+    if "start" not in code_labels:
+        return False
+    for index, line in enumerate(lines):
+        if line.word is None:
+            return False
+        if not isinstance(line.word, Code):
+            continue
+        if not _symbolic(line.word, code_labels):
+            return False
+        following = lines[index + 1].word if index + 1 < len(lines) else None
+        if _falls_through(line.word) and not isinstance(following, Code):
+            return False
+    return True
+
+
+def _symbolic(code: Code, code_labels: set[str]) -> bool:
+    """Whether branches target code labels and nothing else refers to code or to a numeric address"""
+    if code.op in _BRANCHES:
+        target = code.args[2]
+        return isinstance(target, LabelArg) and target.name in code_labels
+    if any(isinstance(arg, LabelArg) and arg.name in code_labels for arg in code.args):
+        return False
+    if code.op in (Op.LW, Op.SW):
+        _, base, address = code.args
+        if isinstance(address, LabelArg):
+            return True
+        return (
+            base == isa.RegArg(0) and isinstance(address, isa.ImmArg) and address.val in isa.PREDEFINED_LABELS.values()
+        )
+    return True
+
+
+def _falls_through(code: Code) -> bool:
+    return code.op is not Op.HALT and not _unconditional(code)
+
+
+def _unconditional(code: Code) -> bool:
+    return code.op in _BRANCHES and code.args[0] == code.args[1]
+
+
+def _label_lines(lines: list[Line]) -> dict[str, int]:
+    return {label: index for index, line in enumerate(lines) for label in line.labels}
+
+
+def _code(line: Line) -> Code:
+    assert isinstance(line.word, Code), f"Expected an instruction, but got {line.word}"
+    return line.word
+
+
+def _successors(lines: list[Line], index: int, targets: dict[str, int]) -> list[int]:
+    code = _code(lines[index])
+    if code.op is Op.HALT:
+        return []
+    if code.op not in _BRANCHES:
+        return [index + 1]
+    target = targets[_target(code)]
+    return [target] if _unconditional(code) else [index + 1, target]
+
+
+def _target(branch: Code) -> str:
+    target = branch.args[2]
+    assert isinstance(target, LabelArg), f"Branch to a numeric address {target}"
+    return target.name
+
+
+def _without(lines: list[Line], removed: set[int]) -> list[Line]:
+    """Drops the `removed` lines and moves their labels to the next line that is kept"""
+    result: list[Line] = []
+    pending: tuple[str, ...] = ()
+    for index, line in enumerate(lines):
+        if index in removed:
+            pending += line.labels
+            continue
+        result.append(line._replace(labels=pending + line.labels))
+        pending = ()
+    return result
+
+
+def _propagate_constants(lines: list[Line]) -> list[Line]:
+    """Folds instructions over known register values, and drops the ones that change nothing"""
+    result = list(lines)
+    removed = set()
+    for index, state in _constants(lines).items():
+        folded = _fold(_code(lines[index]), state)
+        if folded is None:
+            removed.add(index)
+        else:
+            result[index] = lines[index]._replace(word=folded)
+    return _without(result, removed)
+
+
+def _constants(lines: list[Line]) -> dict[int, Constants]:
+    """Known register values before each reachable instruction, starting from zeroed registers"""
+    targets = _label_lines(lines)
+    start = targets["start"]
+    states: dict[int, Constants] = {start: (0,) * isa.GEN_REG_N}
+    work = [start]
+    while len(work) > 0:
+        index = work.pop()
+        after = _transfer(_code(lines[index]), states[index])
+        for successor in _successors(lines, index, targets):
+            old = states.get(successor)
+            new = after if old is None else tuple(x if x == y else None for x, y in zip(old, after))
+            if new != old:
+                states[successor] = new
+                work.append(successor)
+    return states
+
+
+def _transfer(code: Code, state: Constants) -> Constants:
+    written, _ = _registers(code)
+    if written is None:
+        return state
+    values = list(state)
+    values[written] = _evaluate(code, state)
+    return tuple(values)
+
+
+def _evaluate(code: Code, state: Constants) -> Optional[int]:
+    if code.op not in _EVAL:
+        return None
+    _, x, y = code.args
+    assert isinstance(x, isa.RegArg)
+    lhs = state[x.idx]
+    rhs = state[y.idx] if isinstance(y, isa.RegArg) else y.val if isinstance(y, isa.ImmArg) else None
+    if lhs is None or rhs is None:
+        return None
+    return _EVAL[code.op](lhs, rhs)
+
+
+def _fold(code: Code, state: Constants) -> Optional[Code]:
+    """`code` rewritten for the known values in `state`, or None when it has no effect"""
+    if code.op in _BRANCHES:
+        return _fold_branch(code, state)
+    if code.op not in _EVAL or code.args[0] == isa.RegArg(0):
+        return code
+    dst = code.args[0]
+    assert isinstance(dst, isa.RegArg)
+    value = _evaluate(code, state)
+    if value is None or not 0 <= value <= isa.IMM_MASK:
+        return _reduce(code, state)
+    if state[dst.idx] == value:
+        return None
+    return Code(Op.ADDI, (dst, isa.RegArg(0), isa.ImmArg(value)))
+
+
+def _fold_branch(code: Code, state: Constants) -> Optional[Code]:
+    x, y, target = code.args
+    assert isinstance(x, isa.RegArg)
+    assert isinstance(y, isa.RegArg)
+    lhs, rhs = state[x.idx], state[y.idx]
+    if _unconditional(code) or lhs is None or rhs is None:
+        return code
+    if _BRANCHES[code.op](lhs, rhs):
+        return Code(code.op, (isa.RegArg(0), isa.RegArg(0), target))
+    return None
+
+
+def _reduce(code: Code, state: Constants) -> Code:
+    """`ADD` and `SUB` with a known operand as the cheaper `ADDI`
+
+    >>> _reduce(Code(Op.ADD, (isa.RegArg(1), isa.RegArg(2), isa.RegArg(3))), (0, None, None, 5, None, None))
+    Code(op=ADDI, args=(RegArg(idx=1), RegArg(idx=2), ImmArg(val=5)))
+    """
+    if code.op not in (Op.ADD, Op.SUB):
+        return code
+    dst, x, y = code.args
+    assert isinstance(x, isa.RegArg)
+    assert isinstance(y, isa.RegArg)
+    if code.op is Op.SUB:
+        return Code(Op.ADDI, (dst, x, isa.ImmArg(0))) if state[y.idx] == 0 else code
+    for reg, known in ((x, state[y.idx]), (y, state[x.idx])):
+        if known is not None and 0 <= known <= isa.IMM_MASK:
+            return Code(Op.ADDI, (dst, reg, isa.ImmArg(known)))
+    return code
+
+
+def _thread_jumps(lines: list[Line]) -> list[Line]:
+    """Retargets branches past unconditional jumps and drops branches to the next instruction"""
+    targets = _label_lines(lines)
+    result = list(lines)
+    removed = set()
+    for index, line in enumerate(lines):
+        if not isinstance(line.word, Code) or line.word.op not in _BRANCHES:
+            continue
+        target = _final_target(lines, targets, _target(line.word))
+        if targets[target] == index + 1:
+            removed.add(index)
+        elif target != _target(line.word):
+            result[index] = line._replace(word=Code(line.word.op, (*line.word.args[:2], LabelArg(target))))
+    return _without(result, removed)
+
+
+def _final_target(lines: list[Line], targets: dict[str, int], name: str) -> str:
+    seen = {name}
+    while True:
+        code = lines[targets[name]].word
+        if not isinstance(code, Code) or not _unconditional(code) or _target(code) in seen:
+            return name
+        name = _target(code)
+        seen.add(name)
+
+
+def _remove_unreachable(lines: list[Line]) -> list[Line]:
+    targets = _label_lines(lines)
+    reached = set()
+    work = [targets["start"]]
+    while len(work) > 0:
+        index = work.pop()
+        if index not in reached:
+            reached.add(index)
+            work.extend(_successors(lines, index, targets))
+    return _without(lines, {i for i, line in enumerate(lines) if isinstance(line.word, Code) and i not in reached})
+
+
+def _remove_dead_code(lines: list[Line]) -> list[Line]:
+    """Drops register writes nothing reads; loads stay when they may touch a device"""
+    removed = set()
+    for index, live in _live_registers(lines).items():
+        code = _code(lines[index])
+        written, _ = _registers(code)
+        if (code.op in _EVAL or _reads_data(code)) and (written is None or written not in live):
+            removed.add(index)
+    return _without(lines, removed)
+
+
+def _reads_data(code: Code) -> bool:
+    if code.op is not Op.LW:
+        return False
+    _, base, address = code.args
+    return base == isa.RegArg(0) and isinstance(address, LabelArg) and address.name not in isa.PREDEFINED_LABELS
+
+
+def _live_registers(lines: list[Line]) -> dict[int, frozenset[int]]:
+    """Registers read later on some path, after each instruction"""
+    targets = _label_lines(lines)
+    code = [index for index, line in enumerate(lines) if isinstance(line.word, Code)]
+    live_in: dict[int, frozenset[int]] = {index: frozenset() for index in code}
+    live_out: dict[int, frozenset[int]] = {}
+    changed = True
+    while changed:
+        changed = False
+        for index in reversed(code):
+            live_out[index] = frozenset().union(*(live_in[s] for s in _successors(lines, index, targets)))
+            written, read = _registers(_code(lines[index]))
+            new = read | (live_out[index] - {written})
+            if new != live_in[index]:
+                live_in[index] = new
+                changed = True
+    return live_out
+
+
+def _registers(code: Code) -> tuple[Optional[int], frozenset[int]]:
+    """The written register and the read ones, leaving out the constant `$0`"""
+    regs = [arg.idx for arg in code.args if isinstance(arg, isa.RegArg)]
+    if code.op in _BRANCHES or code.op is Op.SW:
+        return (None, frozenset(regs) - {0})
+    if len(regs) == 0:
+        return (None, frozenset())
+    written, *read = regs
+    return (written if written != 0 else None, frozenset(read) - {0})
@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import pytest
+import pytest_golden  # type: ignore[import-untyped]
+
+import isa
+import machine
+import translator
+from isa import ImmArg, Op, RegArg
+
+
+@pytest.mark.golden_test("golden/*.yml")
+@pytest.mark.parametrize("profile", ["classic", "dispatch"])
+def test_optimized_program_keeps_output(golden: pytest_golden.plugin.GoldenTestFixture, profile: str) -> None:
+    input_buffer = [ord(c) for c in golden["in_stdin"]] + [0]
+
+    plain = machine.simulation(translator.parse(golden["in_source"]), input_buffer.copy(), profile=profile)
+    optimized = machine.simulation(
+        translator.parse(golden["in_source"], optimize=True), input_buffer.copy(), profile=profile
+    )
+
+    assert optimized.output == plain.output
+    assert optimized.ticks <= plain.ticks
+
+
+def test_constant_move_is_folded() -> None:
+    program = translator.parse("start:\n addi $1, $0, 5\n add $2, $1, $0\n sw $2, $0, output\n halt\n", optimize=True)
+
+    assert program.instructions == [
+        (Op.ADDI, RegArg(2), RegArg(0), ImmArg(5)),
+        (Op.SW, RegArg(2), RegArg(0), ImmArg(isa.OUTPUT_DEVICE_ADDR)),
+        (Op.HALT,),
+    ]
+
+
+def test_jumps_are_threaded_and_unreachable_code_removed() -> None:
+    source = """start:
+        lw $1, $0, input
+        beq $1, $0, skip
+        sw $1, $0, output
+    skip:
+        beq $0, $0, done
+        addi $2, $0, 1
+    done:
+        halt
+    """
+
+    assert translator.parse(source, optimize=True).instructions == [
+        (Op.LW, RegArg(1), RegArg(0), ImmArg(isa.INPUT_DEVICE_ADDR)),
+        (Op.BEQ, RegArg(1), RegArg(0), ImmArg(3)),
+        (Op.SW, RegArg(1), RegArg(0), ImmArg(isa.OUTPUT_DEVICE_ADDR)),
+        (Op.HALT,),
+    ]
+
+
+def test_numeric_addresses_disable_optimization() -> None:
+    source = 'start:\n addi $1, $0, 0\n lw $2, $0, 4\n sw $2, $0, output\n halt\nchar: "A"\n'
+
+    assert translator.parse(source, optimize=True) == translator.parse(source)
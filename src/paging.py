@@ -0,0 +1,232 @@
+from __future__ import annotations
+
+import functools
+from array import array
+from typing import Callable, Final, Optional, TypeAlias, Union
+
+import isa
+
+PAGE_SHIFT: Final[int] = 8
+PAGE_SIZE: Final[int] = 1 << PAGE_SHIFT
+PAGE_MASK: Final[int] = PAGE_SIZE - 1
+WATCH_READ: Final[int] = 1
+WATCH_WRITE: Final[int] = 2
+
+Reader: TypeAlias = Callable[[], int]
+Writer: TypeAlias = Callable[[int], None]
+Watcher: TypeAlias = Callable[[int, int, bool], None]
+"""Called with the address, the value loaded or stored, and whether it was a store"""
+
+
+class MappedPage:
+    """A page with device ports at some offsets and RAM everywhere else.
+
+    A write is stored in RAM before the port's writer runs, so a port without a reader reads
+    back the last written word (or whatever its device left there).
+    """
+
+    ram: array[int]
+    readers: list[Optional[Reader]]
+    writers: list[Optional[Writer]]
+
+    def __init__(self, ram: array[int]) -> None:
+        self.ram = ram
+        self.readers = [None] * len(ram)
+        self.writers = [None] * len(ram)
+
+    def __len__(self) -> int:
+        return len(self.ram)
+
+    def __getitem__(self, offset: int) -> int:
+        reader = self.readers[offset]
+        return self.ram[offset] if reader is None else reader()
+
+    def __setitem__(self, offset: int, value: int) -> None:
+        self.ram[offset] = value
+        writer = self.writers[offset]
+        if writer is not None:
+            writer(value)
+
+
+class WatchedPage(MappedPage):
+    """A page with a watch bitmap: accesses to offsets flagged with `WATCH_READ` or `WATCH_WRITE`
+    are reported to `watcher` after they are done, ports and RAM behave as before"""
+
+    base: int
+    watched: bytearray
+    watcher: Watcher
+
+    def __init__(self, page: Page, base: int, watcher: Watcher) -> None:
+        if isinstance(page, MappedPage):
+            super().__init__(page.ram)
+            self.readers, self.writers = page.readers, page.writers
+        else:
+            super().__init__(page)
+        self.base = base
+        self.watched = bytearray(len(page))
+        self.watcher = watcher
+
+    def __getitem__(self, offset: int) -> int:
+        value = super().__getitem__(offset)
+        if self.watched[offset] & WATCH_READ:
+            self.watcher(self.base + offset, value, False)
+        return value
+
+    def __setitem__(self, offset: int, value: int) -> None:
+        super().__setitem__(offset, value)
+        if self.watched[offset] & WATCH_WRITE:
+            self.watcher(self.base + offset, value, True)
+
+    def unwatched(self) -> Page:
+        """The page without the bitmap"""
+        if any(reader is not None for reader in self.readers) or any(writer is not None for writer in self.writers):
+            page = MappedPage(self.ram)
+            page.readers, page.writers = self.readers, self.writers
+            return page
+        return self.ram
+
+
+Page: TypeAlias = Union["array[int]", MappedPage]
+
+
+class PagedMemory:
+    """Guest memory made of `PAGE_SIZE`-word pages that are allocated on the first write.
+
+    Until then a page is a zero page shared by every memory, so a run only pays for the pages
+    its program is loaded into and the ones it writes. Indexing works like the flat array it
+    replaces, including `IndexError` past the end of memory.
+
+    Devices are mapped into the same page table: a page holding a port becomes a `MappedPage`,
+    so decoding an address is one lookup and RAM accesses never check for devices.
+
+    >>> memory = PagedMemory()
+    >>> memory[0x1234] = 7
+    >>> (memory[0x1234], memory[0x1235], memory.resident_pages())
+    (7, 0, [18])
+    """
+
+    size: int
+    pages: list[Page]
+    """Hot loops may read `pages[address >> PAGE_SHIFT][address & PAGE_MASK]`, but writes must
+    go through the memory: zero pages are shared and must not be modified"""
+    write_listeners: list[Callable[[int, int], None]]
+    """Called with the address and the length of every `write_words`, which bypasses the engines"""
+    _resident: bytearray
+
+    def __init__(self, size: int = isa.MEMORY_SIZE) -> None:
+        self.size = size
+        full, tail = divmod(size, PAGE_SIZE)
+        pages: list[Page] = [_zero_page(PAGE_SIZE)] * full
+        self.pages = pages + ([_zero_page(tail)] if tail > 0 else [])
+        self.write_listeners = []
+        self._resident = bytearray(len(self.pages))
+
+    @classmethod
+    def from_program(cls, program: isa.LoadableProgram) -> PagedMemory:
+        memory = cls()
+        for section in program.sections():
+            assert section.address + len(section.words) <= memory.size, (
+                f"Section at {section.address} does not fit into memory"
+            )
+            memory.write_words(section.address, section.words)
+            section.words.release()
+        return memory
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, address: int) -> int:
+        return self.pages[address >> PAGE_SHIFT][address & PAGE_MASK]
+
+    def __setitem__(self, address: int, value: int) -> None:
+        number = address >> PAGE_SHIFT
+        if not self._resident[number]:
+            self._allocate(number)
+        self.pages[number][address & PAGE_MASK] = value
+
+    def map(self, address: int, read: Optional[Reader] = None, write: Optional[Writer] = None) -> None:
+        """Makes `address` a device port; loads call `read` instead of reading RAM, and stores call `write`"""
+        number, offset = divmod(address, PAGE_SIZE)
+        if not self._resident[number]:
+            self._allocate(number)
+        page = self.pages[number]
+        if not isinstance(page, MappedPage):
+            page = self.pages[number] = MappedPage(self.ram(number))
+        assert page.readers[offset] is None, f"Address {address:#x} is already mapped"
+        assert page.writers[offset] is None, f"Address {address:#x} is already mapped"
+        page.readers[offset] = read
+        page.writers[offset] = write
+
+    def watch(self, address: int, count: int, watcher: Watcher, flags: int = WATCH_READ | WATCH_WRITE) -> None:
+        """Reports accesses to `count` words from `address` to `watcher`.
+
+        Only the pages holding them get a bitmap, so accesses to other pages cost nothing more.
+        """
+        assert 0 <= address <= address + count <= self.size, f"Block at {address} does not fit into memory"
+        for watched in range(address, address + count):
+            number, offset = divmod(watched, PAGE_SIZE)
+            if not self._resident[number]:
+                self._allocate(number)
+            page = self.pages[number]
+            if not isinstance(page, WatchedPage):
+                page = self.pages[number] = WatchedPage(page, number * PAGE_SIZE, watcher)
+            assert page.watcher == watcher, f"Page {number} is watched by another watcher"
+            page.watched[offset] |= flags
+
+    def unwatch(self, address: int, count: int) -> None:
+        """Stops watching `count` words from `address`; pages left without watched words lose their bitmap"""
+        assert 0 <= address <= address + count <= self.size, f"Block at {address} does not fit into memory"
+        for watched in range(address, address + count):
+            number, offset = divmod(watched, PAGE_SIZE)
+            page = self.pages[number]
+            if isinstance(page, WatchedPage):
+                page.watched[offset] = 0
+                if not any(page.watched):
+                    self.pages[number] = page.unwatched()
+
+    def ram(self, number: int) -> array[int]:
+        """RAM words of a page, without its ports; a zero page is shared and must not be modified"""
+        page = self.pages[number]
+        return page.ram if isinstance(page, MappedPage) else page
+
+    def read_words(self, address: int, count: int) -> array[int]:
+        """RAM words from `address`, without triggering device ports"""
+        assert 0 <= address <= address + count <= self.size, f"Block at {address} does not fit into memory"
+        words = array("I")
+        while count > 0:
+            number, offset = divmod(address, PAGE_SIZE)
+            ram = self.ram(number)
+            words.extend(ram[offset : offset + count])
+            address, count = address + len(ram) - offset, count - (len(ram) - offset)
+        return words
+
+    def write_words(self, address: int, words: Union[array[int], memoryview]) -> None:
+        """Stores consecutive `words` from `address` in RAM, page by page, without triggering device ports"""
+        assert 0 <= address <= address + len(words) <= self.size, f"Block at {address} does not fit into memory"
+        with memoryview(words) as source:
+            done = 0
+            while done < len(source):
+                number, offset = divmod(address + done, PAGE_SIZE)
+                count = min(len(source) - done, PAGE_SIZE - offset)
+                if not self._resident[number]:
+                    self._allocate(number)
+                with memoryview(self.ram(number)) as page:
+                    page[offset : offset + count] = source[done : done + count]
+                done += count
+        for listener in self.write_listeners:
+            listener(address, len(words))
+
+    def resident_pages(self) -> list[int]:
+        """Numbers of the pages that were allocated by loading the program or by writes"""
+        return [number for number, resident in enumerate(self._resident) if resident]
+
+    def _allocate(self, number: int) -> None:
+        zero = self.pages[number]
+        assert isinstance(zero, array), "Only zero pages are allocated"
+        self.pages[number] = array("I", zero)
+        self._resident[number] = True
+
+
+@functools.cache
+def _zero_page(size: int) -> array[int]:
+    return array("I", [0]) * size
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+from array import array
+
+import pytest
+
+import devices
+import isa
+import machine
+import paging
+import translator
+
+
+def test_program_pages_are_resident_and_untouched_pages_shared() -> None:
+    program = translator.parse('start:\n halt\ndata: "ab"\n')
+    memory = paging.PagedMemory.from_program(program)
+    other = paging.PagedMemory()
+
+    assert memory.resident_pages() == [0]
+    assert [memory[address] for address in range(3)] == list(isa.memory_image(program)[:3])
+    assert memory.pages[1] is other.pages[1]
+
+
+def test_writes_across_pages_allocate_only_them() -> None:
+    memory = paging.PagedMemory()
+    memory.write_words(paging.PAGE_SIZE - 1, array("I", [1, 2, 3]))
+    memory[isa.OUTPUT_DEVICE_ADDR] = 4
+
+    assert memory.resident_pages() == [0, 1, isa.OUTPUT_DEVICE_ADDR >> paging.PAGE_SHIFT]
+    assert [memory[address] for address in range(paging.PAGE_SIZE - 2, paging.PAGE_SIZE + 3)] == [0, 1, 2, 3, 0]
+    assert paging.PagedMemory().pages[1] == array("I", [0]) * paging.PAGE_SIZE
+
+
+def test_addresses_past_memory_are_rejected() -> None:
+    memory = paging.PagedMemory()
+    memory[isa.MEMORY_SIZE - 1] = 1
+    with pytest.raises(IndexError):
+        memory[isa.MEMORY_SIZE] = 1
+    with pytest.raises(IndexError):
+        memory[isa.MEMORY_SIZE]
+
+
+def test_run_allocates_written_pages() -> None:
+    program = translator.parse("start:\n addi $1, $0, 65\n sw $1, $0, output\n halt\n")
+    unit = machine.prepare(program, devices.BufferInput([]), devices.BufferOutput())
+    unit.run()
+
+    assert unit.data_path.memory.resident_pages() == [0, isa.OUTPUT_DEVICE_ADDR >> paging.PAGE_SHIFT]
+
+
+def test_mapped_ports_dispatch_and_keep_ram_elsewhere() -> None:
+    memory = paging.PagedMemory()
+    written: list[int] = []
+    memory.map(0x1200, read=lambda: 42)
+    memory.map(0x1201, write=written.append)
+    memory[0x1202] = 5
+    memory[0x1201] = 7
+
+    assert (memory[0x1200], memory[0x1201], memory[0x1202], written) == (42, 7, 5, [7])
+    assert memory.read_words(0x1200, 3) == array("I", [0, 7, 5])
+    with pytest.raises(AssertionError, match="already mapped"):
+        memory.map(0x1200, read=lambda: 0)
+
+
+def test_watched_pages_report_accesses_and_keep_ports() -> None:
+    memory = paging.PagedMemory()
+    outputs: list[int] = []
+    memory.map(isa.OUTPUT_DEVICE_ADDR, write=outputs.append)
+    accesses: list[tuple[int, int, bool]] = []
+
+    def watcher(address: int, value: int, write: bool) -> None:
+        accesses.append((address, value, write))
+
+    memory.watch(0x1234, 2, watcher, paging.WATCH_WRITE)
+    memory.watch(isa.OUTPUT_DEVICE_ADDR, 1, watcher)
+    memory[0x1234] = 7
+    memory[0x1236] = 8
+    memory[isa.OUTPUT_DEVICE_ADDR] = 65
+    memory.write_words(0x1235, array("I", [9]))
+    assert (memory[0x1234], memory[0x1235], memory[isa.OUTPUT_DEVICE_ADDR]) == (7, 9, 65)
+
+    assert accesses == [(0x1234, 7, True), (isa.OUTPUT_DEVICE_ADDR, 65, True), (isa.OUTPUT_DEVICE_ADDR, 65, False)]
+    assert outputs == [65]
+    memory.unwatch(0x1234, 2)
+    memory.unwatch(isa.OUTPUT_DEVICE_ADDR, 1)
+    assert type(memory.pages[0x12]) is array
+    assert type(memory.pages[isa.OUTPUT_DEVICE_ADDR >> paging.PAGE_SHIFT]) is paging.MappedPage
+    memory[isa.OUTPUT_DEVICE_ADDR] = 66
+    assert outputs == [65, 66]
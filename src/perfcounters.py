@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import argparse
+import collections
+import json
+import sys
+from typing import Any, Iterator, Optional
+
+import isa
+from devices import InputDevice, OutputDevice, StreamInput, StreamOutput
+from machine import ControlUnit, DataPath
+from microcode import PROFILES, routine_names
+from paging import PAGE_MASK, PAGE_SHIFT
+
+Sample = tuple[int, int, int]
+
+
+class PerfCounters:
+    """Ticks sampled by (guest pc, opcode, mpc), plus device access counts.
+
+    Every other view (ticks per op, microcode address counts, hot pcs) is aggregated from the
+    samples on export, so collecting costs a single dict update per tick.
+    """
+
+    profile: str
+    samples: dict[Sample, int]
+    device_reads: int
+    device_writes: int
+
+    def __init__(self, profile: str) -> None:
+        self.profile = profile
+        self.samples = {}
+        self.device_reads = 0
+        self.device_writes = 0
+
+    def op_ticks(self) -> dict[str, int]:
+        ticks: collections.Counter[str] = collections.Counter()
+        for (_, code, _), count in self.samples.items():
+            ticks[_op_name(code)] += count
+        return dict(ticks.most_common())
+
+    def op_counts(self) -> dict[str, int]:
+        """Executed instructions per op, counted by their fetch microinstruction"""
+        counts: collections.Counter[str] = collections.Counter()
+        for (_, code, mpc), count in self.samples.items():
+            if mpc == 0:
+                counts[_op_name(code)] += count
+        return dict(counts.most_common())
+
+    def mpc_counts(self) -> list[dict[str, Any]]:
+        counts: collections.Counter[int] = collections.Counter()
+        for (_, _, mpc), count in self.samples.items():
+            counts[mpc] += count
+        names = routine_names(self.profile)
+        return [{"mpc": mpc, "routine": names[mpc], "count": counts[mpc]} for mpc in sorted(counts)]
+
+    def hot_pcs(self, limit: Optional[int] = None) -> list[dict[str, int]]:
+        ticks: collections.Counter[int] = collections.Counter()
+        executed: collections.Counter[int] = collections.Counter()
+        for (pc, _, mpc), count in self.samples.items():
+            ticks[pc] += count
+            if mpc == 0:
+                executed[pc] += count
+        return [{"pc": pc, "ticks": count, "executed": executed[pc]} for pc, count in ticks.most_common(limit)]
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            "profile": self.profile,
+            "ticks": sum(self.samples.values()),
+            "op_ticks": self.op_ticks(),
+            "op_counts": self.op_counts(),
+            "mpc_counts": self.mpc_counts(),
+            "hot_pcs": self.hot_pcs(),
+            "devices": {"reads": self.device_reads, "writes": self.device_writes},
+        }
+
+    def collapsed_stacks(self) -> Iterator[str]:
+        """Lines of `op;pc;routine ticks`, the input format of flamegraph.pl and speedscope"""
+        names = routine_names(self.profile)
+        stacks: collections.Counter[str] = collections.Counter()
+        for (pc, code, mpc), count in self.samples.items():
+            stacks[f"{_op_name(code)};{pc:#06x};{names[mpc]}"] += count
+        for stack in sorted(stacks):
+            yield f"{stack} {stacks[stack]}"
+
+
+class ProfilingControlUnit(ControlUnit):
+    """`ControlUnit` that samples every tick into `PerfCounters`; the base class stays uninstrumented"""
+
+    counters: PerfCounters
+    _current: tuple[int, int]
+
+    def __init__(self, microcode: list[isa.MInstruction], data_path: DataPath, counters: PerfCounters) -> None:
+        super().__init__(microcode, data_path)
+        self.counters = counters
+        self._current = (0, 0)
+
+    def execute_microinstruction(self) -> None:
+        mpc = self.mpc
+        if mpc == 0:
+            pc = self.data_path.registers[isa.PC]
+            # RAM is read directly, so device ports and watchpoints see only the fetch itself
+            word = self.data_path.memory.ram(pc >> PAGE_SHIFT)[pc & PAGE_MASK]
+            self._current = (pc, word >> isa.OPCODE_SHIFT)
+        super().execute_microinstruction()
+        sample = (*self._current, mpc)
+        self.counters.samples[sample] = self.counters.samples.get(sample, 0) + 1
+
+
+class CountingInput:
+    device: InputDevice
+    counters: PerfCounters
+
+    def __init__(self, device: InputDevice, counters: PerfCounters) -> None:
+        self.device = device
+        self.counters = counters
+
+    @property
+    def pos(self) -> int:
+        return self.device.pos
+
+    @property
+    def ended(self) -> bool:
+        return self.device.ended
+
+    def read(self) -> int:
+        self.counters.device_reads += 1
+        return self.device.read()
+
+    def skip(self, count: int, *, ended: bool = False) -> None:
+        self.device.skip(count, ended=ended)
+
+
+class CountingOutput:
+    device: OutputDevice
+    counters: PerfCounters
+
+    def __init__(self, device: OutputDevice, counters: PerfCounters) -> None:
+        self.device = device
+        self.counters = counters
+
+    @property
+    def written(self) -> int:
+        return self.device.written
+
+    def write(self, char: int) -> None:
+        self.counters.device_writes += 1
+        self.device.write(char)
+
+    def flush(self) -> None:
+        self.device.flush()
+
+
+def profile_run(
+    program: isa.LoadableProgram,
+    input_device: InputDevice,
+    output_device: OutputDevice,
+    profile: str = "classic",
+) -> tuple[ProfilingControlUnit, PerfCounters]:
+    counters = PerfCounters(profile)
+    data_path = DataPath(program, CountingInput(input_device, counters), CountingOutput(output_device, counters))
+    unit = ProfilingControlUnit(PROFILES[profile], data_path, counters)
+    unit.run()
+    return (unit, counters)
+
+
+def _op_name(code: int) -> str:
+    op = isa.op_from_code(code)
+    return op.name if op is not None else f"op{code}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a program on the microcode engine and collect counters")
+    parser.add_argument("program_file")
+    parser.add_argument("input_file")
+    parser.add_argument("--microcode", choices=PROFILES.keys(), default="classic")
+    parser.add_argument("--json", metavar="FILE", help="write all counters as JSON")
+    parser.add_argument("--collapsed", metavar="FILE", help="write collapsed stacks for flamegraph tools")
+    args = parser.parse_args()
+    output_device = StreamOutput(sys.stdout)
+    with open(args.input_file, encoding="ascii") as f, isa.open_program(args.program_file) as program:
+        try:
+            _, counters = profile_run(program, StreamInput(f), output_device, args.microcode)
+        finally:
+            output_device.flush()
+    if args.json is not None:
+        with open(args.json, "w") as out:
+            json.dump(counters.to_json(), out, indent=2)
+    if args.collapsed is not None:
+        with open(args.collapsed, "w") as out:
+            out.writelines(line + "\n" for line in counters.collapsed_stacks())
+    for name, ticks in counters.op_ticks().items():
+        print(f"{name:6} {ticks:>10} ticks {counters.op_counts().get(name, 0):>8} executed", file=sys.stderr)
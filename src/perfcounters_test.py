@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import pathlib
+
+import pytest
+
+import devices
+import machine
+import paging
+import perfcounters
+import translator
+from microcode import PROFILES
+
+_EXAMPLES = pathlib.Path(__file__).parent.parent / "examples"
+
+
+@pytest.mark.parametrize("profile", ["classic", "dispatch"])
+def test_counters_add_up_to_run_totals(profile: str) -> None:
+    program = translator.parse((_EXAMPLES / "cat.asm").read_text())
+    text = "count me\n"
+    expected = machine.simulation(program, [ord(c) for c in text] + [0], profile=profile)
+
+    output_device = devices.BufferOutput()
+    unit, counters = perfcounters.profile_run(
+        program, devices.BufferInput([ord(c) for c in text] + [0]), output_device, profile
+    )
+
+    assert output_device.text() == expected.output
+    assert (unit.ticks, unit.instructions) == (expected.ticks, expected.instructions)
+    assert sum(counters.op_ticks().values()) == expected.ticks
+    assert sum(counters.op_counts().values()) == expected.instructions
+    assert sum(pc["executed"] for pc in counters.hot_pcs()) == expected.instructions
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in counters.collapsed_stacks()) == expected.ticks
+    assert (counters.device_reads, counters.device_writes) == (len(text) + 1, len(text))
+    assert counters.op_counts()["LW"] == len(text) + 1
+
+
+def test_collapsed_stacks_name_routines() -> None:
+    program = translator.parse("start:\n addi $1, $0, 1\n halt\n")
+    _, counters = perfcounters.profile_run(program, devices.BufferInput([]), devices.BufferOutput())
+
+    assert list(counters.collapsed_stacks()) == [
+        "ADDI;0x0000;ADDI 6",
+        "ADDI;0x0000;increment_pc 2",
+        "ADDI;0x0000;instruction_fetch 6",
+        "HALT;0x0001;instruction_fetch 11",
+    ]
+
+
+def test_profiling_does_not_read_through_watchpoints() -> None:
+    program = translator.parse((_EXAMPLES / "cat.asm").read_text())
+    text = "watched\n"
+    counters = perfcounters.PerfCounters("classic")
+    data_path = machine.DataPath(program, devices.BufferInput([ord(c) for c in text] + [0]), devices.BufferOutput())
+    reads: list[int] = []
+    data_path.memory.watch(program.start, 1, lambda address, value, write: reads.append(address), paging.WATCH_READ)
+    unit = perfcounters.ProfilingControlUnit(PROFILES["classic"], data_path, counters)
+
+    unit.run()
+
+    fetches = sum(count for (pc, _, mpc), count in counters.samples.items() if pc == program.start and mpc == 0)
+    assert len(reads) == fetches == len(text) + 1
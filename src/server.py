@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import collections
+import concurrent.futures
+import hashlib
+import io
+import json
+import os
+import pathlib
+import sys
+from typing import Any, Final, Optional
+
+import isa
+import machine
+import translator
+from client import DEFAULT_SOCKET
+
+CACHED_PROGRAMS: Final[int] = 64
+MAX_REQUEST: Final[int] = 64 * 1024 * 1024
+
+_programs: collections.OrderedDict[str, isa.LoadableProgram] = collections.OrderedDict()
+
+
+def _init_worker() -> None:
+    _programs.clear()
+    machine.simulation(translator.parse("start: halt"), [0])  # loads everything a first request would need
+
+
+def handle(request: dict[str, Any]) -> dict[str, Any]:
+    """Runs in a worker process and answers one request; a failure is answered with its error"""
+    try:
+        if request["op"] == "translate":
+            return _translate(
+                request["source"], binary=request.get("binary", False), optimize=request.get("optimize", False)
+            )
+        assert request["op"] == "run", f"Unknown request '{request['op']}'"
+        result = machine.simulation(
+            _program(base64.b64decode(request["program"])),
+            [ord(char) for char in request["input"]] + [0],
+            request.get("engine", "microcode"),
+            request.get("profile", "classic"),
+            max_ticks=request.get("max_ticks"),
+            max_instructions=request.get("max_instructions"),
+        )
+    except Exception as e:  # a failing request is reported and must not stop the worker
+        return {"error": f"{type(e).__name__}: {e}"}
+    return result._asdict()
+
+
+def _translate(source: str, *, binary: bool, optimize: bool) -> dict[str, Any]:
+    program = translator.parse(source, optimize=optimize)
+    if binary:
+        out = io.BytesIO()
+        isa.write_object(program, out)
+        return {"program": base64.b64encode(out.getvalue()).decode()}
+    text = io.StringIO()
+    isa.write_program(program, text)
+    return {"program": base64.b64encode(text.getvalue().encode()).decode()}
+
+
+def _program(payload: bytes) -> isa.LoadableProgram:
+    """Loads a JSON or object file's contents once and keeps the last `CACHED_PROGRAMS` by hash"""
+    key = hashlib.sha256(payload).hexdigest()
+    program = _programs.get(key)
+    if program is not None:
+        _programs.move_to_end(key)
+        return program
+    if payload.startswith(isa.OBJECT_MAGIC):
+        program = isa.ObjectImage(payload)
+    else:
+        program = isa.read_program(io.StringIO(payload.decode()))
+    _programs[key] = program
+    if len(_programs) > CACHED_PROGRAMS:
+        _programs.popitem(last=False)
+    return program
+
+
+async def serve(path: str, workers: Optional[int] = None, ready: Optional[asyncio.Event] = None) -> None:
+    """Answers requests on the Unix socket at `path` until cancelled; a stale socket file is replaced.
+
+    Requests from one connection are answered in order, while connections are served by the
+    pool concurrently. Workers are started and warmed up before the socket is opened.
+    """
+    workers = workers or os.cpu_count() or 1
+    loop = asyncio.get_running_loop()
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=_init_worker) as pool:
+        await asyncio.gather(*(loop.run_in_executor(pool, _warm) for _ in range(workers)))
+
+        async def connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            try:
+                while line := await reader.readline():
+                    response = await loop.run_in_executor(pool, handle, json.loads(line))
+                    writer.write(json.dumps(response).encode() + b"\n")
+                    await writer.drain()
+            finally:
+                writer.close()
+
+        server = await asyncio.start_unix_server(connection, path, limit=MAX_REQUEST)
+        async with server:
+            if ready is not None:
+                ready.set()
+            await server.serve_forever()
+
+
+def main(path: str, workers: Optional[int] = None) -> None:
+    try:
+        asyncio.run(serve(path, workers))
+    except KeyboardInterrupt:
+        print("Server stopped", file=sys.stderr)
+    finally:
+        pathlib.Path(path).unlink(missing_ok=True)
+
+
+def _warm() -> None:
+    """Makes the pool start a worker, which runs `_init_worker` before this"""
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve translate and run requests from 'client.py'")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help=f"socket to listen on, '{DEFAULT_SOCKET}' by default")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="number of worker processes")
+    args = parser.parse_args()
+    main(args.socket, args.jobs)
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import asyncio
+import io
+import os
+import pathlib
+from typing import Callable, TypeVar
+
+import pytest
+
+import client
+import isa
+import machine
+import server
+import translator
+
+_EXAMPLES = pathlib.Path(__file__).parent.parent / "examples"
+_Result = TypeVar("_Result")
+
+
+def _with_server(socket_path: str, talk: Callable[[], _Result]) -> _Result:
+    """Runs `talk` in a thread while a two-worker server listens on `socket_path`"""
+
+    async def session() -> _Result:
+        ready = asyncio.Event()
+        serving = asyncio.create_task(server.serve(socket_path, workers=2, ready=ready))
+        await ready.wait()
+        try:
+            return await asyncio.to_thread(talk)
+        finally:
+            serving.cancel()
+
+    return asyncio.run(session())
+
+
+def test_translate_and_run_match_local_tools(tmp_path: os.PathLike[str]) -> None:
+    socket_path = os.path.join(tmp_path, "sim.sock")
+    source = (_EXAMPLES / "hello_user_name.asm").read_text()
+    text = "Alice\n"
+
+    def talk() -> tuple[bytes, bytes, list[dict[str, object]]]:
+        with client.Client(socket_path) as connection:
+            translated = connection.translate(source)
+            binary = connection.translate(source, binary=True, optimize=True)
+            results = [
+                connection.run(translated, text),
+                connection.run(translated, text, "jit", "optimized"),
+                connection.run(binary, text, "functional"),
+                connection.run(translated, text, max_ticks=100),
+            ]
+        return translated, binary, results
+
+    translated, binary, results = _with_server(socket_path, talk)
+
+    out = io.StringIO()
+    isa.write_program(translator.parse(source), out)
+    assert translated == out.getvalue().encode()
+    assert binary.startswith(isa.OBJECT_MAGIC)
+    expected = machine.simulation(translator.parse(source), [ord(char) for char in text] + [0])
+    optimized = machine.simulation(translator.parse(source, optimize=True), [ord(char) for char in text] + [0])
+    assert results[0] == expected._asdict()
+    assert results[1]["output"] == expected.output
+    assert results[2] == optimized._asdict()
+    assert (results[3]["ticks"], results[3]["halted"]) == (100, False)
+
+
+def test_errors_are_reported_without_stopping_the_server(tmp_path: os.PathLike[str]) -> None:
+    socket_path = os.path.join(tmp_path, "sim.sock")
+
+    def talk() -> list[str]:
+        errors = []
+        with client.Client(socket_path) as connection:
+            for request in ({"op": "translate", "source": "start: beq $0, $0, missing"}, {"op": "explode"}):
+                with pytest.raises(client.ServerError) as failure:
+                    connection.request(request)
+                errors.append(str(failure.value))
+            assert connection.translate("start: halt").startswith(b"[")
+        return errors
+
+    errors = _with_server(socket_path, talk)
+
+    assert errors[0] == "AssertionError: Label 'missing' is used, but not declared"
+    assert errors[1] == "AssertionError: Unknown request 'explode'"
+
+
+def test_programs_are_cached_by_hash() -> None:
+    out = io.StringIO()
+    isa.write_program(translator.parse("start: halt"), out)
+    payload = out.getvalue().encode()
+    server._programs.clear()
+
+    first = server._program(payload)
+    assert server._program(bytes(payload)) is first
+    for n in range(server.CACHED_PROGRAMS):
+        server._program(payload + b" " * (n + 1))
+    assert len(server._programs) == server.CACHED_PROGRAMS
+    assert server._program(payload) is not first
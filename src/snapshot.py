@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import hashlib
+import struct
+import sys
+from array import array
+from typing import TYPE_CHECKING, BinaryIO, Final, NamedTuple
+
+import isa
+from paging import PAGE_SIZE, PagedMemory
+
+if TYPE_CHECKING:
+    from machine import Engine
+
+SNAPSHOT_MAGIC: Final[bytes] = b"ASMS"
+SNAPSHOT_VERSION: Final[int] = 2
+
+_HEADER: Final[struct.Struct] = struct.Struct("<4sHQQI??Q?QQQ?32sB")
+_REGISTER: Final[struct.Struct] = struct.Struct("<H")
+_RUN_COUNT: Final[struct.Struct] = struct.Struct("<I")
+_RUN: Final[struct.Struct] = struct.Struct("<II")
+
+
+class Snapshot(NamedTuple):
+    """Machine state between two microinstructions.
+
+    Memory is kept as runs of words that differ from the program image, and the image itself
+    is identified by its sha256 so a snapshot can't be resumed against another program.
+    """
+
+    mpc: int
+    ticks: int
+    instructions: int
+    registers: list[int]
+    carry: bool
+    zero: bool
+    input_pos: int
+    input_ended: bool
+    output_written: int
+    dma: tuple[int, int, bool]
+    """Address, copied count and end of input of the DMA controller"""
+    image_digest: bytes
+    memory: list[tuple[int, array[int]]]
+
+
+def capture(unit: Engine, program: isa.LoadableProgram) -> Snapshot:
+    data_path = unit.data_path
+    data_path.output_device.flush()
+    image = PagedMemory.from_program(program)
+    return Snapshot(
+        mpc=unit.mpc,
+        ticks=unit.ticks,
+        instructions=unit.instructions,
+        registers=data_path.registers.copy(),
+        carry=data_path.carry,
+        zero=data_path.zero,
+        input_pos=data_path.input_device.pos,
+        input_ended=data_path.input_device.ended,
+        output_written=data_path.output_device.written,
+        dma=(data_path.dma.address, data_path.dma.copied, data_path.dma.ended),
+        image_digest=_digest(image),
+        memory=memory_delta(data_path.memory, image),
+    )
+
+
+def restore(snapshot: Snapshot, unit: Engine, program: isa.LoadableProgram) -> None:
+    """Brings a freshly loaded `unit` to the snapshot state, skipping the input it already consumed"""
+    data_path = unit.data_path
+    assert _digest(PagedMemory.from_program(program)) == snapshot.image_digest, "Snapshot was taken for another program"
+    for address, words in snapshot.memory:
+        data_path.memory.write_words(address, words)
+    data_path.registers[:] = snapshot.registers
+    data_path.carry = snapshot.carry
+    data_path.zero = snapshot.zero
+    data_path.dma.address, data_path.dma.copied, data_path.dma.ended = snapshot.dma
+    data_path.input_device.skip(snapshot.input_pos - data_path.input_device.pos, ended=snapshot.input_ended)
+    unit.restore(snapshot.mpc, snapshot.ticks, snapshot.instructions)
+
+
+def memory_delta(memory: PagedMemory, image: PagedMemory) -> list[tuple[int, array[int]]]:
+    """Runs of words that differ from the image; only pages resident in `memory` can differ
+
+    >>> memory, image = PagedMemory(), PagedMemory()
+    >>> image.write_words(1, array("I", [9, 9, 3, 9]))
+    >>> memory.write_words(1, array("I", [1, 2, 3, 4]))
+    >>> memory_delta(memory, image)
+    [(1, array('I', [1, 2])), (4, array('I', [4]))]
+    """
+    runs: list[tuple[int, array[int]]] = []
+    for number in memory.resident_pages():
+        page, original = memory.ram(number), image.ram(number)
+        if page == original:
+            continue
+        base = number * PAGE_SIZE
+        for offset, word in enumerate(page):
+            if word == original[offset]:
+                continue
+            address = base + offset
+            if len(runs) > 0 and runs[-1][0] + len(runs[-1][1]) == address:
+                runs[-1][1].append(word)
+            else:
+                runs.append((address, array("I", [word])))
+    return runs
+
+
+def write_snapshot(snapshot: Snapshot, out: BinaryIO) -> None:
+    out.write(
+        _HEADER.pack(
+            SNAPSHOT_MAGIC,
+            SNAPSHOT_VERSION,
+            snapshot.ticks,
+            snapshot.instructions,
+            snapshot.mpc,
+            snapshot.carry,
+            snapshot.zero,
+            snapshot.input_pos,
+            snapshot.input_ended,
+            snapshot.output_written,
+            *snapshot.dma,
+            snapshot.image_digest,
+            len(snapshot.registers),
+        )
+    )
+    for reg in snapshot.registers:
+        # Registers hold unbounded ALU results, so they are stored with their own length
+        encoded = reg.to_bytes((reg.bit_length() + 8) // 8, "little", signed=True)
+        out.write(_REGISTER.pack(len(encoded)) + encoded)
+    out.write(_RUN_COUNT.pack(len(snapshot.memory)))
+    for address, words in snapshot.memory:
+        out.write(_RUN.pack(address, len(words)))
+        out.write(_little_endian(words).tobytes())
+
+
+def read_snapshot(src: BinaryIO) -> Snapshot:
+    data = src.read()
+    fields = _HEADER.unpack_from(data)
+    (
+        magic,
+        version,
+        ticks,
+        instructions,
+        mpc,
+        carry,
+        zero,
+        input_pos,
+        input_ended,
+        output_written,
+        *dma,
+        digest,
+        reg_n,
+    ) = fields
+    assert magic == SNAPSHOT_MAGIC, "Not a snapshot file"
+    assert version == SNAPSHOT_VERSION, f"Unsupported snapshot version {version}"
+    offset = _HEADER.size
+    registers = []
+    for _ in range(reg_n):
+        (length,) = _REGISTER.unpack_from(data, offset)
+        offset += _REGISTER.size
+        registers.append(int.from_bytes(data[offset : offset + length], "little", signed=True))
+        offset += length
+    (run_count,) = _RUN_COUNT.unpack_from(data, offset)
+    offset += _RUN_COUNT.size
+    memory = []
+    for _ in range(run_count):
+        address, length = _RUN.unpack_from(data, offset)
+        offset += _RUN.size
+        words = array("I", data[offset : offset + 4 * length])
+        offset += 4 * length
+        memory.append((address, _little_endian(words)))
+    dma_address, copied, ended = dma
+    return Snapshot(
+        mpc,
+        ticks,
+        instructions,
+        registers,
+        carry,
+        zero,
+        input_pos,
+        input_ended,
+        output_written,
+        (dma_address, copied, ended),
+        digest,
+        memory,
+    )
+
+
+def _little_endian(words: array[int]) -> array[int]:
+    if sys.byteorder == "little":
+        return words
+    swapped = array("I", words)
+    swapped.byteswap()
+    return swapped
+
+
+def _digest(image: PagedMemory) -> bytes:
+    digest = hashlib.sha256()
+    for number in range(len(image.pages)):
+        digest.update(_little_endian(image.ram(number)).tobytes())
+    return digest.digest()
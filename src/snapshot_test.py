@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import contextlib
+import io
+import os
+import pathlib
+
+import pytest
+
+import devices
+import machine
+import snapshot
+import translator
+
+_EXAMPLES = pathlib.Path(__file__).parent.parent / "examples"
+
+
+@pytest.mark.parametrize(("engine", "budget"), [("microcode", 1000), ("functional", 500), ("jit", 500)])
+def test_resumed_run_matches_uninterrupted(engine: str, budget: int) -> None:
+    program = translator.parse((_EXAMPLES / "cat.asm").read_text())
+    input_buffer = [ord(c) for c in "resume me, please\n" * 10] + [0]
+    full = machine.simulation(program, input_buffer.copy(), engine)
+
+    unit = machine.prepare(program, devices.BufferInput(input_buffer.copy()), devices.BufferOutput(), engine)
+    assert not unit.run(max_ticks=budget)
+    out = io.BytesIO()
+    snapshot.write_snapshot(snapshot.capture(unit, program), out)
+    saved = snapshot.read_snapshot(io.BytesIO(out.getvalue()))
+    resumed = machine.simulation(program, input_buffer.copy(), engine, resume=saved)
+
+    assert saved.output_written + len(resumed.output) == len(full.output)
+    assert full.output.endswith(resumed.output)
+    assert resumed[1:] == full[1:]
+
+
+@pytest.mark.parametrize("engine", ["microcode", "functional", "jit"])
+@pytest.mark.parametrize("budget", [2, 3, 4, 5, 7, 9, 12])
+def test_resumed_dma_transfers_continue_at_the_saved_address(engine: str, budget: int) -> None:
+    program = translator.parse((_EXAMPLES / "cat_dma.asm").read_text())
+    input_buffer = [ord(c) for c in "copied in blocks " * 6] + [0]
+    full = machine.simulation(program, input_buffer.copy(), engine)
+
+    unit = machine.prepare(program, devices.BufferInput(input_buffer.copy()), devices.BufferOutput(), engine)
+    assert not unit.run(max_instructions=budget)
+    out = io.BytesIO()
+    snapshot.write_snapshot(snapshot.capture(unit, program), out)
+    saved = snapshot.read_snapshot(io.BytesIO(out.getvalue()))
+    resumed = machine.simulation(program, input_buffer.copy(), engine, resume=saved)
+
+    assert saved.output_written + len(resumed.output) == len(full.output)
+    assert resumed[1:] == full[1:]
+
+
+@pytest.mark.parametrize("engine", ["microcode", "functional", "jit"])
+def test_resumed_run_keeps_the_end_of_input(engine: str) -> None:
+    program = translator.parse(
+        """start:
+            lw $1, $0, input
+            beq $1, $0, end
+            beq $0, $0, start
+        end:
+            addi $2, $0, 1
+            lw $1, $0, input
+            halt
+        """
+    )
+    unit = machine.prepare(program, devices.StreamInput(io.StringIO("ab")), devices.BufferOutput(), engine)
+    assert not unit.run(max_instructions=8)
+    saved = snapshot.capture(unit, program)
+    assert saved.input_ended
+
+    resumed = machine.prepare(
+        program, devices.StreamInput(io.StringIO("ab")), devices.BufferOutput(), engine, resume=saved
+    )
+    with pytest.raises(AssertionError, match="Read from empty input buffer"):
+        resumed.run()
+
+
+def test_budget_stops_runaway_program() -> None:
+    program = translator.parse("start: beq $0, $0, start\n")
+
+    result = machine.simulation(program, [], max_ticks=100)
+    assert (result.ticks, result.halted) == (100, False)
+    result = machine.simulation(program, [], "functional", max_instructions=10)
+    assert (result.instructions, result.halted) == (10, False)
+
+
+def test_cli_resumes_from_snapshot(tmp_path: os.PathLike[str]) -> None:
+    source = os.path.join(tmp_path, "cat.asm")
+    target = os.path.join(tmp_path, "cat.json")
+    input_stream = os.path.join(tmp_path, "input.txt")
+    state = os.path.join(tmp_path, "state.snap")
+    with open(source, "w") as f:
+        f.write((_EXAMPLES / "cat.asm").read_text())
+    with open(input_stream, "w") as f:
+        f.write("split across two workers\n")
+    translator.main(source, target)
+
+    with contextlib.redirect_stdout(io.StringIO()) as first, contextlib.redirect_stderr(io.StringIO()):
+        machine.main(target, input_stream, max_instructions=30, snapshot_file=state)
+    with contextlib.redirect_stdout(io.StringIO()) as second:
+        machine.main(target, input_stream, resume_file=state)
+
+    assert first.getvalue() != ""
+    assert second.getvalue() != ""
+    assert first.getvalue() + second.getvalue() == "split across two workers\n"
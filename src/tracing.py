@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+import argparse
+import struct
+import sys
+from typing import BinaryIO, Final, Iterator, NamedTuple, Optional
+
+import isa
+from microcode import PROFILES
+
+TRACE_MAGIC: Final[bytes] = b"ASMT"
+TRACE_VERSION: Final[int] = 1
+FLUSH_RECORDS: Final[int] = 4096
+
+MEM_WR: Final[int] = 1
+MEM_RD: Final[int] = 2
+MEM_DEVICE: Final[int] = 4
+NO_REGISTER: Final[int] = -1
+
+_HEADER: Final[struct.Struct] = struct.Struct("<4sHB")
+_START: Final[struct.Struct] = struct.Struct(f"<Q{isa.REG_N}q")
+_RECORD: Final[struct.Struct] = struct.Struct("<QHbqBIq")
+
+_EXECUTE_PREFIX: Final[str] = "DEBUG   machine:execute_microinstruction "
+_MEM_WR_PREFIX: Final[str] = "DEBUG   machine:signal_mem_wr "
+_MEM_RD_PREFIX: Final[str] = "DEBUG   machine:signal_mem_rd "
+_DEVICE_ADDRS: Final[frozenset[int]] = frozenset(isa.PREDEFINED_LABELS.values())
+
+
+def memory_word_repr(word: int) -> str:
+    """Decoded instruction for a word with a known opcode, the number otherwise
+
+    >>> memory_word_repr(isa.encode_instruction((isa.Op.ADDI, isa.RegArg(1), isa.RegArg(0), isa.ImmArg(5))))
+    'ADDI $1 $0 5'
+    >>> memory_word_repr(isa.encode_instruction((isa.Op.HALT,)))
+    'HALT'
+    >>> memory_word_repr(65)
+    '  65'
+    """
+    if not 0 <= word <= isa.WORD_MASK or isa.op_from_code(word >> isa.OPCODE_SHIFT) is None:
+        return f"{word:4}"
+    instr = isa.decode_instruction(word)
+    args = (f"${arg.idx}" if isinstance(arg, isa.RegArg) else str(arg.val) for arg in instr[1:])
+    decoded = " ".join([instr[0].name, *args])
+    return f"{decoded:4}"
+
+
+def state_repr(tick: int, mpc: int, registers: list[int]) -> str:
+    registers_repr = ", ".join(memory_word_repr(word) for word in registers)
+    return f"tick:{tick:3} mpc:{mpc:3} regs:{registers_repr}"
+
+
+def input_repr(char: int) -> str:
+    return chr(char) if char != 0 else r"\0"
+
+
+class Record(NamedTuple):
+    tick: int
+    mpc: int
+    register: int
+    value: int
+    memory: int
+    address: int
+    data: int
+
+
+class Tracer:
+    """Records every executed microinstruction as a fixed-size binary record:
+    tick, mpc, the register it wrote with its new value, and its memory access if any.
+
+    Without `capacity` records are streamed to `stream` in batches. With `capacity` only the
+    last `capacity` records are kept in a ring and written out by `finish`. Evicted records are
+    folded into the starting register state, so a ring still decodes into exact register values.
+    Without a stream the trace stays in memory until `save`.
+    """
+
+    profile: str
+    stream: Optional[BinaryIO]
+    capacity: Optional[int]
+    _buffer: bytearray
+    _count: int
+    _first_tick: int
+    _base: list[int]
+    _pending: Optional[tuple[int, int, int, isa.MInstruction]]
+
+    def __init__(self, profile: str, stream: Optional[BinaryIO] = None, capacity: Optional[int] = None) -> None:
+        assert profile in PROFILES, f"Unknown microcode profile '{profile}'"
+        assert capacity is None or capacity > 0, "Trace ring capacity must be positive"
+        self.profile = profile
+        self.stream = stream
+        self.capacity = capacity
+        self._buffer = bytearray(_RECORD.size * capacity) if capacity is not None else bytearray()
+        self._count = 0
+        self._first_tick = 0
+        self._base = []
+        self._pending = None
+
+    def step(self, tick: int, mpc: int, minstr: isa.MInstruction, registers: list[int]) -> None:
+        """Called before `minstr` executes; completes the record of the previous microinstruction"""
+        if self._pending is not None:
+            self._emit(registers)
+        elif self._count == 0:
+            self._start(tick, registers)
+        self._pending = (tick, mpc, _target_register(minstr, registers), minstr)
+
+    def finish(self, registers: list[int]) -> None:
+        if self._pending is not None:
+            self._emit(registers)
+            self._pending = None
+        if self.stream is None:
+            return
+        if self.capacity is not None:
+            self.save(self.stream)
+        else:
+            self.stream.write(self._buffer)
+            self._buffer.clear()
+        self.stream.flush()
+
+    def save(self, out: BinaryIO) -> None:
+        assert self.stream is None or self.capacity is not None, "A streamed trace is already written out"
+        out.write(self._header(self._first_tick, self._base))
+        if self.capacity is None or self._count <= self.capacity:
+            out.write(self._buffer[: _RECORD.size * self._count])
+            return
+        split = _RECORD.size * (self._count % self.capacity)
+        out.write(self._buffer[split:])
+        out.write(self._buffer[:split])
+
+    def _start(self, tick: int, registers: list[int]) -> None:
+        self._first_tick = tick
+        self._base = registers.copy()
+        if self.stream is not None and self.capacity is None:
+            self.stream.write(self._header(tick, registers))
+
+    def _header(self, tick: int, registers: list[int]) -> bytes:
+        name = self.profile.encode()
+        return _HEADER.pack(TRACE_MAGIC, TRACE_VERSION, len(name)) + name + _START.pack(tick, *registers)
+
+    def _emit(self, registers: list[int]) -> None:
+        assert self._pending is not None
+        tick, mpc, register, minstr = self._pending
+        value = registers[register] if register != NO_REGISTER else 0
+        memory, address, data = _memory_effect(minstr, registers)
+        if self.capacity is None:
+            self._buffer += _RECORD.pack(tick, mpc, register, value, memory, address, data)
+            if self.stream is not None and self._count % FLUSH_RECORDS == FLUSH_RECORDS - 1:
+                self.stream.write(self._buffer)
+                self._buffer.clear()
+        else:
+            offset = _RECORD.size * (self._count % self.capacity)
+            if self._count >= self.capacity:
+                _apply(Record._make(_RECORD.unpack_from(self._buffer, offset)), self._base)
+                self._first_tick += 1
+            _RECORD.pack_into(self._buffer, offset, tick, mpc, register, value, memory, address, data)
+        self._count += 1
+
+
+def _target_register(minstr: isa.MInstruction, registers: list[int]) -> int:
+    if isinstance(minstr, isa.MIJump):
+        return NO_REGISTER
+    reg = minstr.rwr_sel
+    if reg == isa.IND_AR:
+        reg = registers[isa.AR] & isa.IND_AR_MASK
+    return reg if reg != 0 else NO_REGISTER
+
+
+def _memory_effect(minstr: isa.MInstruction, registers: list[int]) -> tuple[int, int, int]:
+    if isinstance(minstr, isa.MIJump) or not (minstr.mem_wr or minstr.mem_rd):
+        return (0, 0, 0)
+    address = registers[isa.AR]
+    memory = MEM_WR if minstr.mem_wr else MEM_RD
+    if address in _DEVICE_ADDRS:
+        memory |= MEM_DEVICE
+    return (memory, address, registers[isa.DR])
+
+
+def _apply(record: Record, registers: list[int]) -> None:
+    if record.register != NO_REGISTER:
+        registers[record.register] = record.value
+    if record.memory & MEM_RD:
+        registers[isa.DR] = record.data
+
+
+class Trace(NamedTuple):
+    profile: str
+    first_tick: int
+    registers: list[int]
+    records: Iterator[Record]
+
+
+def read_trace(data: bytes) -> Trace:
+    magic, version, name_len = _HEADER.unpack_from(data)
+    assert magic == TRACE_MAGIC, "Not a trace file"
+    assert version == TRACE_VERSION, f"Unsupported trace version {version}"
+    offset = _HEADER.size
+    profile = data[offset : offset + name_len].decode()
+    first_tick, *registers = _START.unpack_from(data, offset + name_len)
+    offset += name_len + _START.size
+    assert (len(data) - offset) % _RECORD.size == 0, "Truncated trace file"
+    records = (Record._make(fields) for fields in _RECORD.iter_unpack(data[offset:]))
+    return Trace(profile, first_tick, registers, records)
+
+
+def render(data: bytes) -> Iterator[str]:
+    """Renders a trace as the lines `machine` logs at the DEBUG level"""
+    trace = read_trace(data)
+    microcode = PROFILES[trace.profile]
+    registers = trace.registers
+    for record in trace.records:
+        yield f"{_EXECUTE_PREFIX}executing: {microcode[record.mpc]}"
+        yield f"{_EXECUTE_PREFIX}control_unit: {state_repr(record.tick, record.mpc, registers)}"
+        _apply(record, registers)
+        if record.memory == MEM_WR | MEM_DEVICE and record.address == isa.OUTPUT_DEVICE_ADDR:
+            yield f"{_MEM_WR_PREFIX}output: {chr(record.data & 0xFF)}"
+        if record.memory == MEM_RD | MEM_DEVICE and record.address == isa.INPUT_DEVICE_ADDR:
+            yield f"{_MEM_RD_PREFIX}input: {input_repr(record.data)}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render a binary machine trace as text")
+    parser.add_argument("trace_file")
+    args = parser.parse_args()
+    with open(args.trace_file, "rb") as f:
+        content = f.read()
+    for line in render(content):
+        sys.stdout.write(line + "\n")
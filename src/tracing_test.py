@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+import io
+
+import pytest
+import pytest_golden  # type: ignore[import-untyped]
+
+import devices
+import machine
+import tracing
+import translator
+
+
+def _traced_run(source: str, stdin: str, tracer: tracing.Tracer) -> None:
+    program = translator.parse(source)
+    input_device = devices.BufferInput([ord(c) for c in stdin] + [0])
+    machine.simulate(program, input_device, devices.BufferOutput(), tracer=tracer)
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_trace_renders_debug_log(golden: pytest_golden.plugin.GoldenTestFixture) -> None:
+    out = io.BytesIO()
+    _traced_run(golden["in_source"], golden["in_stdin"], tracing.Tracer("classic", out))
+
+    assert "".join(line + "\n" for line in tracing.render(out.getvalue())) == golden.out["out_log"]
+
+
+def test_ring_keeps_last_records() -> None:
+    source = 'hello: "Hi\\0"\nstart: lw $1, $0, hello\n sw $1, $0, output\n halt\n'
+    full = tracing.Tracer("classic")
+    ring = tracing.Tracer("classic", capacity=10)
+    _traced_run(source, "", full)
+    _traced_run(source, "", ring)
+    full_out, ring_out = io.BytesIO(), io.BytesIO()
+    full.save(full_out)
+    ring.save(ring_out)
+
+    full_lines = list(tracing.render(full_out.getvalue()))
+    ring_lines = list(tracing.render(ring_out.getvalue()))
+    assert len(list(tracing.read_trace(ring_out.getvalue()).records)) == 10
+    assert ring_lines == full_lines[-len(ring_lines) :]
+    assert "executing:" in ring_lines[0]
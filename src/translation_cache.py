@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import contextlib
+import fcntl
+import hashlib
+import io
+import os
+import pathlib
+import tempfile
+from typing import Final, Iterator, Optional
+
+import isa
+
+CACHE_VERSION: Final[int] = 1
+DEFAULT_MAX_BYTES: Final[int] = 64 * 1024 * 1024
+_ENCODER_SOURCES: Final[tuple[str, ...]] = ("isa.py", "lexer.py", "optimizer.py", "translator.py")
+_ENTRY_SUFFIX: Final[str] = ".json"
+
+
+def default_directory() -> pathlib.Path:
+    if "ASM_SIM_CACHE_DIR" in os.environ:
+        return pathlib.Path(os.environ["ASM_SIM_CACHE_DIR"])
+    base = os.environ.get("XDG_CACHE_HOME") or pathlib.Path.home() / ".cache"
+    return pathlib.Path(base) / "asm-sim"
+
+
+def encoder_version() -> str:
+    """Hash of the modules that define the translation, so any change to them invalidates old entries"""
+    digest = hashlib.sha256(f"{CACHE_VERSION}:{isa.OBJECT_VERSION}".encode())
+    for name in _ENCODER_SOURCES:
+        digest.update((pathlib.Path(__file__).parent / name).read_bytes())
+    return digest.hexdigest()
+
+
+class TranslationCache:
+    """Translated programs stored as JSON files named by the hash of their source.
+
+    Entries are published with an atomic rename, so concurrent readers either see a whole
+    entry or none. Hits refresh the file's mtime, and once the directory grows past
+    `max_bytes` the least recently used entries are removed under an exclusive `flock`.
+    """
+
+    directory: pathlib.Path
+    max_bytes: int
+    _version: str
+
+    def __init__(self, directory: Optional[pathlib.Path] = None, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        self.directory = directory if directory is not None else default_directory()
+        self.max_bytes = max_bytes
+        self._version = encoder_version()
+
+    def key(self, source: str, variant: str = "") -> str:
+        """`variant` tells apart translations of the same source with different options"""
+        return hashlib.sha256(self._version.encode() + b"\0" + variant.encode() + b"\0" + source.encode()).hexdigest()
+
+    def get(self, source: str, variant: str = "") -> Optional[isa.Program]:
+        path = self._entry(source, variant)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return isa.read_program(io.StringIO(data.decode()))
+
+    def put(self, source: str, program: isa.Program, variant: str = "") -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        out = io.StringIO()
+        isa.write_program(program, out)
+        with tempfile.NamedTemporaryFile("w", dir=self.directory, prefix=".", suffix=".tmp", delete=False) as f:
+            f.write(out.getvalue())
+        pathlib.Path(f.name).replace(self._entry(source, variant))
+        self._evict()
+
+    def clear(self) -> None:
+        if not self.directory.exists():
+            return
+        with self._locked():
+            for path in self._entries():
+                path.unlink(missing_ok=True)
+
+    def size(self) -> int:
+        return sum(_stat_size(path) for path in self._entries())
+
+    def _entry(self, source: str, variant: str) -> pathlib.Path:
+        return self.directory / (self.key(source, variant) + _ENTRY_SUFFIX)
+
+    def _entries(self) -> list[pathlib.Path]:
+        return list(self.directory.glob("*" + _ENTRY_SUFFIX))
+
+    def _evict(self) -> None:
+        with self._locked():
+            stats = []
+            for path in self._entries():
+                with contextlib.suppress(FileNotFoundError):
+                    stats.append((path.stat(), path))
+            total = sum(stat.st_size for stat, _ in stats)
+            for stat, path in sorted(stats, key=lambda entry: entry[0].st_mtime_ns):
+                if total <= self.max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total -= stat.st_size
+
+    @contextlib.contextmanager
+    def _locked(self) -> Iterator[None]:
+        with open(self.directory / ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _stat_size(path: pathlib.Path) -> int:
+    try:
+        return path.stat().st_size
+    except FileNotFoundError:
+        return 0
@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import concurrent.futures
+import os
+import pathlib
+
+import translation_cache
+import translator
+
+_SOURCE = (pathlib.Path(__file__).parent.parent / "examples" / "hello.asm").read_text()
+
+
+def test_hit_returns_stored_program(tmp_path: pathlib.Path) -> None:
+    cache = translation_cache.TranslationCache(tmp_path)
+
+    assert cache.get(_SOURCE) is None
+    program = translator.parse_cached(_SOURCE, cache)
+    assert cache.get(_SOURCE) == program == translator.parse(_SOURCE)
+    assert cache.get(_SOURCE + "\n") is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path: pathlib.Path) -> None:
+    sources = [_SOURCE + "\n" * n for n in range(3)]
+    cache = translation_cache.TranslationCache(tmp_path)
+    for n, source in enumerate(sources):
+        cache.put(source, translator.parse(source))
+        os.utime(cache.directory / (cache.key(source) + ".json"), ns=(n, n))
+    cache.get(sources[0])
+    cache.max_bytes = cache.size() - 1
+
+    cache.put(sources[0], translator.parse(sources[0]))
+
+    assert [cache.get(source) is not None for source in sources] == [True, False, True]
+
+
+def test_clear_removes_entries(tmp_path: pathlib.Path) -> None:
+    cache = translation_cache.TranslationCache(tmp_path)
+    cache.put(_SOURCE, translator.parse(_SOURCE))
+
+    cache.clear()
+
+    assert cache.get(_SOURCE) is None
+    assert cache.size() == 0
+
+
+def _translate(directory: pathlib.Path, n: int) -> bool:
+    cache = translation_cache.TranslationCache(directory, max_bytes=4096)
+    source = _SOURCE + "\n" * (n % 4)
+    return translator.parse_cached(source, cache) == translator.parse(source)
+
+
+def test_concurrent_processes_share_cache(tmp_path: pathlib.Path) -> None:
+    with concurrent.futures.ProcessPoolExecutor(4) as pool:
+        results = list(pool.map(_translate, [tmp_path] * 32, range(32)))
+
+    assert all(results)
+    assert translation_cache.TranslationCache(tmp_path).size() <= 4096
@@ -1,54 +1,93 @@
 from __future__ import annotations
 
-import json
-import sys
-from typing import Generator, Optional
+import argparse
+import pathlib
+from typing import Final, Generator, Optional
 
 import isa
 import lexer as lex
-
-
-def main(source: str, out_target: str) -> None:
+import optimizer
+import translation_cache
+
+
+def main(
+    source: str,
+    out_target: str,
+    *,
+    binary: bool = False,
+    optimize: bool = False,
+    cache: Optional[translation_cache.TranslationCache] = None,
+) -> None:
     with open(source) as f:
         inp = f.read()
-    program = parse(inp)
+    program = parse_cached(inp, cache, optimize=optimize)
+    if binary:
+        with open(out_target, "wb") as f:
+            isa.write_object(program, f)
+        return
     with open(out_target, "w") as f:
-        json.dump(program, f, cls=isa.ProgramEncoder)
+        isa.write_program(program, f)
+
 
+_OPS_BY_MNEMONIC: Final[dict[str, isa.Op]] = {op.name.lower(): op for op in isa.Op}
 
-def parse(inp: str) -> isa.Program:
+
+def parse(inp: str, *, optimize: bool = False) -> isa.Program:
     l = lex.Lexer.new(inp)
     tokens = l.run()
     for token in tokens:
         assert token.type != lex.TokenType.ERROR, f"Lexer error: {token.literal}"
-    labels = labels_from_tokens(tokens)
+    strings = strings_from_tokens(tokens)
+    labels = labels_from_tokens(tokens, strings)
     assert "start" in labels, "No 'start' label in the program"
-    instructions = parse_instructions(tokens, labels)
+    if optimize:
+        return optimizer.assemble(optimizer.optimize(lines_from_tokens(tokens, labels, strings)))
+    instructions = parse_instructions(tokens, labels, strings)
     return isa.Program(start=labels["start"], instructions=instructions)
 
 
-def labels_from_tokens(tokens: list[lex.Token]) -> dict[str, int]:
+def parse_cached(
+    inp: str, cache: Optional[translation_cache.TranslationCache], *, optimize: bool = False
+) -> isa.Program:
+    if cache is None:
+        return parse(inp, optimize=optimize)
+    variant = "-O" if optimize else ""
+    program = cache.get(inp, variant)
+    if program is None:
+        program = parse(inp, optimize=optimize)
+        cache.put(inp, program, variant)
+    return program
+
+
+def strings_from_tokens(tokens: list[lex.Token]) -> dict[int, list[isa.MemoryWord]]:
+    return {i: string_token_to_words(token) for i, token in enumerate(tokens) if token.type == lex.TokenType.STR}
+
+
+def labels_from_tokens(tokens: list[lex.Token], strings: dict[int, list[isa.MemoryWord]]) -> dict[str, int]:
     labels = isa.PREDEFINED_LABELS.copy()
-    for pc, token in tokens_with_pc(tokens):
+    for pc, token in tokens_with_pc(tokens, strings):
         if token.type == lex.TokenType.LABEL:
             labels[token.literal] = pc
     return labels
 
 
-def parse_instructions(tokens: list[lex.Token], labels: dict[str, int]) -> list[isa.MemoryWord]:
+def parse_instructions(
+    tokens: list[lex.Token], labels: dict[str, int], strings: dict[int, list[isa.MemoryWord]]
+) -> list[isa.MemoryWord]:
     program: list[isa.MemoryWord] = []
-    while len(tokens) > 0:
-        token = tokens.pop(0)
-        if token.type in [lex.TokenType.LABEL, lex.TokenType.EOF]:
+    pos = 0
+    while pos < len(tokens):
+        token = tokens[pos]
+        pos += 1
+        if token.type in (lex.TokenType.LABEL, lex.TokenType.EOF):
             continue
         if token.type == lex.TokenType.STR:
-            words = string_token_to_words(token)
-            program.extend(words)
+            program.extend(strings[pos - 1])
             continue
         if token.type == lex.TokenType.OP:
             op = op_from_token(token)
             assert op is not None, f"Unknown op '{token.literal}'"
-            args, tokens = arguments_from_tokens(tokens, labels)
+            args, pos = arguments_from_tokens(tokens, pos, labels)
             instruction = isa.instruction_from_args(op, args)
             program.append(instruction)
             continue
@@ -56,34 +95,72 @@ def parse_instructions(tokens: list[lex.Token], labels: dict[str, int]) -> list[
     return program
 
 
+def lines_from_tokens(
+    tokens: list[lex.Token], labels: dict[str, int], strings: dict[int, list[isa.MemoryWord]]
+) -> list[optimizer.Line]:
+    """The program as `optimizer.Line`s, with label arguments kept by name"""
+    lines: list[optimizer.Line] = []
+    pending: list[str] = []
+    pos = 0
+    while pos < len(tokens):
+        token = tokens[pos]
+        pos += 1
+        if token.type == lex.TokenType.LABEL:
+            pending.append(token.literal)
+        elif token.type == lex.TokenType.STR:
+            for word in strings[pos - 1]:
+                assert isinstance(word, int)
+                lines.append(optimizer.Line(tuple(pending), word))
+                pending.clear()
+        elif token.type == lex.TokenType.OP:
+            op = op_from_token(token)
+            assert op is not None, f"Unknown op '{token.literal}'"
+            args, end = arguments_from_tokens(tokens, pos, labels)
+            isa.instruction_from_args(op, args)  # checks the arguments the same way as `parse_instructions`
+            symbolic = [_symbolic_argument(arg, tokens[i]) for i, arg in enumerate(args, pos)]
+            lines.append(optimizer.Line(tuple(pending), optimizer.Code(op, tuple(symbolic))))
+            pending.clear()
+            pos = end
+        else:
+            assert token.type == lex.TokenType.EOF, f"Expected label, string, op or EOF, but got {token}"
+    if len(pending) > 0:
+        lines.append(optimizer.Line(tuple(pending), None))
+    return lines
+
+
+def _symbolic_argument(arg: isa.ImmArg | isa.RegArg, token: lex.Token) -> optimizer.Arg:
+    return optimizer.LabelArg(token.literal) if token.type == lex.TokenType.ARG_LABEL else arg
+
+
 def tokens_with_pc(
-    tokens: list[lex.Token],
+    tokens: list[lex.Token], strings: dict[int, list[isa.MemoryWord]]
 ) -> Generator[tuple[int, lex.Token], None, None]:
     pc = isa.ORIGIN
-    for token in tokens:
+    for i, token in enumerate(tokens):
         yield (pc, token)
         if token.type == lex.TokenType.OP:
             pc += 1
         if token.type == lex.TokenType.STR:
-            pc += len(string_token_to_words(token))
+            pc += len(strings[i])
 
 
 def string_token_to_words(token: lex.Token) -> list[isa.MemoryWord]:
     assert token.type == lex.TokenType.STR
-    words: list[isa.MemoryWord] = []
     escaped = token.literal[1:-1].encode("raw_unicode_escape").decode("unicode_escape")
-    for i in range(0, len(escaped)):
-        char = ord(escaped[i])
-        assert char <= 255, "Only ASCII characters in string literals"
-        words.append(char)
+    words: list[isa.MemoryWord] = []
+    for char in escaped:
+        code = ord(char)
+        assert code <= 255, "Only ASCII characters in string literals"
+        words.append(code)
     return words
 
 
 def arguments_from_tokens(
-    tokens: list[lex.Token], labels: dict[str, int]
-) -> tuple[list[isa.ImmArg | isa.RegArg], list[lex.Token]]:
+    tokens: list[lex.Token], pos: int, labels: dict[str, int]
+) -> tuple[list[isa.ImmArg | isa.RegArg], int]:
     args: list[isa.ImmArg | isa.RegArg] = []
-    for token in tokens:
+    while pos + len(args) < len(tokens):
+        token = tokens[pos + len(args)]
         if token.type == lex.TokenType.ARG_LABEL:
             assert token.literal in labels, f"Label '{token.literal}' is used, but not declared"
             addr = labels[token.literal]
@@ -94,18 +171,29 @@ def arguments_from_tokens(
             args.append(isa.RegArg(idx))
         elif token.type == lex.TokenType.ARG_UINT:
             num = int(token.literal)
-            assert num < 2**32, f"Immediate values can be up to 2^32 ({2**32}), but {num} was used"
+            assert num <= isa.IMM_MASK, f"Immediate values can be up to {isa.IMM_MASK}, but {num} was used"
             args.append(isa.ImmArg(num))
         else:
             break
-    return (args, tokens[len(args) :])
+    return (args, pos + len(args))
 
 
 def op_from_token(token: lex.Token) -> Optional[isa.Op]:
     assert token.type == lex.TokenType.OP
-    return next((op for op in isa.Op if op.name.lower() == token.literal), None)
+    return _OPS_BY_MNEMONIC.get(token.literal)
 
 
 if __name__ == "__main__":
-    assert len(sys.argv) == 3
-    main(sys.argv[1], sys.argv[2])
+    parser = argparse.ArgumentParser(description="Translate assembly source into machine code")
+    parser.add_argument("source")
+    parser.add_argument("target")
+    parser.add_argument("--binary", action="store_true", help="write a binary object file instead of JSON")
+    parser.add_argument("-O", dest="optimize", action="store_true", help="run the optimizer over the program")
+    parser.add_argument("--no-cache", action="store_true", help="translate without reading or writing the cache")
+    parser.add_argument("--clear-cache", action="store_true", help="remove all cached translations first")
+    parser.add_argument("--cache-dir", type=pathlib.Path, help="cache directory, '~/.cache/asm-sim' by default")
+    args = parser.parse_args()
+    cache = translation_cache.TranslationCache(args.cache_dir)
+    if args.clear_cache:
+        cache.clear()
+    main(args.source, args.target, binary=args.binary, optimize=args.optimize, cache=None if args.no_cache else cache)